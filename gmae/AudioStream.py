@@ -1,10 +1,19 @@
+from time import perf_counter
+
+import numpy as np
 import sounddevice as sd
 
+from gmae.audio_effects import AudioEffectsChain, AudioEffectParams
+
 
 class AudioStream:
     def __init__(self, args, name):
         self.input_device, self.output_device = \
             self.find_corresponding_sound_devices(name, args.audio_out)
+        self.effects = None
+        self.int_scale = None
+        # whether the flashes of the video effects glitch the audio, too
+        self.glitch = args.audio_glitch
         self.stream = self.create_stream()
         self.mute = args.mute
         if self.stream is not None:
@@ -17,6 +26,9 @@ class AudioStream:
         return self
 
     def __exit__(self, _type, _val, _tb):
+        self.close()
+
+    def close(self):
         if self.stream is None:
             return
         self.stream.stop()
@@ -34,6 +46,11 @@ class AudioStream:
         for key, value in params.items():
             if key != "callback":
                 print(f"  {key}: {value}")
+        # needs to exist before the first callback
+        self.effects = AudioEffectsChain(int(params['samplerate']), params['channels'])
+        dtype = np.dtype(params['dtype'])
+        if dtype.kind in "iu":
+            self.int_scale = float(np.iinfo(dtype).max + 1)
         return sd.Stream(**params)
 
     @staticmethod
@@ -58,6 +75,7 @@ class AudioStream:
             device
             for device in all_devices
             if device['max_input_channels'] > 0
+            and input_name is not None
             and input_name in device['name']
         ), None)
         output_devices = [
@@ -96,14 +114,35 @@ class AudioStream:
             'callback': callback
         }
 
-    def play_thru(self, indata, outdata, _frames, time, _status):
+    def play_thru(self, indata, outdata, frames, time, status):
+        started_at = perf_counter()
         if self.first_timestamp is None:
             self.first_timestamp = time.currentTime
         # don't need for now. anyway.
         # elapsed_sec = time.currentTime - self.first_timestamp
-        gain = 0 if self.mute else 1
-        outdata[:] = gain * indata
+        if self.mute:
+            outdata.fill(0)
+        elif self.int_scale is None:
+            outdata[:] = self.effects.process(indata)
+        else:
+            processed = self.effects.process(indata, scale=1 / self.int_scale)
+            np.multiply(processed, self.int_scale, out=processed)
+            np.clip(processed, -self.int_scale, self.int_scale - 1, out=processed)
+            outdata[:] = processed
         self.max_amplitude_since_unmuting = abs(indata.max())
+        self.effects.timing.record(perf_counter() - started_at, frames / self.effects.samplerate, status)
+
+    def set_effect_amounts(self, amounts: dict):
+        # called from the render thread. the callback picks up the whole new object on its next block.
+        if self.effects is not None and self.glitch:
+            self.effects.params = AudioEffectParams.from_effect_amounts(amounts, self.effects.params)
+
+    def trigger_tape_stop(self, duration_sec=None):
+        if self.effects is not None:
+            self.effects.params = self.effects.params.with_tape_stop(duration_sec)
+
+    def callback_summary(self):
+        return {} if self.effects is None else self.effects.timing.summary()
 
     def toggle_mute(self):
         self.mute = not self.mute
@@ -115,3 +154,6 @@ class AudioStream:
         print("Audio Output Device", self.output_device)
         muted_info = " [MUTED]" if self.mute else ""
         print("Max Amplitude:", self.max_amplitude_since_unmuting, muted_info)
+        if self.effects is not None:
+            print("Audio Effects:", self.effects.params if self.glitch else "no glitches (--audio-glitch)")
+            self.effects.timing.print_debug()
@@ -2,12 +2,23 @@ import argparse
 from os import getenv
 from platform import system
 
-import cv2
+import OpenGL
+
+from gmae.utils import env_means_true
+
+# PyOpenGL checks glGetError() after every single call, which costs more than most of the calls themselves.
+# but that is also what finds our GL bugs, so it's only off for the show (GMAE_SHOW=1), or with
+# GMAE_GL_ERROR_CHECKING=0. has to be set before anything imports OpenGL.GL, hence no command line argument.
+if getenv('GMAE_GL_ERROR_CHECKING'):
+    OpenGL.ERROR_CHECKING = env_means_true('GMAE_GL_ERROR_CHECKING')
+else:
+    OpenGL.ERROR_CHECKING = not env_means_true('GMAE_SHOW')
 
 from gmae.find_video_captures import find_capture_device_name_with_index
-from gmae.AudioStream import AudioStream
+from gmae.frame_interpolation import InterpolationQuality
 from gmae.processor import Processor
-from gmae.utils import log, env_means_true
+from gmae.processor_utils import MotionMode
+from gmae.startup import Startup
 
 
 def parse_args():
@@ -15,8 +26,8 @@ def parse_args():
     parser.add_argument("--index",
                         "-i",
                         type=int,
-                        default=getenv('GMAE_CAPTURE_INDEX', 0),
-                        help="OpenCV Index of the Video Capture Device"
+                        default=getenv('GMAE_CAPTURE_INDEX'),
+                        help="OpenCV Index of the Video Capture Device (default: the found one on Linux, 0 on Windows)"
                         )
     parser.add_argument("--fullscreen",
                         "-f",
@@ -30,32 +41,147 @@ def parse_args():
                         default=getenv('GMAE_MONITOR', -1),
                         help="Which monitor number to launch the shit (default is the last one)"
                         )
+    parser.add_argument("--audio-in",
+                        type=str,
+                        default=getenv('GMAE_AUDIO_INPUT'),
+                        help="A (partial) string to identify the audio input (default: the capture device, "
+                             "no audio on --replay)"
+                        )
     parser.add_argument("--audio-out",
                         "-audio",
                         type=str,
                         default=getenv('GMAE_AUDIO_OUTPUT', ''),
                         help="A (partial) string to identify the audio output, it will take the first that matches"
                         )
+    parser.add_argument("--audio-glitch",
+                        type=bool,
+                        default=env_means_true('GMAE_AUDIO_GLITCH'),
+                        help="Let the effect flashes glitch the audio as well (stutter, bitcrush, filter etc.)"
+                        )
     parser.add_argument("--mute",
                         type=bool,
                         default=env_means_true('GMAE_MUTE'),
                         help="Whether to start in full screen"
                         )
+    parser.add_argument("--record",
+                        type=str,
+                        default=getenv('GMAE_RECORD', ''),
+                        help="Record the raw frames (plus inputs and effect states) to this frame store file"
+                        )
+    parser.add_argument("--replay",
+                        type=str,
+                        default=getenv('GMAE_REPLAY', ''),
+                        help="Replay a recorded frame store file instead of reading the capture device"
+                        )
+    parser.add_argument("--replay-fast",
+                        type=bool,
+                        default=env_means_true('GMAE_REPLAY_FAST'),
+                        help="Replay as fast as possible instead of at the original timing"
+                        )
+    parser.add_argument("--analytic-noise",
+                        type=bool,
+                        default=env_means_true('GMAE_ANALYTIC_NOISE'),
+                        help="Start with the analytic noise / dithering in the shader instead of the lookup textures (toggle with F6)"
+                        )
+    parser.add_argument("--preprocess",
+                        type=str,
+                        default=getenv('GMAE_PREPROCESS'),
+                        help="CPU preprocessing of the live capture, comma separated, from: "
+                             "deinterlace, denoise[=strength], crop=left/top/right/bottom, letterbox[=threshold], "
+                             "undistort[=k1]"
+                        )
+    parser.add_argument("--preprocess-workers",
+                        type=int,
+                        default=getenv('GMAE_PREPROCESS_WORKERS', 2),
+                        help="How many processes do the preprocessing"
+                        )
+    parser.add_argument("--analytic-colors",
+                        type=bool,
+                        default=env_means_true('GMAE_ANALYTIC_COLORS'),
+                        help="Start with the per-pixel color effects instead of the baked color LUT (toggle with F3)"
+                        )
+    parser.add_argument("--uncached-gl",
+                        type=bool,
+                        default=env_means_true('GMAE_UNCACHED_GL'),
+                        help="Issue every GL state call every frame, only to compare the GL call counts (see F1)"
+                        )
+    parser.add_argument("--grading-lut",
+                        type=str,
+                        default=getenv('GMAE_GRADING_LUT'),
+                        help="A .cube 3D LUT file for color grading the wet output"
+                        )
+    parser.add_argument("--auto-levels",
+                        type=bool,
+                        default=env_means_true('GMAE_AUTO_LEVELS'),
+                        help="Start with the GPU auto levels / exposure normalization of the input (toggle with F7)"
+                        )
+    parser.add_argument("--motion-mode",
+                        choices=[mode.value for mode in MotionMode],
+                        default=getenv('GMAE_MOTION_MODE', MotionMode.OFF.value),
+                        help="Let the motion in the picture modulate the effect flashes or trigger them (cycle with F10)"
+                        )
+    parser.add_argument("--interpolation",
+                        choices=[quality.value for quality in InterpolationQuality],
+                        default=getenv('GMAE_INTERPOLATION', InterpolationQuality.OFF.value),
+                        help="Interpolate between the captured frames up to the display rate, "
+                             "by blending or along the motion (cycle with I)"
+                        )
+    parser.add_argument("--history",
+                        type=int,
+                        default=getenv('GMAE_HISTORY_DEPTH', 0),
+                        help="How many frames to keep on the GPU for temporal effects (0 = none)"
+                        )
+    parser.add_argument("--history-source",
+                        type=str,
+                        choices=["captured", "processed"],
+                        default=getenv('GMAE_HISTORY_SOURCE', "captured"),
+                        help="Keep the captured frames, or the processed output (for feedback effects)"
+                        )
+    parser.add_argument("--remote-port",
+                        type=int,
+                        default=getenv('GMAE_REMOTE_PORT', 0),
+                        help="Port for the remote control / telemetry HTTP server (0 = off)"
+                        )
+    parser.add_argument("--remote-host",
+                        type=str,
+                        default=getenv('GMAE_REMOTE_HOST', '127.0.0.1'),
+                        help="Where the remote control listens, 0.0.0.0 to allow other machines"
+                        )
     return parser.parse_args()
 
 
+def find_devices(args):
+    if args.replay:
+        # the Processor takes the original device name from the frame store
+        return "", None
+    return find_capture_device_name_with_index()
+
+
+def start_audio_stream(args, device_future):
+    # sounddevice takes a while to import, so that also happens on the startup thread
+    from gmae.AudioStream import AudioStream
+    name, _index = device_future.result()
+    if args.audio_in:
+        name = args.audio_in
+    elif args.replay:
+        # the empty name would just match the first input there is, which is hardly ever the right one
+        print("Replay without audio, choose an input with --audio-in")
+        name = None
+    return AudioStream(args, name)
+
+
 if __name__ == '__main__':
-    print("CV2 version", cv2.__version__)
-    if system() != "Windows":
-        raise OSError("Windows has won the game for now, sorry!")
+    if system() not in ["Windows", "Linux"]:
+        raise OSError("Windows and Linux have won the game for now, sorry!")
 
     args = parse_args()
+    print("OpenGL Error Checking?", OpenGL.ERROR_CHECKING)
 
-    log("Find Devices")
-    name, index_ = find_capture_device_name_with_index()
+    with Startup() as startup:
+        # everything that doesn't need the GL context runs while the window is created and the shaders compile
+        device_future = startup.background("Find Devices", find_devices, args)
+        capture_future = startup.background("Open Capture", Processor.open_capture, args, device_future)
+        audio_future = startup.background("Start Audio Stream", start_audio_stream, args, device_future)
 
-    log("Start Audio Stream")
-    with AudioStream(args, name) as audio:
-        log("Start Video Processor")
-        with Processor(args, name, audio) as processor:
+        with Processor(args, capture_future, audio_future, startup) as processor:
             processor.run()
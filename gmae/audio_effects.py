@@ -0,0 +1,398 @@
+"""
+Audio glitch effects, to go with the video ones: tape stop, stutter, sample rate reduction, bitcrush, filter sweep.
+
+The flash-driven stages only come in when their video effect flashes above GLITCH_THRESHOLD, and they follow it
+with an attack / release envelope (per block), so nothing clicks in or out. The tape stop is only ever triggered,
+and crossfades back into the live audio over its last TAPE_STOP_CROSSFADE_SEC.
+
+All of this runs inside the PortAudio callback, so: every buffer is allocated up front, everything is
+vectorized over the whole block, and the parameters are one immutable object that the render thread
+replaces as a whole (the callback takes the reference once per block, so it never sees half an update).
+The time every callback takes is recorded, to see how close we get to xruns.
+
+Offline, without any audio device:
+    python -m gmae.audio_effects input.wav output.wav --bitcrush 0.8 --filter 0.5 --tape-stop-at 2
+"""
+
+import argparse
+import wave
+from dataclasses import dataclass
+from math import exp
+from time import perf_counter
+
+import numpy as np
+
+from gmae.processor_utils import EffectId
+
+# blocksize=0 lets PortAudio choose, which is usually way below this. if not, the buffers grow once.
+MAX_BLOCK_FRAMES = 4096
+HISTORY_SEC = 4.
+STUTTER_SLICE_SEC = 0.25
+MIN_STUTTER_SLICE_SEC = 0.03
+# then a fresh slice gets grabbed, otherwise one slice would loop for the whole flash
+STUTTER_REPEATS = 8
+MAX_SAMPLE_HOLD = 32
+MIN_BITS = 3
+FILTER_TAPS = 63
+MIN_CUTOFF_HZ = 200.
+# the kernels for that many cutoffs are computed up front, not in the callback
+FILTER_STEPS = 64
+# below that amount of its video effect, a stage stays out completely, above it takes the rest of the range
+GLITCH_THRESHOLD = 0.5
+ENVELOPE_ATTACK_SEC = 0.05
+ENVELOPE_RELEASE_SEC = 0.3
+# the stopped tape holds some sample value, jumping from there back to the live audio would click
+TAPE_STOP_CROSSFADE_SEC = 0.05
+GLITCH_STAGES = ("stutter", "downsample", "bitcrush", "filter_sweep")
+TIMING_WINDOW = 512
+# a callback taking more than this fraction of its block duration is considered dangerous
+CALLBACK_BUDGET_FRACTION = 0.5
+
+
+@dataclass(frozen=True)
+class AudioEffectParams:
+    bitcrush: float = 0.
+    downsample: float = 0.
+    stutter: float = 0.
+    filter_sweep: float = 0.
+    tape_stop_serial: int = 0
+    tape_stop_sec: float = 1.
+
+    @classmethod
+    def from_effect_amounts(cls, amounts: dict, previous: "AudioEffectParams" = None):
+        # the audio mirrors the peaks of the flash envelopes of the video effects
+        previous = previous or cls()
+
+        def engaged(effect_id):
+            return max(amounts.get(effect_id, 0) - GLITCH_THRESHOLD, 0) / (1 - GLITCH_THRESHOLD)
+
+        return cls(
+            bitcrush=engaged(EffectId.D),
+            downsample=engaged(EffectId.C),
+            stutter=engaged(EffectId.A),
+            filter_sweep=engaged(EffectId.B),
+            tape_stop_serial=previous.tape_stop_serial,
+            tape_stop_sec=previous.tape_stop_sec,
+        )
+
+    def with_tape_stop(self, duration_sec=None):
+        return AudioEffectParams(
+            bitcrush=self.bitcrush,
+            downsample=self.downsample,
+            stutter=self.stutter,
+            filter_sweep=self.filter_sweep,
+            tape_stop_serial=self.tape_stop_serial + 1,
+            tape_stop_sec=duration_sec or self.tape_stop_sec,
+        )
+
+
+class CallbackTiming:
+    def __init__(self, window=TIMING_WINDOW):
+        self.durations_sec = np.zeros(window)
+        self.loads = np.zeros(window)
+        self.count = 0
+        self.over_budget = 0
+        self.xruns = 0
+
+    def record(self, duration_sec, block_sec, status=None):
+        index = self.count % len(self.durations_sec)
+        self.durations_sec[index] = duration_sec
+        load = duration_sec / block_sec if block_sec > 0 else 0
+        self.loads[index] = load
+        self.count += 1
+        if load > CALLBACK_BUDGET_FRACTION:
+            self.over_budget += 1
+        if status:
+            # PortAudio tells us about actual under- / overflows
+            self.xruns += 1
+
+    def summary(self):
+        filled = min(self.count, len(self.durations_sec))
+        if filled == 0:
+            return {"callbacks": 0}
+        return {
+            "callbacks": self.count,
+            "mean_ms": 1000 * self.durations_sec[:filled].mean(),
+            "max_ms": 1000 * self.durations_sec[:filled].max(),
+            "mean_load": self.loads[:filled].mean(),
+            "max_load": self.loads[:filled].max(),
+            "over_budget": self.over_budget,
+            "xruns": self.xruns,
+        }
+
+    def print_debug(self):
+        summary = self.summary()
+        if summary["callbacks"] == 0:
+            print("Audio Callback: none yet")
+            return
+        print(f"Audio Callback: {summary['mean_ms']:.3f} ms mean, {summary['max_ms']:.3f} ms max,",
+              f"load {100 * summary['mean_load']:.1f}% mean / {100 * summary['max_load']:.1f}% max,",
+              f"{summary['over_budget']} over budget, {summary['xruns']} xruns")
+
+
+def lowpass_kernel(cutoff_hz, samplerate, taps=FILTER_TAPS):
+    # windowed sinc, normalized to unity gain
+    n = np.arange(taps) - (taps - 1) / 2
+    kernel = np.sinc(2 * cutoff_hz / samplerate * n) * np.blackman(taps)
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+def filter_sweep_kernels(samplerate, steps=FILTER_STEPS):
+    # row i is for the sweep amount i / (steps - 1), already reversed for the matmul in the callback
+    nyquist = samplerate / 2
+    cutoffs = nyquist * (MIN_CUTOFF_HZ / nyquist) ** np.linspace(0, 1, steps)
+    kernels = np.stack([lowpass_kernel(cutoff, samplerate)[::-1] for cutoff in cutoffs])
+    return np.ascontiguousarray(kernels)
+
+
+class AudioEffectsChain:
+    def __init__(self, samplerate, channels, max_block=MAX_BLOCK_FRAMES):
+        self.samplerate = samplerate
+        self.channels = channels
+        self.params = AudioEffectParams()
+        self.timing = CallbackTiming()
+
+        self.history = np.zeros((int(HISTORY_SEC * samplerate), channels), dtype=np.float32)
+        # absolute number of frames that went into the history so far
+        self.written = 0
+
+        self.tape_stop_serial = 0
+        self.tape_stop_start = None
+        self.stutter_start = None
+        self.stutter_frames = 0
+        self.stutter_phase = 0
+        self.stutter_repeats = 0
+        self.kernels = filter_sweep_kernels(samplerate)
+        # what the stages actually use, the params following the envelope
+        self.levels = dict.fromkeys(GLITCH_STAGES, 0.)
+        self._allocate(max_block)
+
+    def _allocate(self, max_block):
+        self.max_block = max_block
+        self.work = np.zeros((max_block, self.channels), dtype=np.float32)
+        self.other = np.zeros((max_block, self.channels), dtype=np.float32)
+        self.live = np.zeros((max_block, self.channels), dtype=np.float32)
+        self.weights = np.zeros((max_block, 1), dtype=np.float32)
+        self.positions = np.zeros(max_block, dtype=np.float64)
+        self.read_index = np.zeros(max_block, dtype=np.int64)
+        self.steps = np.arange(max_block, dtype=np.int64)
+        self.filter_input = np.zeros((max_block + FILTER_TAPS - 1, self.channels), dtype=np.float32)
+
+    def process(self, block: np.ndarray, scale=1.):
+        """
+        Takes samples (frames x channels), returns a view of the effected float samples (same shape).
+        Integer samples need a scale to get them into [-1, 1]. The view stays valid until the next call.
+        """
+        frames = len(block)
+        if frames > self.max_block:
+            self._allocate(frames)
+        params = self.params
+
+        out = self.work[:frames]
+        if scale == 1:
+            out[:] = block
+        else:
+            np.multiply(block, scale, out=out)
+        self._write_history(out)
+        self._follow_envelope(params, frames / self.samplerate)
+        levels = self.levels
+
+        self._tape_stop(out, params)
+        self._stutter(out, levels["stutter"])
+        self._downsample(out, levels["downsample"])
+        self._bitcrush(out, levels["bitcrush"])
+        self._filter_sweep(out, levels["filter_sweep"])
+        return out
+
+    def _follow_envelope(self, params, block_sec):
+        for stage in GLITCH_STAGES:
+            target = getattr(params, stage)
+            level = self.levels[stage]
+            time_constant = ENVELOPE_ATTACK_SEC if target > level else ENVELOPE_RELEASE_SEC
+            level += (target - level) * (1 - exp(-block_sec / time_constant))
+            # the release would never quite reach zero
+            self.levels[stage] = level if level > 1e-3 or target > 0 else 0.
+
+    def _write_history(self, block):
+        size = len(self.history)
+        start = self.written % size
+        first = min(len(block), size - start)
+        self.history[start:start + first] = block[:first]
+        self.history[:len(block) - first] = block[first:]
+        self.written += len(block)
+
+    def _read_history(self, absolute_index, out):
+        # absolute_index: int array of frames, already available in the history
+        np.remainder(absolute_index, len(self.history), out=absolute_index)
+        np.take(self.history, absolute_index, axis=0, out=out)
+
+    def _tape_stop(self, out, params):
+        if params.tape_stop_serial != self.tape_stop_serial:
+            self.tape_stop_serial = params.tape_stop_serial
+            self.tape_stop_start = self.written - len(out)
+        if self.tape_stop_start is None:
+            return
+        frames = len(out)
+        duration = params.tape_stop_sec * self.samplerate
+        elapsed = self.written - len(out) - self.tape_stop_start
+        if elapsed > duration:
+            self.tape_stop_start = None
+            return
+        fade = min(TAPE_STOP_CROSSFADE_SEC * self.samplerate, duration / 2)
+        fade_start = duration - fade
+        fading = elapsed + frames > fade_start
+        if fading:
+            live = self.live[:frames]
+            live[:] = out
+        # the playback speed goes linearly down to zero, and the read position is the integral of that.
+        # positions are relative to the tape stop start, so they stay small enough for the fractional part.
+        positions = self.positions[:frames]
+        np.add(self.steps[:frames], elapsed, out=positions)
+        np.divide(positions, duration, out=positions)
+        np.subtract(1, positions, out=positions)
+        np.clip(positions, 0, 1, out=positions)
+        first_speed = positions[0]
+        np.cumsum(positions, out=positions)
+        np.add(positions, elapsed * (1 - elapsed / (2 * duration)) - first_speed, out=positions)
+
+        index = self.read_index[:frames]
+        weights = self.weights[:frames, 0]
+        other = self.other[:frames]
+        index[:] = positions
+        np.subtract(positions, index, out=weights)
+        np.add(index, self.tape_stop_start, out=index)
+        # as the tape is slower than realtime, all of this is in the history already (but the very next sample)
+        np.minimum(index, self.written - 2, out=index)
+        self._read_history(index, out)
+        np.add(index, 1, out=index)
+        self._read_history(index, other)
+        weights = self.weights[:frames]
+        np.subtract(other, out, out=other)
+        np.multiply(other, weights, out=other)
+        np.add(out, other, out=out)
+        if not fading:
+            return
+        # linearly from the tape to the live audio, which it is all the way at the end of the duration
+        weights = self.weights[:frames, 0]
+        np.add(self.steps[:frames], elapsed - fade_start, out=weights)
+        np.divide(weights, fade, out=weights)
+        np.clip(weights, 0, 1, out=weights)
+        weights = self.weights[:frames]
+        np.subtract(live, out, out=live)
+        np.multiply(live, weights, out=live)
+        np.add(out, live, out=out)
+
+    def _stutter(self, out, amount):
+        if amount <= 0.01:
+            self.stutter_start = None
+            return
+        frames = len(out)
+        if self.stutter_start is None or self.stutter_repeats >= STUTTER_REPEATS:
+            # grab the slice that just went by, and loop it (for every flash, and every STUTTER_REPEATS)
+            slice_sec = STUTTER_SLICE_SEC - (STUTTER_SLICE_SEC - MIN_STUTTER_SLICE_SEC) * amount
+            self.stutter_frames = max(int(slice_sec * self.samplerate), 1)
+            self.stutter_start = self.written - self.stutter_frames
+            self.stutter_phase = 0
+            self.stutter_repeats = 0
+        slice_frames = self.stutter_frames
+        index = self.read_index[:frames]
+        np.add(self.steps[:frames], self.stutter_phase, out=index)
+        np.remainder(index, slice_frames, out=index)
+        np.add(index, self.stutter_start, out=index)
+        other = self.other[:frames]
+        self._read_history(index, other)
+        self.stutter_repeats += (self.stutter_phase + frames) // slice_frames
+        self.stutter_phase = (self.stutter_phase + frames) % slice_frames
+        # crossfade with the amount, so it follows the envelope
+        np.multiply(out, 1 - amount, out=out)
+        np.multiply(other, amount, out=other)
+        np.add(out, other, out=out)
+
+    def _downsample(self, out, amount):
+        hold = 1 + int(amount * (MAX_SAMPLE_HOLD - 1))
+        if hold <= 1:
+            return
+        frames = len(out)
+        # every sample takes the value of the last one on the coarse grid (of the absolute sample count)
+        index = self.read_index[:frames]
+        np.add(self.steps[:frames], self.written - frames, out=index)
+        np.remainder(index, hold, out=index)
+        np.subtract(self.steps[:frames], index, out=index)
+        np.maximum(index, 0, out=index)
+        other = self.other[:frames]
+        np.take(out, index, axis=0, out=other)
+        out[:] = other
+
+    def _bitcrush(self, out, amount):
+        if amount <= 0:
+            return
+        bits = 16 - amount * (16 - MIN_BITS)
+        levels = np.float32(2 ** (bits - 1))
+        np.multiply(out, levels, out=out)
+        np.round(out, out=out)
+        np.divide(out, levels, out=out)
+
+    def _filter_sweep(self, out, amount):
+        frames = len(out)
+        tail = FILTER_TAPS - 1
+        filter_input = self.filter_input[:frames + tail]
+        # always keep the tail up to date, so the filter can come in without a click
+        filter_input[tail:] = out
+        if amount > 0:
+            kernel = self.kernels[round(amount * (FILTER_STEPS - 1))]
+            windows = np.lib.stride_tricks.sliding_window_view(filter_input, FILTER_TAPS, axis=0)
+            np.matmul(windows, kernel, out=out)
+        self.filter_input[:tail] = filter_input[frames:frames + tail]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the audio glitch chain on a wav file, offline")
+    parser.add_argument("input", help="16 bit PCM wav")
+    parser.add_argument("output")
+    parser.add_argument("--bitcrush", type=float, default=0)
+    parser.add_argument("--downsample", type=float, default=0)
+    parser.add_argument("--stutter", type=float, default=0)
+    parser.add_argument("--filter", type=float, default=0)
+    parser.add_argument("--tape-stop-at", type=float, default=None, help="Seconds into the file")
+    parser.add_argument("--tape-stop-sec", type=float, default=1.)
+    parser.add_argument("--block", type=int, default=512, help="Frames per block, as the callback would get")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    with wave.open(args.input, "rb") as file:
+        if file.getsampwidth() != 2:
+            raise ValueError("Only 16 bit PCM wav files, sorry")
+        channels = file.getnchannels()
+        samplerate = file.getframerate()
+        samples = np.frombuffer(file.readframes(file.getnframes()), dtype=np.int16).reshape(-1, channels)
+
+    chain = AudioEffectsChain(samplerate, channels, max_block=args.block)
+    chain.params = AudioEffectParams(
+        bitcrush=args.bitcrush,
+        downsample=args.downsample,
+        stutter=args.stutter,
+        filter_sweep=args.filter,
+        tape_stop_sec=args.tape_stop_sec,
+    )
+    tape_stop_frame = None if args.tape_stop_at is None else int(args.tape_stop_at * samplerate)
+
+    result = np.zeros(samples.shape, dtype=np.int16)
+    block_sec = args.block / samplerate
+    for start in range(0, len(samples), args.block):
+        if tape_stop_frame is not None and start >= tape_stop_frame:
+            chain.params = chain.params.with_tape_stop()
+            tape_stop_frame = None
+        block = samples[start:start + args.block].astype(np.float32) / 32768
+        started_at = perf_counter()
+        processed = chain.process(block)
+        chain.timing.record(perf_counter() - started_at, block_sec)
+        result[start:start + len(block)] = np.clip(processed * 32768, -32768, 32767)
+
+    with wave.open(args.output, "wb") as file:
+        file.setnchannels(channels)
+        file.setsampwidth(2)
+        file.setframerate(samplerate)
+        file.writeframes(result.tobytes())
+    chain.timing.print_debug()
@@ -0,0 +1,167 @@
+"""
+Auto levels / exposure normalization of the captured frame, entirely on the GPU.
+
+Two small passes after every upload:
+    1. tiles:  LEVELS_TILES_X x LEVELS_TILES_Y fragments, each one samples its tile of the frame
+               into (min, max, mean) luma
+    2. reduce: one fragment, reduces all tiles to (min, max, mean) and counts the tile means into a histogram
+               of LEVELS_HISTOGRAM_BINS, for their median - that is what the exposure goes by.
+               Blended with the previous result, so the levels don't flicker.
+The result stays in a 1 x 1 float texture that the dry and wet shaders read from,
+the CPU never waits for it. Only print_debug() reads it back, and the GPU time of the passes.
+"""
+
+from math import exp
+from pathlib import Path
+
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.GL import shaders
+
+from gmae.utils import inject_defines
+
+LEVELS_TEXTURE_UNIT = 6
+LEVELS_TILES_X = 64
+LEVELS_TILES_Y = 36
+LEVELS_SAMPLES_PER_TILE = 8
+LEVELS_HISTOGRAM_BINS = 64
+# seconds until a change in the picture is mostly (1 - 1/e) taken over
+LEVELS_SMOOTHING_SEC = 0.5
+
+
+def create_float_texture(width, height):
+    texture = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_2D, texture)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA32F, width, height, 0, GL_RGBA, GL_FLOAT, None)
+    return texture
+
+
+class AutoLevels:
+    def __init__(self, vertex_shader: int, tiles_shader_path: Path, reduce_shader_path: Path):
+        defines = {
+            "SAMPLES_PER_TILE": LEVELS_SAMPLES_PER_TILE,
+            "HISTOGRAM_BINS": LEVELS_HISTOGRAM_BINS,
+        }
+        self.tiles_program = self._compile(vertex_shader, tiles_shader_path, defines)
+        self.reduce_program = self._compile(vertex_shader, reduce_shader_path, defines)
+        self.locations = {
+            "tiles_frame": glGetUniformLocation(self.tiles_program, "iPixelData"),
+            "tiles_count": glGetUniformLocation(self.tiles_program, "iTiles"),
+            "reduce_tiles": glGetUniformLocation(self.reduce_program, "iTileStats"),
+            "reduce_previous": glGetUniformLocation(self.reduce_program, "iPreviousLevels"),
+            "reduce_smoothing": glGetUniformLocation(self.reduce_program, "iSmoothing"),
+        }
+
+        # the textures are bound to LEVELS_TEXTURE_UNIT only while being written / read as levels
+        glActiveTexture(GL_TEXTURE0 + LEVELS_TEXTURE_UNIT)
+        self.tiles_texture = create_float_texture(LEVELS_TILES_X, LEVELS_TILES_Y)
+        # ping-pong, the reduce pass reads the previous result while writing the new one
+        self.levels_textures = [create_float_texture(1, 1) for _ in range(2)]
+        glActiveTexture(GL_TEXTURE0)
+        self.framebuffer = glGenFramebuffers(1)
+        self.current = 0
+        self.updates = 0
+        self.last_update_sec = None
+
+        self.query = glGenQueries(1)
+        self.query_pending = False
+        self.last_gpu_ms = None
+
+    @staticmethod
+    def _compile(vertex_shader, path, defines):
+        with open(path, 'r') as file:
+            fragment_shader = shaders.compileShader(inject_defines(file.read(), defines), GL_FRAGMENT_SHADER)
+        return shaders.compileProgram(vertex_shader, fragment_shader)
+
+    def delete(self):
+        glDeleteQueries(1, [self.query])
+        glDeleteFramebuffers(1, [self.framebuffer])
+        glDeleteTextures(3, [self.tiles_texture, *self.levels_textures])
+        glDeleteProgram(self.tiles_program)
+        glDeleteProgram(self.reduce_program)
+
+    @property
+    def levels_texture(self):
+        return self.levels_textures[self.current]
+
+    def update(self, frame_texture, draw_quad, time_sec):
+        """
+        To call after a new frame got uploaded (to texture unit 0). draw_quad() renders the full screen quad,
+        time_sec is the running time, the smoothing works with the time since the last update.
+        Leaves the levels texture bound to LEVELS_TEXTURE_UNIT, and the default framebuffer as it was.
+        """
+        self._collect_gpu_time()
+        viewport = glGetIntegerv(GL_VIEWPORT)
+        if not self.query_pending:
+            glBeginQuery(GL_TIME_ELAPSED, self.query)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.tiles_texture, 0)
+        glViewport(0, 0, LEVELS_TILES_X, LEVELS_TILES_Y)
+        glUseProgram(self.tiles_program)
+        glActiveTexture(GL_TEXTURE0)
+        glBindTexture(GL_TEXTURE_2D, frame_texture)
+        glUniform1i(self.locations["tiles_frame"], 0)
+        glUniform2i(self.locations["tiles_count"], LEVELS_TILES_X, LEVELS_TILES_Y)
+        draw_quad()
+
+        previous = self.levels_textures[self.current]
+        self.current = 1 - self.current
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.levels_texture, 0)
+        glViewport(0, 0, 1, 1)
+        glUseProgram(self.reduce_program)
+        glActiveTexture(GL_TEXTURE0 + LEVELS_TEXTURE_UNIT)
+        glBindTexture(GL_TEXTURE_2D, self.tiles_texture)
+        glActiveTexture(GL_TEXTURE0 + LEVELS_TEXTURE_UNIT + 1)
+        glBindTexture(GL_TEXTURE_2D, previous)
+        glUniform1i(self.locations["reduce_tiles"], LEVELS_TEXTURE_UNIT)
+        glUniform1i(self.locations["reduce_previous"], LEVELS_TEXTURE_UNIT + 1)
+        # frame rate independent smoothing, and the very first frame is taken as it is
+        if self.last_update_sec is None:
+            smoothing = 1.
+        else:
+            smoothing = 1 - exp(-max(time_sec - self.last_update_sec, 0) / LEVELS_SMOOTHING_SEC)
+        self.last_update_sec = time_sec
+        glUniform1f(self.locations["reduce_smoothing"], smoothing)
+        draw_quad()
+
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glActiveTexture(GL_TEXTURE0 + LEVELS_TEXTURE_UNIT)
+        glBindTexture(GL_TEXTURE_2D, self.levels_texture)
+        glActiveTexture(GL_TEXTURE0)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        glViewport(*viewport)
+        if not self.query_pending:
+            glEndQuery(GL_TIME_ELAPSED)
+            self.query_pending = True
+        self.updates += 1
+
+    def _collect_gpu_time(self):
+        # only take the result if it is there already, never wait for the GPU
+        if not self.query_pending:
+            return
+        if not glGetQueryObjectiv(self.query, GL_QUERY_RESULT_AVAILABLE):
+            return
+        self.last_gpu_ms = int(glGetQueryObjectui64v(self.query, GL_QUERY_RESULT)) * 1e-6
+        self.query_pending = False
+
+    def read_back(self):
+        # for debugging only, this waits for the GPU
+        glBindTexture(GL_TEXTURE_2D, self.levels_texture)
+        data = glGetTexImage(GL_TEXTURE_2D, 0, GL_RGBA, GL_FLOAT)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        minimum, maximum, mean, median = np.asarray(data, dtype=np.float32).reshape(4)
+        return minimum, maximum, mean, median
+
+    def print_debug(self):
+        if self.updates == 0:
+            print("Auto Levels: nothing measured yet")
+            return
+        minimum, maximum, mean, median = self.read_back()
+        gpu_time = "?" if self.last_gpu_ms is None else f"{self.last_gpu_ms:.3f} ms"
+        print(f"Auto Levels: min {minimum:.3f}, max {maximum:.3f}, mean {mean:.3f}, median {median:.3f}, "
+              f"GPU {gpu_time}")
@@ -0,0 +1,202 @@
+"""
+Keeps the show running when the capture device hiccups or gets unplugged.
+
+The frames are read on a background thread. If a read fails, or no frame arrives for STALL_TIMEOUT_SEC,
+the device is reopened on another thread (with backoff, and with the capture settings that were negotiated
+at startup, and only once the old capture is released - some backends, e.g. on Windows, can't open it twice), while the render loop just keeps rendering the last good frame. The window, GL context and
+programs stay as they are, the new stream is simply swapped in (if it comes at another size, the Processor
+re-creates whatever depends on that, see Processor.handle_capture_resize).
+"""
+
+from threading import Thread, Lock, Condition
+from time import perf_counter, sleep
+
+import numpy as np
+
+from gmae.find_video_captures import open_video_capture
+from gmae.utils import log, CaptureDeviceInfo
+
+STALL_TIMEOUT_SEC = 2.
+RECONNECT_BACKOFF_START_SEC = 0.5
+RECONNECT_BACKOFF_MAX_SEC = 5.
+DEFAULT_FPS = 30.
+# after a stall, the reader may still be stuck in read() with the old capture. that long it gets to return by itself
+STUCK_READER_WAIT_SEC = 1.
+
+
+def reopen_capture(index, capture_info: CaptureDeviceInfo):
+    import cv2
+    capture = open_video_capture(index)
+    if capture.isOpened():
+        # ask for what we had, the texture and the frame history are made for that
+        capture.set(cv2.CAP_PROP_FRAME_WIDTH, capture_info.width)
+        capture.set(cv2.CAP_PROP_FRAME_HEIGHT, capture_info.height)
+        if capture_info.fps:
+            capture.set(cv2.CAP_PROP_FPS, capture_info.fps)
+    return capture
+
+
+def fallback_pattern(width, height):
+    # some color bars, for when there never was a good frame
+    bars = np.array([
+        [255, 255, 255], [0, 255, 255], [255, 255, 0], [0, 255, 0],
+        [255, 0, 255], [0, 0, 255], [255, 0, 0], [0, 0, 0],
+    ], dtype=np.uint8)
+    columns = np.arange(width) * len(bars) // width
+    return np.ascontiguousarray(np.broadcast_to(bars[columns], (height, width, 3)))
+
+
+class CaptureSupervisor:
+    def __init__(self, capture, capture_info: CaptureDeviceInfo, index):
+        self.capture_info = capture_info
+        self.index = index
+        self.frame_interval_sec = 1 / (capture_info.fps or DEFAULT_FPS)
+
+        self.lock = Lock()
+        self.new_frame = Condition()
+        self.frame = None
+        self.frame_id = 0
+        self.consumed_frame_id = 0
+        self.last_frame_at = perf_counter()
+        self.fallback = None
+
+        self.generation = 0
+        self.reconnecting = False
+        self.reconnects = 0
+        self.stale_since = None
+        self.total_stale_sec = 0.
+        self.stopped = False
+        self.reader = None
+        self.capture = None
+
+        self._start_reader(capture)
+
+    def _start_reader(self, capture):
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+            self.capture = capture
+        self.reader = Thread(
+            target=self._read_loop,
+            args=(capture, generation),
+            name=f"CaptureReader{generation}",
+            daemon=True
+        )
+        self.reader.start()
+
+    def _read_loop(self, capture, generation):
+        while not self.stopped and generation == self.generation:
+            ok, frame = capture.read()
+            if generation != self.generation:
+                # we were given up on while blocking in read(), there is a new capture already
+                break
+            if not ok:
+                self._lost("Capture read failed")
+                break
+            with self.new_frame:
+                self.frame = frame
+                self.frame_id += 1
+                self.last_frame_at = perf_counter()
+                self.new_frame.notify_all()
+        capture.release()
+
+    def _lost(self, reason):
+        with self.lock:
+            if self.reconnecting or self.stopped:
+                return
+            self.reconnecting = True
+            # invalidates the current reader, even if it is still stuck in a read
+            self.generation += 1
+            old_reader, old_capture = self.reader, self.capture
+        if self.stale_since is None:
+            self.stale_since = self.last_frame_at
+        log(f"{reason}, reconnect {self.capture_info.name or self.index} in the background")
+        Thread(
+            target=self._reconnect_loop,
+            args=(old_reader, old_capture),
+            name="CaptureReconnect",
+            daemon=True
+        ).start()
+
+    @staticmethod
+    def _retire(reader, capture):
+        # after a read error the reader is on its way out already (and releases its capture),
+        # after a stall it may still block in read(). releasing the capture makes that read() return
+        reader.join(timeout=STUCK_READER_WAIT_SEC)
+        if reader.is_alive():
+            log("Capture reader is stuck, release its capture anyway")
+            capture.release()
+
+    def _reconnect_loop(self, old_reader, old_capture):
+        self._retire(old_reader, old_capture)
+        delay_sec = RECONNECT_BACKOFF_START_SEC
+        while not self.stopped:
+            capture = reopen_capture(self.index, self.capture_info)
+            info = CaptureDeviceInfo.read_from(capture, name=self.capture_info.name, index=self.index)
+            if info is not None:
+                if (info.width, info.height) != (self.capture_info.width, self.capture_info.height):
+                    # the Processor notices that with the first frame, and makes its textures etc. again
+                    print("Reopened capture has a different size now:", info)
+                break
+            capture.release()
+            sleep(delay_sec)
+            delay_sec = min(2 * delay_sec, RECONNECT_BACKOFF_MAX_SEC)
+        else:
+            return
+        self.reconnects += 1
+        log(f"Reopened capture {self.capture_info.name or self.index}")
+        with self.lock:
+            self.reconnecting = False
+            self.last_frame_at = perf_counter()
+        self._start_reader(capture)
+
+    def read(self, max_wait_sec=None):
+        """
+        For the render loop: the newest frame, and whether it is a new one.
+        Waits at most one frame interval (or max_wait_sec), so that the effects keep running even if the capture
+        doesn't. When the render loop is paced by the display (vsync), it gives the time until its next deadline.
+        """
+        if max_wait_sec is None:
+            max_wait_sec = self.frame_interval_sec
+        with self.new_frame:
+            if max_wait_sec > 0 and self.frame_id == self.consumed_frame_id:
+                self.new_frame.wait(timeout=max_wait_sec)
+            frame = self.frame
+            fresh = self.frame_id != self.consumed_frame_id
+            self.consumed_frame_id = self.frame_id
+
+        now = perf_counter()
+        if fresh and self.stale_since is not None:
+            stale_sec = now - self.stale_since
+            self.total_stale_sec += stale_sec
+            self.stale_since = None
+            log(f"Capture is back, the output was stale for {stale_sec:.2f}s")
+        elif not fresh and not self.reconnecting and now - self.last_frame_at > STALL_TIMEOUT_SEC:
+            self._lost(f"Capture stalled for {now - self.last_frame_at:.1f}s")
+
+        if frame is None:
+            # only needs to be uploaded once
+            fresh = self.fallback is None
+            if fresh:
+                self.fallback = fallback_pattern(self.capture_info.width, self.capture_info.height)
+            frame = self.fallback
+        return frame, fresh
+
+    @property
+    def is_stale(self):
+        return self.stale_since is not None
+
+    def stale_seconds(self):
+        # including the currently ongoing stale period, if there is one
+        ongoing = 0 if self.stale_since is None else perf_counter() - self.stale_since
+        return self.total_stale_sec + ongoing
+
+    def release(self):
+        # the reader releases its capture when it stops, unless it is stuck in a read - then, it's lost anyway
+        self.stopped = True
+        with self.lock:
+            self.generation += 1
+        if self.reader is not None:
+            self.reader.join(timeout=2 * self.frame_interval_sec + 0.5)
+        if self.stale_since is not None:
+            log(f"Capture was still stale at the end, total stale time {self.stale_seconds():.2f}s")
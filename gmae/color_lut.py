@@ -0,0 +1,229 @@
+"""
+The color-only effects (effectA hue shift, effectC gamma flicker, and an optional grading LUT from a .cube file)
+baked into one 3D LUT, so the wet shader needs one trilinear fetch instead of all the per-pixel math.
+
+The baking is frag.glsl itself, compiled with BAKE_COLOR_LUT: every fragment is one lattice point of the LUT,
+one draw per slice, so it is exactly the same code as the per-pixel path (even the noise lookups).
+It only happens when its inputs change - the amounts (quantized), the grading, and the time only as far
+as the active effects depend on it: effectC steps with floor(4 * iTime) anyway, and the hue shift of effectA
+is computed here as well (same lfnoise as the shader), looked at HUE_UPDATES_PER_SEC and quantized to HUE_STEPS,
+so where the noise is flat it doesn't bake at all.
+
+One difference to the per-pixel path: effectA now happens where effectC is, i.e. after the blur of effectB.
+"""
+
+from math import floor
+from typing import TYPE_CHECKING
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.GL import shaders
+
+from gmae.lookup_textures import LookupUnit
+from gmae.processor_utils import EffectId
+from gmae.utils import inject_defines
+
+if TYPE_CHECKING:
+    from gmae.gl_state import GLState
+
+COLOR_LUT_TEXTURE_UNIT = 8
+GRADING_LUT_TEXTURE_UNIT = 9
+COLOR_LUT_SIZE = 33
+AMOUNT_STEPS = 64
+# a multiple of 4, so that the quantized time still has the same floor(4 * iTime) as the real one
+HUE_UPDATES_PER_SEC = 16
+# over the whole -1 .. 1 of lfnoise(), i.e. the hue shift only re-bakes in steps of 1/32 of the hue circle,
+# which is about 8 times a second instead of every HUE_UPDATES_PER_SEC
+HUE_STEPS = 64
+
+
+def fract(x):
+    return x - floor(x)
+
+
+def hash12(x, y):
+    # the hash12() of frag.glsl, only that this has doubles - close enough to tell when the hue moves
+    p3 = [fract(x * .1031), fract(y * .1031), fract(x * .1031)]
+    shift = p3[0] * (p3[1] + 33.33) + p3[1] * (p3[2] + 33.33) + p3[2] * (p3[0] + 33.33)
+    p3 = [value + shift for value in p3]
+    return fract((p3[0] + p3[1]) * p3[2])
+
+
+def lfnoise(t):
+    # the lfnoise() of frag.glsl, at vec2(t, t) like effectA calls it
+    i = floor(t)
+    s = fract(t)
+    s = s * s * (3 - 2 * s)
+    v1 = (hash12(i, i), hash12(i + 1, i))
+    v2 = (hash12(i, i + 1), hash12(i + 1, i + 1))
+    v1 = [-1 + 2 * (a + (b - a) * s) for a, b in zip(v1, v2)]
+    return v1[0] + (v1[1] - v1[0]) * s
+
+
+def hue_step(time_sec):
+    # what effectA shifts the hue by (see frag.glsl), quantized
+    return round(lfnoise(.3 * time_sec) * HUE_STEPS / 2)
+
+
+def load_cube_file(path):
+    """
+    Reads a 3D LUT in the .cube format (as exported by Resolve & co.), as float32 array [blue][green][red][rgb].
+    """
+    size = None
+    domain_min = np.zeros(3, dtype=np.float32)
+    domain_max = np.ones(3, dtype=np.float32)
+    values = []
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            keyword, *rest = line.split()
+            if keyword == "TITLE":
+                continue
+            if keyword == "LUT_1D_SIZE":
+                raise ValueError(f"{path} is a 1D LUT, only 3D LUTs are supported")
+            if keyword == "LUT_3D_SIZE":
+                size = int(rest[0])
+            elif keyword == "DOMAIN_MIN":
+                domain_min = np.array(rest, dtype=np.float32)
+            elif keyword == "DOMAIN_MAX":
+                domain_max = np.array(rest, dtype=np.float32)
+            else:
+                values.append(line.split())
+    if size is None:
+        raise ValueError(f"{path} has no LUT_3D_SIZE")
+    table = np.array(values, dtype=np.float32)
+    if table.shape != (size ** 3, 3):
+        raise ValueError(f"{path} should have {size ** 3} RGB entries, but has {table.shape}")
+    if np.any(domain_min != 0) or np.any(domain_max != 1):
+        print(f"LUT {path} has domain {domain_min} - {domain_max}, will be used as if it were 0 - 1")
+    # red changes fastest in the file, which is x in the 3D texture
+    return table.reshape(size, size, size, 3)
+
+
+def create_lut_texture(unit, size, data=None):
+    texture = glGenTextures(1)
+    glActiveTexture(GL_TEXTURE0 + unit)
+    glBindTexture(GL_TEXTURE_3D, texture)
+    glTexParameteri(GL_TEXTURE_3D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+    glTexParameteri(GL_TEXTURE_3D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+    for wrap in [GL_TEXTURE_WRAP_S, GL_TEXTURE_WRAP_T, GL_TEXTURE_WRAP_R]:
+        glTexParameteri(GL_TEXTURE_3D, wrap, GL_CLAMP_TO_EDGE)
+    glTexImage3D(GL_TEXTURE_3D, 0, GL_RGB16F, size, size, size, 0, GL_RGB, GL_FLOAT, data)
+    glActiveTexture(GL_TEXTURE0)
+    return texture
+
+
+class ColorLut:
+    def __init__(self, gl: "GLState", grading_path=None):
+        self.gl = gl
+        self.texture = create_lut_texture(COLOR_LUT_TEXTURE_UNIT, COLOR_LUT_SIZE)
+        self.framebuffer = glGenFramebuffers(1)
+        self.grading_texture = None
+        if grading_path:
+            grading = load_cube_file(grading_path)
+            self.grading_texture = create_lut_texture(GRADING_LUT_TEXTURE_UNIT, len(grading), grading)
+            print(f"Loaded Grading LUT {Path(grading_path).name} ({len(grading)}^3)")
+
+        self.bake_program = None
+        self.locations = {}
+        self.key = None
+        self.bakes = 0
+        self.last_bake_ms = None
+
+    @property
+    def has_grading(self):
+        return self.grading_texture is not None
+
+    def compile(self, vertex_shader, wet_fragment_shader_source):
+        # raises like shaders.compileShader() does, then the old bake program stays
+        fragment_shader = shaders.compileShader(
+            inject_defines(wet_fragment_shader_source, {"BAKE_COLOR_LUT": 1}),
+            GL_FRAGMENT_SHADER
+        )
+        program = shaders.compileProgram(vertex_shader, fragment_shader)
+        if self.bake_program is not None:
+            glDeleteProgram(self.bake_program)
+            # the new one might get the same id, but not the uniform values
+            self.gl.forget_program(self.bake_program)
+        self.bake_program = program
+        self.locations = {
+            name: glGetUniformLocation(program, name)
+            for name in [
+                "iTime", "aEffectA", "aEffectC", "iColorLutSize", "iColorLutSlice",
+                "iUseGradingLut", "iGradingLut", "iUseLookupTextures",
+                "iNoiseLookup", "iBlueNoise", "iBayerLookup",
+            ]
+        }
+        # the shader might have changed the effects, so the LUT is outdated
+        self.key = None
+
+    def delete(self):
+        if self.bake_program is not None:
+            glDeleteProgram(self.bake_program)
+        glDeleteFramebuffers(1, [self.framebuffer])
+        glDeleteTextures(1, [self.texture])
+        if self.grading_texture is not None:
+            glDeleteTextures(1, [self.grading_texture])
+
+    def update(self, elapsed_seconds, amounts: dict, use_lookup_textures, draw_quad):
+        """
+        Re-bakes the LUT if anything that goes into it changed. Everything goes through the GLState, which gets
+        the program and viewport back as they were, and the framebuffer is the default one again.
+        Returns whether it baked.
+        """
+        amount_a = round(amounts.get(EffectId.A, 0) * AMOUNT_STEPS)
+        amount_c = round(amounts.get(EffectId.C, 0) * AMOUNT_STEPS)
+        time_step = floor(elapsed_seconds * HUE_UPDATES_PER_SEC)
+        bake_time = time_step / HUE_UPDATES_PER_SEC
+        key = (
+            amount_a,
+            amount_c,
+            self.has_grading,
+            hue_step(bake_time) if amount_a else None,
+            floor(4 * bake_time) if amount_c else None,
+            use_lookup_textures if amount_a else None,
+        )
+        if key == self.key:
+            return False
+        self.key = key
+
+        started_at = perf_counter()
+        gl = self.gl
+        program = gl.program
+        viewport = gl.viewport_rect
+        gl.use_program(self.bake_program)
+        gl.uniform(glUniform1f, self.locations["iTime"], bake_time)
+        gl.uniform(glUniform1f, self.locations["aEffectA"], amount_a / AMOUNT_STEPS)
+        gl.uniform(glUniform1f, self.locations["aEffectC"], amount_c / AMOUNT_STEPS)
+        gl.uniform(glUniform1i, self.locations["iColorLutSize"], COLOR_LUT_SIZE)
+        gl.uniform(glUniform1i, self.locations["iUseGradingLut"], self.has_grading)
+        gl.uniform(glUniform1i, self.locations["iGradingLut"], GRADING_LUT_TEXTURE_UNIT)
+        gl.uniform(glUniform1i, self.locations["iUseLookupTextures"], use_lookup_textures)
+        gl.uniform(glUniform1i, self.locations["iNoiseLookup"], LookupUnit.NOISE)
+        gl.uniform(glUniform1i, self.locations["iBlueNoise"], LookupUnit.BLUE_NOISE)
+        gl.uniform(glUniform1i, self.locations["iBayerLookup"], LookupUnit.BAYER)
+
+        gl.call(glBindFramebuffer, GL_FRAMEBUFFER, self.framebuffer)
+        gl.viewport(0, 0, COLOR_LUT_SIZE, COLOR_LUT_SIZE)
+        for layer in range(COLOR_LUT_SIZE):
+            gl.call(glFramebufferTextureLayer, GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, self.texture, 0, layer)
+            gl.uniform(glUniform1i, self.locations["iColorLutSlice"], layer)
+            draw_quad()
+
+        gl.call(glBindFramebuffer, GL_FRAMEBUFFER, 0)
+        if viewport is not None:
+            gl.viewport(*viewport)
+        if program is not None:
+            gl.use_program(program)
+        self.bakes += 1
+        self.last_bake_ms = 1000 * (perf_counter() - started_at)
+        return True
+
+    def print_debug(self):
+        bake_time = "" if self.last_bake_ms is None else f", last one took {self.last_bake_ms:.3f} ms (CPU side)"
+        grading = " + grading LUT" if self.has_grading else ""
+        print(f"Color LUT: {COLOR_LUT_SIZE}^3{grading}, baked {self.bakes} times{bake_time}")
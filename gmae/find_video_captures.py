@@ -1,12 +1,120 @@
-import cv2
-from capture_devices import devices
-import sounddevice as sd
+import os
+import re
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from platform import system
+from typing import Optional
 
 from gmae.utils import log
 
 
 HDMI_USB_ADAPTER_SEARCH_STRING = "ugreen"
 
+# Linux: every /dev/videoN has its /sys/class/video4linux/videoN, and OpenCV (with CAP_V4L2) opens exactly
+# /dev/videoN for index N. To try without real devices, point these to a fake tree, e.g.
+#   fake/sys/class/video4linux/video0/name      containing "UGREEN 25854: UGREEN 25854"
+#   fake/sys/class/video4linux/video0/index     containing "0"  (1 would be the metadata node of the same device)
+#   fake/sys/class/video4linux/video0/device -> symlink to some fake/sys/devices/.../1-2:1.0
+# and call enumerate_linux_video_devices(Path("fake/sys/class/video4linux"), Path("fake/dev"))
+SYSFS_VIDEO4LINUX = Path("/sys/class/video4linux")
+DEV_ROOT = Path("/dev")
+
+# from linux/videodev2.h
+VIDIOC_QUERYCAP = 0x80685600
+V4L2_CAPABILITY_FORMAT = "16s32s32sIII12x"
+V4L2_CAP_VIDEO_CAPTURE = 0x00000001
+V4L2_CAP_VIDEO_CAPTURE_MPLANE = 0x00001000
+V4L2_CAP_DEVICE_CAPS = 0x80000000
+
+
+@dataclass
+class V4L2Capability:
+    driver: str
+    card: str
+    bus_info: str
+    capabilities: int
+
+    @property
+    def can_capture(self):
+        return bool(self.capabilities & (V4L2_CAP_VIDEO_CAPTURE | V4L2_CAP_VIDEO_CAPTURE_MPLANE))
+
+
+@dataclass
+class VideoDevice:
+    # this is N of /dev/videoN, i.e. exactly what cv2.VideoCapture(N, cv2.CAP_V4L2) opens
+    index: int
+    path: str
+    name: str
+    bus_info: str
+    can_capture: bool
+
+    @property
+    def stable_id(self):
+        # stays the same for the same device in the same port, unlike N, which depends on the plugging order
+        return self.bus_info or self.path
+
+
+def query_capability(path) -> Optional[V4L2Capability]:
+    # opening the device node just for the ioctl is fast, it's the streaming setup that takes long in OpenCV
+    import fcntl
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+    except OSError:
+        return None
+    try:
+        buffer = bytearray(struct.calcsize(V4L2_CAPABILITY_FORMAT))
+        fcntl.ioctl(fd, VIDIOC_QUERYCAP, buffer)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    driver, card, bus_info, _version, capabilities, device_caps = struct.unpack(V4L2_CAPABILITY_FORMAT, buffer)
+    if capabilities & V4L2_CAP_DEVICE_CAPS:
+        # the capabilities of this very node, not of the whole physical device
+        capabilities = device_caps
+
+    def text(raw):
+        return raw.split(b"\0", 1)[0].decode("utf-8", errors="replace").strip()
+
+    return V4L2Capability(text(driver), text(card), text(bus_info), capabilities)
+
+
+def read_sysfs_attribute(path: Path, default=""):
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return default
+
+
+def enumerate_linux_video_devices(sysfs_root=SYSFS_VIDEO4LINUX, dev_root=DEV_ROOT):
+    devices = []
+    for entry in sysfs_root.glob("video*"):
+        match = re.fullmatch(r"video(\d+)", entry.name)
+        if match is None:
+            continue
+        path = dev_root / entry.name
+        name = read_sysfs_attribute(entry / "name")
+        bus_info = ""
+        capability = query_capability(path)
+        if capability is not None:
+            name = capability.card or name
+            bus_info = capability.bus_info
+            can_capture = capability.can_capture
+        else:
+            # no access to the node (or a fake tree): the first node of a device is the one that captures
+            can_capture = read_sysfs_attribute(entry / "index", "0") == "0"
+        if not bus_info and (entry / "device").exists():
+            bus_info = os.path.relpath(os.path.realpath(entry / "device"), os.path.realpath(sysfs_root / "../.."))
+        devices.append(VideoDevice(
+            index=int(match.group(1)),
+            path=str(path),
+            name=name,
+            bus_info=bus_info,
+            can_capture=can_capture,
+        ))
+    return sorted(devices, key=lambda device: device.index)
+
 
 def take_preferred_index(names):
     if len(names) == 1:
@@ -27,10 +135,38 @@ def take_preferred_index(names):
     non_integrated = name_find("integrated", exclude=True)
     if non_integrated is not None:
         return names.index(non_integrated)
-    return names[-1]
+    return len(names) - 1
+
+
+def open_video_capture(index):
+    import cv2
+    if system() == "Linux":
+        # the V4L2 backend maps index N to /dev/videoN, which is what the enumeration found
+        return cv2.VideoCapture(index, cv2.CAP_V4L2)
+    return cv2.VideoCapture(index)
+
+
+def find_capture_device_name_with_index_linux(sysfs_root=SYSFS_VIDEO4LINUX, dev_root=DEV_ROOT):
+    devices = enumerate_linux_video_devices(sysfs_root, dev_root)
+    log("Scanned Video Capture Devices.")
+    for device in devices:
+        capture_info = "" if device.can_capture else " (no capture)"
+        print(f"-> {device.path}: {device.name} [{device.stable_id}]{capture_info}")
+    candidates = [device for device in devices if device.can_capture]
+    if not candidates:
+        raise EnvironmentError("There are no Video Capture devices.")
+    device = candidates[take_preferred_index([device.name for device in candidates])]
+    # V4L2 card names often look like "UGREEN 25854: UGREEN 25854"
+    actual_name = device.name.split(':')[0].strip()
+    return actual_name, device.index
 
 
 def find_capture_device_name_with_index():
+    if system() == "Linux":
+        return find_capture_device_name_with_index_linux()
+
+    # Windows only, and slow to import, so only here
+    from capture_devices import devices
     device_names = devices.run_with_param(device_type="video", result_=True)
     log("Scanned Video Capture Devices.")
     for name in device_names:
@@ -38,8 +174,9 @@ def find_capture_device_name_with_index():
     if not device_names:
         raise EnvironmentError("There are no Video Capture devices.")
 
-    # THIS DOES NOT WORK - the orders of the device_names and the open CV indices are different. lel
-    index = take_preferred_index(device_names)
+    # the orders of the device_names and the OpenCV indices are different, so this is only good for the name,
+    # the index then has to come from --index
+    name_index = take_preferred_index(device_names)
 
-    actual_name = device_names[index].split(':')[-1].strip()
-    return actual_name, index
+    actual_name = device_names[name_index].split(':')[-1].strip()
+    return actual_name, None
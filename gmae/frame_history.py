@@ -0,0 +1,112 @@
+"""
+The last N frames, kept on the GPU in a 2D texture array, for trails / echo / feedback effects.
+A new frame is written by blitting into the next layer of the ring, i.e. it never leaves the GPU.
+
+The layers have the orientation of iPixelData (row 0 = top of the image),
+so the shader can sample them with the same image coordinates.
+"""
+
+from enum import Enum
+
+from OpenGL.GL import *
+
+from gmae.utils import log
+
+HISTORY_TEXTURE_UNIT = 4
+
+
+class HistorySource(Enum):
+    CAPTURED = "captured"    # the uploaded camera frame, before any effect
+    PROCESSED = "processed"  # what was rendered to the window, i.e. feedback
+
+
+class FrameHistory:
+    def __init__(self, depth, width, height, source=HistorySource.CAPTURED):
+        max_layers = glGetIntegerv(GL_MAX_ARRAY_TEXTURE_LAYERS)
+        if depth > max_layers:
+            print(f"Frame history of {depth} not supported by this GPU, use {max_layers}")
+            depth = max_layers
+        self.depth = depth
+        self.width = width
+        self.height = height
+        self.source = source
+        # the layer with the most recent frame, -1 as long as nothing was written
+        self.index = -1
+        self.frames_written = 0
+
+        self.texture = glGenTextures(1)
+        glActiveTexture(GL_TEXTURE0 + HISTORY_TEXTURE_UNIT)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, self.texture)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexImage3D(
+            GL_TEXTURE_2D_ARRAY,
+            0,
+            GL_RGBA8,
+            width,
+            height,
+            depth,
+            0,
+            GL_RGBA,
+            GL_UNSIGNED_BYTE,
+            None
+        )
+        glActiveTexture(GL_TEXTURE0)
+
+        self.read_framebuffer, self.draw_framebuffer = glGenFramebuffers(2)
+        log(f"Created Frame History: {depth} x {width}x{height} ({source.value}), {self.memory_megabytes:.1f} MB on the GPU")
+
+    @property
+    def memory_bytes(self):
+        # RGBA8, no mipmaps
+        return self.depth * self.width * self.height * 4
+
+    @property
+    def memory_megabytes(self):
+        return self.memory_bytes / 1024 / 1024
+
+    def delete(self):
+        glDeleteFramebuffers(2, [self.read_framebuffer, self.draw_framebuffer])
+        glDeleteTextures(1, [self.texture])
+
+    def push_captured(self, frame_texture, frame_width, frame_height):
+        if self.source is not HistorySource.CAPTURED:
+            return
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.read_framebuffer)
+        glFramebufferTexture2D(GL_READ_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, frame_texture, 0)
+        # same orientation as the texture already
+        self._blit_into_next_layer(frame_width, frame_height, flip=False)
+
+    def push_processed(self, window_width, window_height):
+        if self.source is not HistorySource.PROCESSED:
+            return
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, 0)
+        glReadBuffer(GL_BACK)
+        # the window has row 0 at the bottom, so flip it into iPixelData orientation
+        self._blit_into_next_layer(window_width, window_height, flip=True)
+
+    def _blit_into_next_layer(self, source_width, source_height, flip):
+        self.index = (self.index + 1) % self.depth
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, self.draw_framebuffer)
+        glFramebufferTextureLayer(GL_DRAW_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, self.texture, 0, self.index)
+        top, bottom = (self.height, 0) if flip else (0, self.height)
+        glBlitFramebuffer(
+            0, 0, source_width, source_height,
+            0, top, self.width, bottom,
+            GL_COLOR_BUFFER_BIT,
+            GL_LINEAR
+        )
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, 0)
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, 0)
+        self.frames_written += 1
+
+    @property
+    def available_depth(self):
+        # before the ring is full, the shader must not read layers that were never written
+        return min(self.frames_written, self.depth)
+
+    def print_debug(self):
+        print(f"Frame History: {self.available_depth} / {self.depth} frames, newest in layer {self.index},",
+              f"{self.memory_megabytes:.1f} MB")
@@ -0,0 +1,367 @@
+"""
+Frame rate upconversion: the capture delivers maybe 30 fps, the projector shows 60 - 144 Hz. Instead of showing
+every captured frame a few times, the previous and the current one stay on the GPU, and every display frame
+gets its own picture from in between, which is what the effect shader then works on - so the iTime effects
+move at the full display rate, and the picture doesn't judder.
+
+The phase between the two frames comes from the time since the current one arrived, relative to the (smoothed)
+interval between captured frames. That means the output is one capture interval behind, the price for never
+having to guess ahead.
+
+Quality levels:
+    blend:       just cross-fades the two frames by the phase
+    motion:      per 32x32 pixel block (on a quarter size luma image), the offset where it matches best
+                 in the previous frame, searched once per captured frame. Every display frame then warps
+                 both frames that far along the offsets. Blocks that match nowhere get the blend.
+    motion_fine: the same with 16x16 blocks and twice the search range
+The GPU time of the search (per captured frame) and of the composition (per display frame) is kept per level.
+"""
+
+from collections import deque
+from enum import Enum
+from math import exp
+from pathlib import Path
+
+from OpenGL.GL import *
+from OpenGL.GL import shaders
+
+from gmae.auto_levels import create_float_texture
+from gmae.utils import inject_defines
+
+# only bound while the passes run
+INTERPOLATION_TEXTURE_UNIT = 12
+# the motion search works on luma of about 1 / LUMA_SCALE the frame size (rounded up, see padded_luma_size)
+LUMA_SCALE = 4
+LUMA_SAMPLES_PER_TEXEL = 2
+# the capture interval, averaged over about that many frames against the jitter of the arrival times
+INTERVAL_SMOOTHING_FRAMES = 10
+INTERPOLATION_STATS_WINDOW = 120
+
+
+class InterpolationQuality(Enum):
+    OFF = "off"
+    BLEND = "blend"
+    MOTION = "motion"
+    MOTION_FINE = "motion_fine"
+
+
+# in luma texels
+MOTION_SEARCH_DEFINES = {
+    InterpolationQuality.MOTION: {"BLOCK_SIZE": 8, "SEARCH_RADIUS": 4, "SAMPLE_STEP": 2},
+    InterpolationQuality.MOTION_FINE: {"BLOCK_SIZE": 4, "SEARCH_RADIUS": 8, "SAMPLE_STEP": 1},
+}
+# the luma gets padded to a multiple of every block size, so the blocks cover all of it and iMotion spans the frame
+LUMA_SIZE_MULTIPLE = max(defines["BLOCK_SIZE"] for defines in MOTION_SEARCH_DEFINES.values())
+
+
+def padded_luma_size(size):
+    return -(-size // (LUMA_SCALE * LUMA_SIZE_MULTIPLE)) * LUMA_SIZE_MULTIPLE
+
+
+def create_frame_copy_texture(width, height):
+    texture = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_2D, texture)
+    # linear, because the warp samples in between the pixels
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+    # RGBA8, because RGB8 is not required to be color-renderable
+    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA8, width, height, 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
+    return texture
+
+
+class TimerQuery:
+    """
+    GL_TIME_ELAPSED around some passes, only ever collected when the result is there already.
+    """
+    def __init__(self):
+        self.query = glGenQueries(1)
+        self.pending_key = None
+        self.milliseconds = {}
+
+    def delete(self):
+        glDeleteQueries(1, [self.query])
+
+    def begin(self, key):
+        # returns whether it measures this time, it can't while the last result is still on its way
+        self.collect()
+        if self.pending_key is not None:
+            return False
+        glBeginQuery(GL_TIME_ELAPSED, self.query)
+        self.pending_key = key
+        return True
+
+    def end(self):
+        glEndQuery(GL_TIME_ELAPSED)
+
+    def collect(self):
+        if self.pending_key is None:
+            return
+        if not glGetQueryObjectiv(self.query, GL_QUERY_RESULT_AVAILABLE):
+            return
+        milliseconds = int(glGetQueryObjectui64v(self.query, GL_QUERY_RESULT)) * 1e-6
+        self.milliseconds.setdefault(self.pending_key, deque(maxlen=INTERPOLATION_STATS_WINDOW)).append(milliseconds)
+        self.pending_key = None
+
+    def mean(self, key):
+        values = self.milliseconds.get(key)
+        return sum(values) / len(values) if values else None
+
+
+class FrameInterpolator:
+    def __init__(self, vertex_shader: int, luma_shader_path: Path, search_shader_path: Path,
+                 compose_shader_path: Path, width: int, height: int):
+        self.vertex_shader = vertex_shader
+        self.search_shader_path = search_shader_path
+        self.width = width
+        self.height = height
+        # the luma shader scales the whole frame into whatever size this is
+        self.luma_width = padded_luma_size(width)
+        self.luma_height = padded_luma_size(height)
+
+        self.luma_program = self._compile(vertex_shader, luma_shader_path, {
+            "SAMPLES_PER_TEXEL": LUMA_SAMPLES_PER_TEXEL,
+        })
+        self.compose_program = self._compile(vertex_shader, compose_shader_path, {})
+        self.locations = {
+            "luma_frame": glGetUniformLocation(self.luma_program, "iPixelData"),
+            "luma_size": glGetUniformLocation(self.luma_program, "iSize"),
+            "compose_previous": glGetUniformLocation(self.compose_program, "iPreviousFrame"),
+            "compose_current": glGetUniformLocation(self.compose_program, "iCurrentFrame"),
+            "compose_motion": glGetUniformLocation(self.compose_program, "iMotion"),
+            "compose_phase": glGetUniformLocation(self.compose_program, "iPhase"),
+            "compose_use_motion": glGetUniformLocation(self.compose_program, "iUseMotion"),
+        }
+        # quality -> (program, locations, motion texture, width, height), compiled when first used
+        self.searches = {}
+
+        glActiveTexture(GL_TEXTURE0 + INTERPOLATION_TEXTURE_UNIT)
+        self.frames = [create_frame_copy_texture(width, height) for _ in range(2)]
+        self.lumas = [create_float_texture(self.luma_width, self.luma_height) for _ in range(2)]
+        self.output_texture = create_frame_copy_texture(width, height)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glActiveTexture(GL_TEXTURE0)
+        self.framebuffer = glGenFramebuffers(1)
+        self.read_framebuffer = glGenFramebuffers(1)
+        self._check_renderable([*self.frames, *self.lumas, self.output_texture])
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+        self.current = 0
+        self.pushed = 0
+        self.luma_pushed = False
+        self.current_at = None
+        self.interval_sec = None
+        # the quality whose motion texture belongs to the current pair of frames
+        self.motion_ready_for = None
+        self.last_phase = 0.
+
+        self.search_time = TimerQuery()
+        self.compose_time = TimerQuery()
+        self.composed = {}
+
+    @staticmethod
+    def _compile(vertex_shader, path, defines):
+        with open(path, 'r') as file:
+            fragment_shader = shaders.compileShader(inject_defines(file.read(), defines), GL_FRAGMENT_SHADER)
+        return shaders.compileProgram(vertex_shader, fragment_shader)
+
+    def _check_renderable(self, textures):
+        # once when they are made, instead of finding out by a black picture in the middle of the show.
+        # leaves our framebuffer bound, push() is in the middle of using it when a search gets compiled
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        for texture in textures:
+            glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, texture, 0)
+            status = glCheckFramebufferStatus(GL_FRAMEBUFFER)
+            if status != GL_FRAMEBUFFER_COMPLETE:
+                raise RuntimeError(f"Frame Interpolation cannot render into its textures, status {status:#x}")
+
+    def _search_for(self, quality):
+        if quality not in self.searches:
+            defines = MOTION_SEARCH_DEFINES[quality]
+            program = self._compile(self.vertex_shader, self.search_shader_path, defines)
+            width = self.luma_width // defines["BLOCK_SIZE"]
+            height = self.luma_height // defines["BLOCK_SIZE"]
+            glActiveTexture(GL_TEXTURE0 + INTERPOLATION_TEXTURE_UNIT)
+            texture = create_float_texture(width, height)
+            # the offsets get interpolated between the blocks, so the warp has no hard block edges
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+            glBindTexture(GL_TEXTURE_2D, 0)
+            glActiveTexture(GL_TEXTURE0)
+            self._check_renderable([texture])
+            locations = {
+                "current": glGetUniformLocation(program, "iCurrentLuma"),
+                "previous": glGetUniformLocation(program, "iPreviousLuma"),
+            }
+            self.searches[quality] = (program, locations, texture, width, height)
+        return self.searches[quality]
+
+    def delete(self):
+        self.search_time.delete()
+        self.compose_time.delete()
+        for program, _locations, texture, _width, _height in self.searches.values():
+            glDeleteProgram(program)
+            glDeleteTextures(1, [texture])
+        glDeleteFramebuffers(2, [self.framebuffer, self.read_framebuffer])
+        glDeleteTextures(5, [*self.frames, *self.lumas, self.output_texture])
+        glDeleteProgram(self.luma_program)
+        glDeleteProgram(self.compose_program)
+
+    def reset(self):
+        # e.g. after it was switched off, the frames it has are not the last ones anymore
+        self.pushed = 0
+        self.luma_pushed = False
+        self.current_at = None
+        self.interval_sec = None
+        self.motion_ready_for = None
+
+    @property
+    def ready(self):
+        return self.pushed > 0
+
+    def push(self, frame_texture, frame_width, frame_height, now_sec, quality, draw_quad):
+        """
+        With every newly captured frame (uploaded to frame_texture). draw_quad() renders the full screen quad.
+        Leaves the default framebuffer and viewport as they were, and texture unit 0 active.
+        """
+        if self.current_at is not None:
+            interval_sec = now_sec - self.current_at
+            if self.interval_sec is None:
+                self.interval_sec = interval_sec
+            else:
+                self.interval_sec += (interval_sec - self.interval_sec) * (1 - exp(-1 / INTERVAL_SMOOTHING_FRAMES))
+        self.current_at = now_sec
+        self.current = 1 - self.current
+        self.pushed += 1
+        self.motion_ready_for = None
+
+        viewport = glGetIntegerv(GL_VIEWPORT)
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.read_framebuffer)
+        glFramebufferTexture2D(GL_READ_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, frame_texture, 0)
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, self.framebuffer)
+        glFramebufferTexture2D(GL_DRAW_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.frames[self.current], 0)
+        glBlitFramebuffer(
+            0, 0, frame_width, frame_height,
+            0, 0, self.width, self.height,
+            GL_COLOR_BUFFER_BIT,
+            GL_LINEAR
+        )
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, 0)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+
+        if quality in MOTION_SEARCH_DEFINES:
+            measuring = self.search_time.begin(quality)
+            glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.lumas[self.current], 0)
+            glViewport(0, 0, self.luma_width, self.luma_height)
+            glUseProgram(self.luma_program)
+            glActiveTexture(GL_TEXTURE0 + INTERPOLATION_TEXTURE_UNIT)
+            glBindTexture(GL_TEXTURE_2D, self.frames[self.current])
+            glUniform1i(self.locations["luma_frame"], INTERPOLATION_TEXTURE_UNIT)
+            glUniform2i(self.locations["luma_size"], self.luma_width, self.luma_height)
+            draw_quad()
+            # the luma of the previous frame is only there if it was pushed with a motion quality, too
+            if self.pushed > 1 and self.luma_pushed:
+                self._search(quality, draw_quad)
+            if measuring:
+                self.search_time.end()
+            glBindTexture(GL_TEXTURE_2D, 0)
+            glActiveTexture(GL_TEXTURE0)
+        self.luma_pushed = quality in MOTION_SEARCH_DEFINES
+
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        glViewport(*viewport)
+
+    def _search(self, quality, draw_quad):
+        program, locations, texture, width, height = self._search_for(quality)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, texture, 0)
+        glViewport(0, 0, width, height)
+        glUseProgram(program)
+        glActiveTexture(GL_TEXTURE0 + INTERPOLATION_TEXTURE_UNIT)
+        glBindTexture(GL_TEXTURE_2D, self.lumas[self.current])
+        glActiveTexture(GL_TEXTURE0 + INTERPOLATION_TEXTURE_UNIT + 1)
+        glBindTexture(GL_TEXTURE_2D, self.lumas[1 - self.current])
+        glUniform1i(locations["current"], INTERPOLATION_TEXTURE_UNIT)
+        glUniform1i(locations["previous"], INTERPOLATION_TEXTURE_UNIT + 1)
+        draw_quad()
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glActiveTexture(GL_TEXTURE0 + INTERPOLATION_TEXTURE_UNIT)
+        self.motion_ready_for = quality
+
+    def phase(self, now_sec):
+        if self.pushed < 2 or not self.interval_sec:
+            return 1.
+        # a late frame just means the current one stays a bit longer
+        return min(max((now_sec - self.current_at) / self.interval_sec, 0.), 1.)
+
+    def compose(self, now_sec, quality, draw_quad):
+        """
+        Every display frame, renders the picture in between the previous and the current frame into
+        output_texture. Leaves the default framebuffer and viewport as they were, and texture unit 0 active.
+        """
+        self.last_phase = self.phase(now_sec)
+        use_motion = self.motion_ready_for is quality
+        viewport = glGetIntegerv(GL_VIEWPORT)
+        measuring = self.compose_time.begin(quality)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.output_texture, 0)
+        glViewport(0, 0, self.width, self.height)
+        glUseProgram(self.compose_program)
+        glActiveTexture(GL_TEXTURE0 + INTERPOLATION_TEXTURE_UNIT)
+        glBindTexture(GL_TEXTURE_2D, self.frames[1 - self.current])
+        glActiveTexture(GL_TEXTURE0 + INTERPOLATION_TEXTURE_UNIT + 1)
+        glBindTexture(GL_TEXTURE_2D, self.frames[self.current])
+        glActiveTexture(GL_TEXTURE0 + INTERPOLATION_TEXTURE_UNIT + 2)
+        glBindTexture(GL_TEXTURE_2D, self.searches[quality][2] if use_motion else 0)
+        glUniform1i(self.locations["compose_previous"], INTERPOLATION_TEXTURE_UNIT)
+        glUniform1i(self.locations["compose_current"], INTERPOLATION_TEXTURE_UNIT + 1)
+        glUniform1i(self.locations["compose_motion"], INTERPOLATION_TEXTURE_UNIT + 2)
+        glUniform1f(self.locations["compose_phase"], self.last_phase)
+        glUniform1i(self.locations["compose_use_motion"], use_motion)
+        draw_quad()
+        for unit in range(3):
+            glActiveTexture(GL_TEXTURE0 + INTERPOLATION_TEXTURE_UNIT + unit)
+            glBindTexture(GL_TEXTURE_2D, 0)
+        glActiveTexture(GL_TEXTURE0)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        glViewport(*viewport)
+        if measuring:
+            self.compose_time.end()
+        self.composed[quality] = self.composed.get(quality, 0) + 1
+
+    def summary(self):
+        self.search_time.collect()
+        self.compose_time.collect()
+        return {
+            "capture_interval_ms": None if self.interval_sec is None else 1000 * self.interval_sec,
+            "phase": self.last_phase,
+            "levels": {
+                quality.value: {
+                    "frames": self.composed.get(quality, 0),
+                    "search_gpu_ms": self.search_time.mean(quality),
+                    "compose_gpu_ms": self.compose_time.mean(quality),
+                }
+                for quality in InterpolationQuality
+                if quality in self.composed
+            },
+        }
+
+    def debug_lines(self, quality):
+        summary = self.summary()
+        interval = summary["capture_interval_ms"]
+        lines = [
+            f"Interpolation: {quality.value} (I), phase {summary['phase']:.2f}"
+            + ("" if interval is None else f", captured every {interval:.1f} ms")
+        ]
+        for name, level in summary["levels"].items():
+            costs = [
+                f"{label} {level[key]:.3f} ms"
+                for label, key in [("search", "search_gpu_ms"), ("compose", "compose_gpu_ms")]
+                if level[key] is not None
+            ]
+            lines.append(f"  {name}: {level['frames']} frames, GPU " + (", ".join(costs) or "?"))
+        return lines
+
+    def print_debug(self, quality):
+        for line in self.debug_lines(quality):
+            print(line)
@@ -0,0 +1,260 @@
+"""
+Raw frame store: for replaying a show without the original camera and without any video decoding.
+
+File layout:
+  [ header, padded to HEADER_SIZE ]
+  [ frame 0 ][ frame 1 ] ... [ frame N-1 ]   <-- each exactly width * height * channels bytes, BGR uint8
+  [ timestamps, N x float64 ]                <-- seconds since the recording started
+  [ events, JSON, one entry per frame ]      <-- EffectsState snapshot, dry / wet, shader time
+
+The index and events are written when the recording is closed, then the header is rewritten to point to them.
+If the program died before that, the frames are still usable, the player then just assumes the nominal fps.
+"""
+
+import json
+import mmap
+import struct
+from dataclasses import dataclass, field
+from pathlib import Path
+from queue import Queue, Full
+from threading import Thread
+from time import perf_counter, sleep
+from typing import Optional
+
+import numpy as np
+
+from gmae.utils import log
+
+MAGIC = b"GMAEFRMS"
+VERSION = 1
+HEADER_SIZE = 4096
+# magic, version, width, height, channels, fps, frame_count, index_offset, events_offset, events_length, name
+HEADER_FORMAT = "<8sIIIIdQQQQ256s"
+
+RECORDER_QUEUE_SIZE = 120
+
+
+@dataclass
+class FrameStoreHeader:
+    width: int
+    height: int
+    channels: int = 3
+    fps: float = 30.
+    frame_count: int = 0
+    index_offset: int = 0
+    events_offset: int = 0
+    events_length: int = 0
+    name: str = ""
+
+    @property
+    def frame_size(self):
+        return self.width * self.height * self.channels
+
+    def pack(self):
+        packed = struct.pack(
+            HEADER_FORMAT,
+            MAGIC,
+            VERSION,
+            self.width,
+            self.height,
+            self.channels,
+            self.fps,
+            self.frame_count,
+            self.index_offset,
+            self.events_offset,
+            self.events_length,
+            self.name.encode("utf-8")[:256],
+        )
+        return packed.ljust(HEADER_SIZE, b"\0")
+
+    @classmethod
+    def unpack(cls, buffer):
+        magic, version, width, height, channels, fps, frame_count, index_offset, events_offset, events_length, name = \
+            struct.unpack_from(HEADER_FORMAT, buffer)
+        if magic != MAGIC:
+            raise ValueError("This is not a GMAE frame store.")
+        if version != VERSION:
+            raise ValueError(f"Frame store version {version} not supported (need {VERSION})")
+        return cls(
+            width=width,
+            height=height,
+            channels=channels,
+            fps=fps,
+            frame_count=frame_count,
+            index_offset=index_offset,
+            events_offset=events_offset,
+            events_length=events_length,
+            name=name.rstrip(b"\0").decode("utf-8"),
+        )
+
+
+@dataclass
+class FrameEvent:
+    # what the Processor needs to do the exact same thing again on replay
+    elapsed_seconds: float = 0
+    # the effects snapshot covers what the keys did, so they are not recorded on their own
+    effects: dict = field(default_factory=dict)
+    use_dry_program: bool = False
+
+
+class FrameStoreRecorder:
+    """
+    Writes frames on a background thread so the render loop never waits for the disk.
+    If the disk cannot keep up, frames are dropped (and counted) rather than stalling the show.
+    """
+    def __init__(self, path, capture_info):
+        self.path = Path(path)
+        self.header = FrameStoreHeader(
+            width=capture_info.width,
+            height=capture_info.height,
+            fps=capture_info.fps or 30.,
+            name=capture_info.name,
+        )
+        self.file = open(self.path, "wb")
+        self.file.write(self.header.pack())
+        self.timestamps = []
+        self.events = []
+        self.dropped_frames = 0
+        self.started_at = None
+        self.queue = Queue(maxsize=RECORDER_QUEUE_SIZE)
+        self.thread = Thread(target=self._write_loop, name="FrameStoreRecorder", daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, _val, _tb):
+        self.close()
+
+    def write(self, frame, event: FrameEvent):
+        if frame.shape != (self.header.height, self.header.width, self.header.channels):
+            raise ValueError(f"Frame of shape {frame.shape} does not fit into this store")
+        if self.started_at is None:
+            self.started_at = perf_counter()
+        timestamp = perf_counter() - self.started_at
+        if frame.base is not None:
+            # a view into memory that gets reused (e.g. a shared memory slot of the preprocessor), which
+            # would be overwritten before the writer thread gets to it. cv2 gives us a fresh array each read.
+            frame = frame.copy()
+        try:
+            self.queue.put_nowait((frame, timestamp, event))
+        except Full:
+            self.dropped_frames += 1
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            frame, timestamp, event = item
+            self.file.write(np.ascontiguousarray(frame).data)
+            self.timestamps.append(timestamp)
+            self.events.append(event.__dict__)
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.queue.put(None)
+        self.thread.join()
+
+        self.header.frame_count = len(self.timestamps)
+        self.header.index_offset = self.file.tell()
+        self.file.write(np.array(self.timestamps, dtype=np.float64).tobytes())
+        events = json.dumps(self.events).encode("utf-8")
+        self.header.events_offset = self.file.tell()
+        self.header.events_length = len(events)
+        self.file.write(events)
+        self.file.seek(0)
+        self.file.write(self.header.pack())
+        self.file.close()
+
+        log(f"Recorded {self.header.frame_count} frames to {self.path} ({self.dropped_frames} dropped)")
+
+
+class FrameStorePlayer:
+    """
+    Plays a frame store back, behaving enough like cv2.VideoCapture that the Processor doesn't care.
+    The frames are numpy views straight into the memory map, i.e. nothing is copied or decoded.
+    """
+    def __init__(self, path, realtime=True):
+        self.path = Path(path)
+        self.realtime = realtime
+        self.file = open(self.path, "rb")
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.header = FrameStoreHeader.unpack(self.mmap)
+
+        frame_count = self.header.frame_count
+        if self.header.index_offset == 0:
+            print("Frame store was not closed properly, assume nominal fps:", self.path)
+            frame_count = (len(self.mmap) - HEADER_SIZE) // self.header.frame_size
+            self.timestamps = np.arange(frame_count) / self.header.fps
+            self.events = []
+        else:
+            self.timestamps = np.frombuffer(
+                self.mmap,
+                dtype=np.float64,
+                count=frame_count,
+                offset=self.header.index_offset
+            )
+            events_end = self.header.events_offset + self.header.events_length
+            self.events = [
+                FrameEvent(**event)
+                for event in json.loads(self.mmap[self.header.events_offset:events_end])
+            ]
+
+        self.frames = np.ndarray(
+            shape=(frame_count, self.header.height, self.header.width, self.header.channels),
+            dtype=np.uint8,
+            buffer=self.mmap,
+            offset=HEADER_SIZE,
+        )
+        self.position = 0
+        self.current_event: Optional[FrameEvent] = None
+        self.started_at = None
+
+    def __len__(self):
+        return len(self.frames)
+
+    def isOpened(self):
+        return not self.file.closed
+
+    def get(self, prop):
+        import cv2
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.header.width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.header.height
+        if prop == cv2.CAP_PROP_FPS:
+            return self.header.fps
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return len(self.frames)
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self.position
+        return 0
+
+    def read(self):
+        if self.position >= len(self.frames):
+            return False, None
+        if self.realtime:
+            if self.started_at is None:
+                self.started_at = perf_counter() - self.timestamps[self.position]
+            wait_sec = self.timestamps[self.position] - (perf_counter() - self.started_at)
+            if wait_sec > 0:
+                sleep(wait_sec)
+        frame = self.frames[self.position]
+        self.current_event = self.events[self.position] if self.position < len(self.events) else None
+        self.position += 1
+        return True, frame
+
+    def release(self):
+        if self.file.closed:
+            return
+        # the numpy views keep the mmap exported, so drop them first
+        self.frames = None
+        self.timestamps = None
+        try:
+            self.mmap.close()
+        except BufferError:
+            # someone still holds a frame, the mmap goes away with that then
+            pass
+        self.file.close()
@@ -0,0 +1,137 @@
+"""
+Every PyOpenGL call costs a few microseconds on the Python side, whether it changes anything or not.
+GLState remembers the bound program, textures, vertex array, viewport and the uniform values per program,
+and skips the calls that would not change anything. It also counts the calls it lets through
+and the time they take, per frame - with caching=False it issues everything, to compare.
+
+Only the render path of the Processor (and the color LUT baking within it) goes through here. The overlay,
+the auto levels etc. do their own raw GL calls, so after they ran, invalidate() forgets what was bound (but not
+the uniform values, these belong to programs that nobody else touches, and not the viewport, they all put that
+back as it was).
+"""
+
+from collections import deque
+from time import perf_counter
+
+from OpenGL.GL import *
+
+GL_STATS_WINDOW = 120
+
+
+class GLState:
+    def __init__(self, caching=True):
+        self.caching = caching
+        self.program = None
+        self.active_unit = None
+        self.vertex_array = None
+        # (x, y, width, height)
+        self.viewport_rect = None
+        # (unit, target) -> texture
+        self.textures = {}
+        # (program, location) -> values
+        self.uniforms = {}
+
+        self.calls = 0
+        self.skipped = 0
+        self.gl_sec = 0.
+        # (calls, skipped, seconds) of the last frames
+        self.frames = deque(maxlen=GL_STATS_WINDOW)
+
+    def call(self, func, *args):
+        started_at = perf_counter()
+        result = func(*args)
+        self.gl_sec += perf_counter() - started_at
+        self.calls += 1
+        return result
+
+    def _unchanged(self, cached, value):
+        if self.caching and cached == value:
+            self.skipped += 1
+            return True
+        return False
+
+    def use_program(self, program):
+        if self._unchanged(self.program, program):
+            return
+        self.call(glUseProgram, program)
+        self.program = program
+
+    def active_texture(self, unit):
+        if self._unchanged(self.active_unit, unit):
+            return
+        self.call(glActiveTexture, GL_TEXTURE0 + unit)
+        self.active_unit = unit
+
+    def bind_texture(self, unit, target, texture):
+        if self._unchanged(self.textures.get((unit, target)), texture):
+            return
+        self.active_texture(unit)
+        self.call(glBindTexture, target, texture)
+        self.textures[(unit, target)] = texture
+
+    def bind_vertex_array(self, vertex_array):
+        if self._unchanged(self.vertex_array, vertex_array):
+            return
+        self.call(glBindVertexArray, vertex_array)
+        self.vertex_array = vertex_array
+
+    def viewport(self, x, y, width, height):
+        rect = (x, y, width, height)
+        if self._unchanged(self.viewport_rect, rect):
+            return
+        self.call(glViewport, *rect)
+        self.viewport_rect = rect
+
+    def uniform(self, setter, location, *values):
+        """
+        e.g. uniform(glUniform1f, location, 0.5), for the currently used program.
+        """
+        if location is None or location < 0:
+            # the shader doesn't have (or optimized away) that uniform, GL would ignore it anyway
+            self.skipped += 1
+            return
+        key = (self.program, location)
+        if self._unchanged(self.uniforms.get(key), values):
+            return
+        self.call(setter, location, *values)
+        self.uniforms[key] = values
+
+    def invalidate(self):
+        self.program = None
+        self.active_unit = None
+        self.vertex_array = None
+        self.textures.clear()
+
+    def forget_program(self, program):
+        self.uniforms = {
+            key: values
+            for key, values in self.uniforms.items()
+            if key[0] != program
+        }
+        if self.program == program:
+            self.program = None
+
+    def end_frame(self):
+        self.frames.append((self.calls, self.skipped, self.gl_sec))
+        self.calls = 0
+        self.skipped = 0
+        self.gl_sec = 0.
+
+    def summary(self):
+        if not self.frames:
+            return {"caching": self.caching}
+        count = len(self.frames)
+        return {
+            "caching": self.caching,
+            "calls_per_frame": sum(frame[0] for frame in self.frames) / count,
+            "skipped_per_frame": sum(frame[1] for frame in self.frames) / count,
+            "gl_ms_per_frame": 1000 * sum(frame[2] for frame in self.frames) / count,
+        }
+
+    def debug_line(self):
+        summary = self.summary()
+        caching = "cached" if self.caching else "uncached"
+        if "calls_per_frame" not in summary:
+            return f"GL Calls ({caching}): nothing yet"
+        return (f"GL Calls ({caching}): {summary['calls_per_frame']:.1f} per frame, "
+                f"{summary['skipped_per_frame']:.1f} skipped, {summary['gl_ms_per_frame']:.3f} ms in Python")
@@ -0,0 +1,157 @@
+"""
+Precomputed lookup textures for frag.glsl, so that the shader doesn't have to
+recompute its rand() / hash12() / Bayer values with sin, fract and loops for every pixel.
+The blue noise is there for the DITHER_BLUE_NOISE variant of effectD.
+
+The tables are generated vectorized in numpy (same formulas as in the shader, on the integer lattice)
+and cached on disk, so startup doesn't pay for them twice.
+"""
+
+from dataclasses import dataclass
+from os import getenv
+from pathlib import Path
+
+import numpy as np
+from OpenGL.GL import *
+
+from gmae.utils import log
+
+NOISE_LOOKUP_SIZE = 256
+BLUE_NOISE_SIZE = 64
+BLUE_NOISE_ITERATIONS = 24
+# frag.glsl uses MAX_LEVEL = 4, i.e. the Bayer pattern repeats every 2^4 pixels
+BAYER_LEVEL = 4
+
+CACHE_VERSION = 1
+CACHE_FOLDER = Path(getenv('GMAE_CACHE_DIR', Path.home() / ".cache" / "gmae"))
+
+
+class LookupUnit:
+    # texture unit 0 is the captured frame (iPixelData)
+    NOISE = 1
+    BLUE_NOISE = 2
+    BAYER = 3
+
+
+def fract(x):
+    return x - np.floor(x)
+
+
+def rand_lattice(size):
+    # float rand(vec2 c), evaluated on all integer points of one tile
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32)
+    dot = x * np.float32(12.9898) + y * np.float32(78.233)
+    return fract(np.sin(dot) * np.float32(43758.5453)).astype(np.float32)
+
+
+def hash12_lattice(size):
+    # float hash12(vec2 p), evaluated on all integer points of one tile
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32)
+    p3 = fract(np.stack([x, y, x]) * np.float32(.1031))
+    p3_yzx = p3[[1, 2, 0]] + np.float32(33.33)
+    p3 = p3 + (p3 * p3_yzx).sum(axis=0)
+    return fract((p3[0] + p3[1]) * p3[2]).astype(np.float32)
+
+
+def value_noise_texture(size=NOISE_LOOKUP_SIZE):
+    # R = rand() for noise(), G = hash12() for lfnoise(). tileable by construction (GL_REPEAT)
+    return np.dstack([rand_lattice(size), hash12_lattice(size)])
+
+
+def bayer_texture(level=BAYER_LEVEL):
+    # exactly what GetBayerFromCoordLevel() computes, for one period of the pattern
+    size = 1 << level
+    y, x = np.mgrid[0:size, 0:size]
+    result = np.zeros((size, size), dtype=np.int32)
+    for _ in range(level):
+        tx, ty = x & 1, y & 1
+        result = result * 4 | (tx ^ ty) * 2 | tx
+        x, y = x // 2, y // 2
+    return (result / float(1 << (2 * level))).astype(np.float32)
+
+
+def blue_noise_texture(size=BLUE_NOISE_SIZE, iterations=BLUE_NOISE_ITERATIONS, seed=210):
+    """
+    Not the real void-and-cluster, but close enough for dithering and a lot faster:
+    high-pass the noise in the frequency domain (periodic, so it tiles), then re-rank it
+    to a uniform distribution again, and repeat.
+    """
+    rng = np.random.default_rng(seed)
+    values = rng.random((size, size))
+    fy = np.fft.fftfreq(size)[:, None]
+    fx = np.fft.fftfreq(size)[None, :]
+    high_pass = 1 - np.exp(-(fx * fx + fy * fy) / (2 * 0.08 ** 2))
+    ranks = np.empty(size * size)
+    for _ in range(iterations):
+        filtered = np.fft.ifft2(np.fft.fft2(values) * high_pass).real
+        ranks[np.argsort(filtered, axis=None)] = np.arange(size * size)
+        values = ranks.reshape(size, size) / (size * size - 1)
+    return values.astype(np.float32)
+
+
+def cached(name, generate):
+    path = CACHE_FOLDER / f"{name}_v{CACHE_VERSION}.npy"
+    try:
+        return np.load(path)
+    except (OSError, ValueError):
+        pass
+    data = generate()
+    try:
+        CACHE_FOLDER.mkdir(parents=True, exist_ok=True)
+        np.save(path, data)
+    except OSError as exc:
+        print("Could not cache lookup texture", path, exc)
+    return data
+
+
+def upload_float_texture(data, unit, filter, wrap=GL_REPEAT):
+    channels = 1 if data.ndim == 2 else data.shape[2]
+    internal_format, pixel_format = {
+        1: (GL_R32F, GL_RED),
+        2: (GL_RG32F, GL_RG),
+    }[channels]
+    texture = glGenTextures(1)
+    glActiveTexture(GL_TEXTURE0 + unit)
+    glBindTexture(GL_TEXTURE_2D, texture)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, wrap)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, wrap)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, filter)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, filter)
+    glTexImage2D(
+        GL_TEXTURE_2D,
+        0,
+        internal_format,
+        data.shape[1],
+        data.shape[0],
+        0,
+        pixel_format,
+        GL_FLOAT,
+        np.ascontiguousarray(data)
+    )
+    glActiveTexture(GL_TEXTURE0)
+    return texture
+
+
+@dataclass
+class LookupTextures:
+    noise: int
+    blue_noise: int
+    bayer: int
+
+    @classmethod
+    def create(cls):
+        # GL context needs to be current. these stay bound to their units for the whole run.
+        noise = cached(f"noise_{NOISE_LOOKUP_SIZE}", value_noise_texture)
+        blue_noise = cached(f"blue_noise_{BLUE_NOISE_SIZE}", blue_noise_texture)
+        bayer = cached(f"bayer_{BAYER_LEVEL}", bayer_texture)
+        result = cls(
+            # LINEAR, so one fetch does the interpolation between four lattice values
+            noise=upload_float_texture(noise, LookupUnit.NOISE, GL_LINEAR),
+            blue_noise=upload_float_texture(blue_noise, LookupUnit.BLUE_NOISE, GL_NEAREST),
+            bayer=upload_float_texture(bayer, LookupUnit.BAYER, GL_NEAREST),
+        )
+        log("Created Lookup Textures")
+        return result
+
+    def delete(self):
+        glDeleteTextures(3, [self.noise, self.blue_noise, self.bayer])
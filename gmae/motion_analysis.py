@@ -0,0 +1,278 @@
+"""
+Motion analysis of the captured frames on the GPU, so the effects can react to what the camera sees.
+
+Two small passes after every upload:
+    1. luma: the frame goes down to MOTION_LUMA_WIDTH x MOTION_LUMA_HEIGHT luma, into one of two textures
+             (ping-pong), so the one of the previous frame is still there
+    2. grid: MOTION_GRID_X x MOTION_GRID_Y fragments, each one is the (mean, max, signed mean) luma difference
+             between the current and the previous frame within its cell
+Only that grid goes back to the CPU, through pixel buffer objects: glReadPixels into a PBO returns right away,
+a fence tells when the copy is done, and only then the buffer gets mapped. So the readings arrive a frame or two
+late, but the CPU never waits for the GPU - if all buffers are still in flight, that frame just isn't read back.
+"""
+
+import ctypes
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.GL import shaders
+from OpenGL.raw.GL.VERSION.GL_1_0 import glReadPixels as glReadPixelsIntoBuffer
+
+from gmae.auto_levels import create_float_texture
+from gmae.utils import inject_defines
+
+# only bound while the passes run
+MOTION_TEXTURE_UNIT = 10
+MOTION_LUMA_WIDTH = 128
+MOTION_LUMA_HEIGHT = 72
+MOTION_SAMPLES_PER_TEXEL = 4
+# has to divide the luma size
+MOTION_GRID_X = 16
+MOTION_GRID_Y = 9
+MOTION_READBACK_BUFFERS = 3
+# a cell with more mean difference than this counts as moving
+MOTION_CELL_THRESHOLD = 0.03
+MOTION_STATS_WINDOW = 120
+
+
+@dataclass
+class MotionReading:
+    energy: float
+    peak: float
+    coverage: float
+    brightening: float
+    grid: np.ndarray
+    frames_late: int
+
+
+class MotionAnalysis:
+    def __init__(self, vertex_shader: int, luma_shader_path: Path, grid_shader_path: Path):
+        self.luma_program = self._compile(vertex_shader, luma_shader_path, {
+            "SAMPLES_PER_TEXEL": MOTION_SAMPLES_PER_TEXEL,
+        })
+        self.grid_program = self._compile(vertex_shader, grid_shader_path, {})
+        self.locations = {
+            "luma_frame": glGetUniformLocation(self.luma_program, "iPixelData"),
+            "luma_size": glGetUniformLocation(self.luma_program, "iSize"),
+            "grid_current": glGetUniformLocation(self.grid_program, "iCurrentLuma"),
+            "grid_previous": glGetUniformLocation(self.grid_program, "iPreviousLuma"),
+            "grid_size": glGetUniformLocation(self.grid_program, "iGrid"),
+        }
+
+        glActiveTexture(GL_TEXTURE0 + MOTION_TEXTURE_UNIT)
+        self.luma_textures = [create_float_texture(MOTION_LUMA_WIDTH, MOTION_LUMA_HEIGHT) for _ in range(2)]
+        self.grid_texture = create_float_texture(MOTION_GRID_X, MOTION_GRID_Y)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glActiveTexture(GL_TEXTURE0)
+        self.framebuffer = glGenFramebuffers(1)
+        self.current = 0
+        self.updates = 0
+
+        self.buffer_size = MOTION_GRID_X * MOTION_GRID_Y * 4 * sizeof(GLfloat)
+        self.buffers = list(glGenBuffers(MOTION_READBACK_BUFFERS))
+        for buffer in self.buffers:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, buffer)
+            glBufferData(GL_PIXEL_PACK_BUFFER, self.buffer_size, None, GL_STREAM_READ)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self.free_buffers = deque(self.buffers)
+        # (buffer, fence, number of the update it belongs to), oldest first
+        self.pending = deque()
+
+        self.latest = None
+        self.unseen = False
+        self.readings = 0
+        self.skipped_readbacks = 0
+        self.cpu_ms = deque(maxlen=MOTION_STATS_WINDOW)
+
+        self.query = glGenQueries(1)
+        self.query_pending = False
+        self.last_gpu_ms = None
+
+    @staticmethod
+    def _compile(vertex_shader, path, defines):
+        with open(path, 'r') as file:
+            fragment_shader = shaders.compileShader(inject_defines(file.read(), defines), GL_FRAGMENT_SHADER)
+        return shaders.compileProgram(vertex_shader, fragment_shader)
+
+    def delete(self):
+        for _buffer, fence, _update in self.pending:
+            glDeleteSync(fence)
+        glDeleteBuffers(len(self.buffers), self.buffers)
+        glDeleteQueries(1, [self.query])
+        glDeleteFramebuffers(1, [self.framebuffer])
+        glDeleteTextures(3, [*self.luma_textures, self.grid_texture])
+        glDeleteProgram(self.luma_program)
+        glDeleteProgram(self.grid_program)
+
+    def reset(self):
+        # e.g. after it was switched off for a while, the previous luma is not the previous frame anymore,
+        # and neither are the readings still on their way back (they would come in as one burst of motion)
+        while self.pending:
+            buffer, fence, _update = self.pending.popleft()
+            glDeleteSync(fence)
+            self.free_buffers.append(buffer)
+        self.latest = None
+        self.unseen = False
+        self.updates = 0
+
+    def update(self, frame_texture, draw_quad):
+        """
+        To call after a new frame got uploaded (to texture unit 0). draw_quad() renders the full screen quad.
+        Leaves the default framebuffer and viewport as they were, and texture unit 0 active.
+        """
+        started_at = perf_counter()
+        self._collect()
+        viewport = glGetIntegerv(GL_VIEWPORT)
+        if not self.query_pending:
+            glBeginQuery(GL_TIME_ELAPSED, self.query)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+
+        previous = self.luma_textures[self.current]
+        self.current = 1 - self.current
+        current = self.luma_textures[self.current]
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, current, 0)
+        glViewport(0, 0, MOTION_LUMA_WIDTH, MOTION_LUMA_HEIGHT)
+        glUseProgram(self.luma_program)
+        glActiveTexture(GL_TEXTURE0)
+        glBindTexture(GL_TEXTURE_2D, frame_texture)
+        glUniform1i(self.locations["luma_frame"], 0)
+        glUniform2i(self.locations["luma_size"], MOTION_LUMA_WIDTH, MOTION_LUMA_HEIGHT)
+        draw_quad()
+
+        # the very first frame has nothing to compare with
+        if self.updates > 0:
+            glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.grid_texture, 0)
+            glViewport(0, 0, MOTION_GRID_X, MOTION_GRID_Y)
+            glUseProgram(self.grid_program)
+            glActiveTexture(GL_TEXTURE0 + MOTION_TEXTURE_UNIT)
+            glBindTexture(GL_TEXTURE_2D, current)
+            glActiveTexture(GL_TEXTURE0 + MOTION_TEXTURE_UNIT + 1)
+            glBindTexture(GL_TEXTURE_2D, previous)
+            glUniform1i(self.locations["grid_current"], MOTION_TEXTURE_UNIT)
+            glUniform1i(self.locations["grid_previous"], MOTION_TEXTURE_UNIT + 1)
+            glUniform2i(self.locations["grid_size"], MOTION_GRID_X, MOTION_GRID_Y)
+            draw_quad()
+            glBindTexture(GL_TEXTURE_2D, 0)
+            glActiveTexture(GL_TEXTURE0 + MOTION_TEXTURE_UNIT)
+            glBindTexture(GL_TEXTURE_2D, 0)
+            glActiveTexture(GL_TEXTURE0)
+            self._read_back()
+
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        glViewport(*viewport)
+        if not self.query_pending:
+            glEndQuery(GL_TIME_ELAPSED)
+            self.query_pending = True
+        self.updates += 1
+        self.cpu_ms.append(1000 * (perf_counter() - started_at))
+
+    def _read_back(self):
+        if not self.free_buffers:
+            self.skipped_readbacks += 1
+            return
+        buffer = self.free_buffers.popleft()
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, buffer)
+        # with a pack buffer bound, the last argument is the offset into it, and this returns without waiting
+        glReadPixelsIntoBuffer(0, 0, MOTION_GRID_X, MOTION_GRID_Y, GL_RGBA, GL_FLOAT, ctypes.c_void_p(0))
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        fence = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        self.pending.append((buffer, fence, self.updates))
+
+    def _collect(self):
+        self._collect_gpu_time()
+        while self.pending:
+            buffer, fence, update = self.pending[0]
+            # a timeout of 0 only asks, it never waits
+            status = glClientWaitSync(fence, 0, 0)
+            if status == GL_TIMEOUT_EXPIRED:
+                # the fences finish in order, so the later ones aren't done either
+                return
+            self.pending.popleft()
+            glDeleteSync(fence)
+            if status != GL_WAIT_FAILED:
+                self.latest = self._reading(self._map_buffer(buffer), self.updates - update)
+                self.unseen = True
+                self.readings += 1
+            self.free_buffers.append(buffer)
+
+    def _collect_gpu_time(self):
+        if not self.query_pending:
+            return
+        if not glGetQueryObjectiv(self.query, GL_QUERY_RESULT_AVAILABLE):
+            return
+        self.last_gpu_ms = int(glGetQueryObjectui64v(self.query, GL_QUERY_RESULT)) * 1e-6
+        self.query_pending = False
+
+    def _map_buffer(self, buffer):
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, buffer)
+        address = glMapBufferRange(GL_PIXEL_PACK_BUFFER, 0, self.buffer_size, GL_MAP_READ_BIT)
+        floats = (ctypes.c_float * (MOTION_GRID_X * MOTION_GRID_Y * 4)).from_address(address)
+        # copied, the mapping is gone after the unmap
+        data = np.ctypeslib.as_array(floats).copy()
+        glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        # the rows come bottom first, like everything from GL
+        return data.reshape(MOTION_GRID_Y, MOTION_GRID_X, 4)[::-1]
+
+    @staticmethod
+    def _reading(data, frames_late):
+        grid = data[..., 0]
+        return MotionReading(
+            energy=float(grid.mean()),
+            peak=float(grid.max()),
+            coverage=float(np.count_nonzero(grid > MOTION_CELL_THRESHOLD)) / grid.size,
+            brightening=float(data[..., 2].mean()),
+            grid=grid,
+            frames_late=frames_late,
+        )
+
+    def poll(self):
+        """
+        The newest reading that arrived since the last poll, or None. Never waits.
+        """
+        self._collect()
+        if not self.unseen:
+            return None
+        self.unseen = False
+        return self.latest
+
+    def summary(self):
+        reading = self.latest
+        return {
+            "readings": self.readings,
+            "skipped_readbacks": self.skipped_readbacks,
+            "in_flight": len(self.pending),
+            "gpu_ms": self.last_gpu_ms,
+            "cpu_ms": sum(self.cpu_ms) / len(self.cpu_ms) if self.cpu_ms else None,
+            "energy": None if reading is None else reading.energy,
+            "peak": None if reading is None else reading.peak,
+            "coverage": None if reading is None else reading.coverage,
+            "frames_late": None if reading is None else reading.frames_late,
+        }
+
+    def debug_lines(self):
+        summary = self.summary()
+        if summary["energy"] is None:
+            return ["Motion: nothing read back yet"]
+        gpu_time = "?" if summary["gpu_ms"] is None else f"{summary['gpu_ms']:.3f}"
+        return [
+            f"Motion: energy {summary['energy']:.4f}, peak {summary['peak']:.4f}, "
+            f"{100 * summary['coverage']:.0f}% moving, {summary['frames_late']} frames late",
+            f"  GPU {gpu_time} ms, CPU {summary['cpu_ms']:.3f} ms, "
+            f"{summary['skipped_readbacks']} readbacks skipped",
+        ]
+
+    def print_debug(self):
+        for line in self.debug_lines():
+            print(line)
+        if self.latest is None:
+            return
+        # the grid as ASCII art, more dense means more motion
+        shades = " .:-=+*#%@"
+        for row in self.latest.grid:
+            levels = np.clip(row / (2 * MOTION_CELL_THRESHOLD) * (len(shades) - 1), 0, len(shades) - 1)
+            print("  |" + "".join(shades[int(level)] for level in levels) + "|")
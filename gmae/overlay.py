@@ -0,0 +1,206 @@
+"""
+Text overlay on top of the output, so that errors and debug info never need a blocking message box.
+
+The glyphs are drawn once into an atlas texture (with cv2.putText, so no font dependency),
+every visible character becomes a quad, and all the quads (plus a dark background per panel)
+go out in one single draw call. The vertices are only rebuilt when some text changed.
+When nothing is shown, nothing is drawn at all.
+"""
+
+import ctypes
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.GL import shaders
+
+OVERLAY_TEXTURE_UNIT = 5
+
+FIRST_CHAR = 32
+LAST_CHAR = 126
+# the cell after the last char is just filled, for the background quads
+SOLID_CELL = LAST_CHAR + 1 - FIRST_CHAR
+ATLAS_COLUMNS = 16
+
+CELL_WIDTH = 14
+CELL_HEIGHT = 20
+CHAR_ADVANCE = 10
+LINE_HEIGHT = 22
+PANEL_PADDING = 8
+MARGIN = 16
+
+BACKGROUND_COLOR = (0., 0., 0., .75)
+# x, y, u, v, r, g, b, a
+FLOATS_PER_VERTEX = 8
+
+
+@dataclass
+class OverlayPanel:
+    lines: list
+    color: tuple
+
+
+def build_glyph_atlas():
+    import cv2
+    cells = SOLID_CELL + 1
+    rows = (cells + ATLAS_COLUMNS - 1) // ATLAS_COLUMNS
+    atlas = np.zeros((rows * CELL_HEIGHT, ATLAS_COLUMNS * CELL_WIDTH), dtype=np.uint8)
+    for index in range(SOLID_CELL):
+        char = chr(FIRST_CHAR + index)
+        row, column = divmod(index, ATLAS_COLUMNS)
+        (width, _height), _baseline = cv2.getTextSize(char, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
+        cv2.putText(
+            atlas,
+            char,
+            (column * CELL_WIDTH + (CELL_WIDTH - width) // 2, row * CELL_HEIGHT + 14),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.5,
+            255,
+            1,
+            cv2.LINE_AA,
+        )
+    row, column = divmod(SOLID_CELL, ATLAS_COLUMNS)
+    atlas[row * CELL_HEIGHT:(row + 1) * CELL_HEIGHT, column * CELL_WIDTH:(column + 1) * CELL_WIDTH] = 255
+    return atlas
+
+
+class Overlay:
+    def __init__(self, vertex_shader_path: Path, fragment_shader_path: Path):
+        with open(vertex_shader_path, 'r') as file:
+            vertex_shader = shaders.compileShader(file.read(), GL_VERTEX_SHADER)
+        with open(fragment_shader_path, 'r') as file:
+            fragment_shader = shaders.compileShader(file.read(), GL_FRAGMENT_SHADER)
+        self.program = shaders.compileProgram(vertex_shader, fragment_shader)
+        self.resolution_location = glGetUniformLocation(self.program, "iResolution")
+        self.atlas_location = glGetUniformLocation(self.program, "iGlyphAtlas")
+
+        atlas = build_glyph_atlas()
+        self.atlas_size = (atlas.shape[1], atlas.shape[0])
+        self.atlas = glGenTextures(1)
+        glActiveTexture(GL_TEXTURE0 + OVERLAY_TEXTURE_UNIT)
+        glBindTexture(GL_TEXTURE_2D, self.atlas)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_R8, atlas.shape[1], atlas.shape[0], 0, GL_RED, GL_UNSIGNED_BYTE, atlas)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+        glActiveTexture(GL_TEXTURE0)
+
+        self.vao = glGenVertexArrays(1)
+        self.vbo = glGenBuffers(1)
+        glBindVertexArray(self.vao)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        stride = FLOATS_PER_VERTEX * sizeof(GLfloat)
+        for location, (offset, size) in enumerate([(0, 2), (2, 2), (4, 4)]):
+            glVertexAttribPointer(location, size, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(offset * sizeof(GLfloat)))
+            glEnableVertexAttribArray(location)
+        glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        # drawn top to bottom in the order they were first set
+        self.panels = {}
+        self.vertex_count = 0
+        self.dirty = False
+        self.built_for_resolution = None
+
+    def delete(self):
+        glDeleteBuffers(1, [self.vbo])
+        glDeleteVertexArrays(1, [self.vao])
+        glDeleteTextures(1, [self.atlas])
+        glDeleteProgram(self.program)
+
+    @property
+    def visible(self):
+        return bool(self.panels)
+
+    def set_panel(self, name, lines, color=(1., 1., 1., 1.)):
+        panel = OverlayPanel(list(lines), color)
+        if self.panels.get(name) == panel:
+            return
+        self.panels[name] = panel
+        self.dirty = True
+
+    def clear_panel(self, name):
+        if self.panels.pop(name, None) is not None:
+            self.dirty = True
+
+    def has_panel(self, name):
+        return name in self.panels
+
+    def _cell_uv(self, cell):
+        row, column = divmod(cell, ATLAS_COLUMNS)
+        atlas_width, atlas_height = self.atlas_size
+        u0 = column * CELL_WIDTH / atlas_width
+        v0 = row * CELL_HEIGHT / atlas_height
+        return u0, v0, u0 + CELL_WIDTH / atlas_width, v0 + CELL_HEIGHT / atlas_height
+
+    @staticmethod
+    def _quad(x0, y0, x1, y1, uv, color):
+        u0, v0, u1, v1 = uv
+        corners = [
+            (x0, y0, u0, v0), (x1, y0, u1, v0), (x1, y1, u1, v1),
+            (x0, y0, u0, v0), (x1, y1, u1, v1), (x0, y1, u0, v1),
+        ]
+        return [(*corner, *color) for corner in corners]
+
+    def _wrap(self, lines, width):
+        columns = max((width - 2 * (MARGIN + PANEL_PADDING)) // CHAR_ADVANCE, 1)
+        wrapped = []
+        for line in lines:
+            line = str(line).expandtabs(4)
+            wrapped.extend(line[start:start + columns] for start in range(0, max(len(line), 1), columns))
+        return wrapped
+
+    def _build(self, width, height):
+        solid_uv = self._cell_uv(SOLID_CELL)
+        vertices = []
+        y = MARGIN
+        for panel in self.panels.values():
+            lines = self._wrap(panel.lines, width)
+            fitting_lines = (height - y - MARGIN - 2 * PANEL_PADDING) // LINE_HEIGHT
+            if fitting_lines < 1:
+                break
+            if len(lines) > fitting_lines:
+                lines = lines[:fitting_lines - 1] + ["..."]
+            panel_width = max(len(line) for line in lines) * CHAR_ADVANCE + 2 * PANEL_PADDING
+            panel_height = len(lines) * LINE_HEIGHT + 2 * PANEL_PADDING
+            vertices += self._quad(MARGIN, y, MARGIN + panel_width, y + panel_height, solid_uv, BACKGROUND_COLOR)
+            for line_index, line in enumerate(lines):
+                top = y + PANEL_PADDING + line_index * LINE_HEIGHT
+                for char_index, char in enumerate(line):
+                    code = ord(char)
+                    if code <= FIRST_CHAR or code > LAST_CHAR:
+                        continue
+                    left = MARGIN + PANEL_PADDING + char_index * CHAR_ADVANCE - (CELL_WIDTH - CHAR_ADVANCE) // 2
+                    vertices += self._quad(
+                        left, top, left + CELL_WIDTH, top + CELL_HEIGHT,
+                        self._cell_uv(code - FIRST_CHAR),
+                        panel.color
+                    )
+            y += panel_height + MARGIN
+
+        data = np.array(vertices, dtype=np.float32).reshape(-1, FLOATS_PER_VERTEX)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(GL_ARRAY_BUFFER, data.nbytes, data if len(data) else None, GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.vertex_count = len(data)
+        self.dirty = False
+        self.built_for_resolution = (width, height)
+
+    def draw(self, width, height):
+        if not self.visible:
+            return
+        if self.dirty or self.built_for_resolution != (width, height):
+            self._build(width, height)
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        glUseProgram(self.program)
+        glUniform2f(self.resolution_location, width, height)
+        glUniform1i(self.atlas_location, OVERLAY_TEXTURE_UNIT)
+        glBindVertexArray(self.vao)
+        glDrawArrays(GL_TRIANGLES, 0, self.vertex_count)
+        glBindVertexArray(0)
+        glDisable(GL_BLEND)
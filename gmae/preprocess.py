@@ -0,0 +1,344 @@
+"""
+Optional CPU preprocessing of the captured frames (deinterlace, denoise, crop, letterbox removal, lens correction),
+on a pool of worker processes, so neither the render loop nor the audio callback have to fight over the GIL.
+
+The frames never get pickled: there is one shared memory block with a ring of frame slots. The render loop copies
+a captured frame into a free slot and only sends (sequence number, slot) to the workers, they work on the slot
+in place and send back the same plus their timings. The results are shown strictly in sequence order,
+and a slot is free again once the next frame is shown.
+
+The chain is given as comma separated operations, some with a parameter, e.g.
+    --preprocess deinterlace,denoise=20,letterbox,undistort=-0.15,crop=0/40/0/40
+"""
+
+import multiprocessing
+import queue
+from collections import deque
+from dataclasses import dataclass, field
+from multiprocessing.shared_memory import SharedMemory
+from time import perf_counter
+
+import numpy as np
+
+from gmae.utils import log
+
+DEFAULT_WORKERS = 2
+# every worker has one frame in progress and there is one waiting, more would only add delay.
+# the slots need some more, for the one on screen and the ones waiting to be reordered.
+MAX_WAITING_FRAMES = 1
+SLOTS_PER_WORKER = 2
+EXTRA_SLOTS = 2
+LATENCY_WINDOW = 120
+LETTERBOX_THRESHOLD = 16
+
+
+def make_deinterlace(_param, _width, _height):
+    def deinterlace(frame):
+        # drop the odd field, and interpolate its lines from the even one
+        import cv2
+        frame[1:-1:2] = cv2.addWeighted(frame[0:-2:2], .5, frame[2::2], .5, 0)
+        return frame
+    return deinterlace
+
+
+def make_denoise(param, _width, _height):
+    strength = float(param or 20)
+
+    def denoise(frame):
+        # fastNlMeansDenoising would look nicer, but takes way longer than a frame
+        import cv2
+        return cv2.bilateralFilter(frame, 5, strength, strength)
+    return denoise
+
+
+def make_crop(param, width, height):
+    try:
+        left, top, right, bottom = (int(value) for value in (param or "").split("/"))
+    except ValueError:
+        raise ValueError("crop needs left/top/right/bottom in pixels, e.g. crop=0/40/0/40")
+    if left + right >= width or top + bottom >= height:
+        raise ValueError(f"crop {param} leaves nothing of {width}x{height}")
+
+    def crop(frame):
+        # scaled back up, the textures are made for the capture size
+        import cv2
+        return cv2.resize(frame[top:height - bottom, left:width - right], (width, height))
+    return crop
+
+
+def make_letterbox(param, width, height):
+    threshold = int(param or LETTERBOX_THRESHOLD)
+
+    def letterbox(frame):
+        import cv2
+        # a coarse look is enough to find the black bars
+        brightness = frame[::4, ::4].max(axis=2)
+        rows = np.flatnonzero(brightness.max(axis=1) > threshold) * 4
+        columns = np.flatnonzero(brightness.max(axis=0) > threshold) * 4
+        if len(rows) == 0 or len(columns) == 0:
+            return frame
+        top, bottom = rows[0], min(rows[-1] + 4, height)
+        left, right = columns[0], min(columns[-1] + 4, width)
+        if (top, bottom, left, right) == (0, height, 0, width):
+            return frame
+        return cv2.resize(frame[top:bottom, left:right], (width, height))
+    return letterbox
+
+
+def make_undistort(param, width, height):
+    k1 = float(param or -0.15)
+    maps = []
+
+    def undistort(frame):
+        import cv2
+        if not maps:
+            # a simple radial model, with the focal length about the image width
+            camera = np.array([[width, 0, width / 2], [0, width, height / 2], [0, 0, 1]], dtype=np.float64)
+            distortion = np.array([k1, 0, 0, 0], dtype=np.float64)
+            maps.extend(cv2.initUndistortRectifyMap(
+                camera, distortion, None, camera, (width, height), cv2.CV_16SC2
+            ))
+        return cv2.remap(frame, maps[0], maps[1], cv2.INTER_LINEAR)
+    return undistort
+
+
+OPERATIONS = {
+    "deinterlace": make_deinterlace,
+    "denoise": make_denoise,
+    "crop": make_crop,
+    "letterbox": make_letterbox,
+    "undistort": make_undistort,
+}
+
+
+def parse_chain(chain_spec: str):
+    chain = []
+    for item in chain_spec.split(","):
+        name, _, param = item.strip().partition("=")
+        if not name:
+            continue
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown preprocessing {name!r}, choose from {list(OPERATIONS)}")
+        chain.append((name, param or None))
+    return chain
+
+
+def build_chain(chain, width, height):
+    return [(name, OPERATIONS[name](param, width, height)) for name, param in chain]
+
+
+@dataclass
+class PreprocessResult:
+    sequence: int
+    slot: int
+    submitted_at: float
+    started_at: float
+    finished_at: float
+    stage_ms: list = field(default_factory=list)
+    error: str = None
+
+
+def worker_main(shared_memory_name, shape, slot_count, chain, tasks, results):
+    import cv2
+    # the parallelism is the pool, not OpenCV's threads
+    cv2.setNumThreads(1)
+    shared_memory = SharedMemory(name=shared_memory_name)
+    slots = np.ndarray((slot_count, *shape), dtype=np.uint8, buffer=shared_memory.buf)
+    operations = build_chain(chain, shape[1], shape[0])
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            sequence, slot, submitted_at = task
+            result = PreprocessResult(sequence, slot, submitted_at, perf_counter(), 0)
+            try:
+                frame = slots[slot]
+                for _name, operation in operations:
+                    stage_started_at = perf_counter()
+                    processed = operation(frame)
+                    if processed is not frame:
+                        frame[...] = processed
+                    result.stage_ms.append(1000 * (perf_counter() - stage_started_at))
+            except Exception as exc:
+                result.error = repr(exc)
+            result.finished_at = perf_counter()
+            results.put(result)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        del slots
+        shared_memory.close()
+
+
+class Preprocessor:
+    def __init__(self, chain_spec, width, height, workers=DEFAULT_WORKERS):
+        # kept, so the same chain can be built again for another capture size
+        self.chain_spec = chain_spec
+        self.chain = parse_chain(chain_spec)
+        # fail here, not in the workers, if a parameter makes no sense
+        build_chain(self.chain, width, height)
+        self.shape = (height, width, 3)
+        slot_count = SLOTS_PER_WORKER * workers + EXTRA_SLOTS
+        self.shared_memory = SharedMemory(create=True, size=slot_count * int(np.prod(self.shape)))
+        self.slots = np.ndarray((slot_count, *self.shape), dtype=np.uint8, buffer=self.shared_memory.buf)
+        self.free_slots = deque(range(slot_count))
+        self.max_in_flight = workers + MAX_WAITING_FRAMES
+
+        # spawn everywhere: it's the only thing Windows can do anyway, and forking a process with GL in it is no fun
+        context = multiprocessing.get_context("spawn")
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.workers = [
+            context.Process(
+                target=worker_main,
+                args=(self.shared_memory.name, self.shape, slot_count, self.chain, self.tasks, self.results),
+                name=f"Preprocess{index}",
+                daemon=True,
+            )
+            for index in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+        self.next_sequence = 0
+        self.next_to_show = 0
+        self.completed = {}
+        self.shown_slot = None
+
+        self.broken = False
+        self.dropped = 0
+        self.skipped = 0
+        self.failed = 0
+        self.mismatched = 0
+        self.latencies_ms = deque(maxlen=LATENCY_WINDOW)
+        self.queue_wait_ms = deque(maxlen=LATENCY_WINDOW)
+        self.stage_ms = {name: deque(maxlen=LATENCY_WINDOW) for name, _param in self.chain}
+        log(f"Started {workers} preprocessing workers: {' -> '.join(name for name, _param in self.chain)}")
+
+    def close(self):
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join(timeout=1)
+            if worker.is_alive():
+                worker.terminate()
+        # the numpy view has to go before the memory can be closed
+        del self.slots
+        self.shared_memory.close()
+        self.shared_memory.unlink()
+
+    @property
+    def in_flight(self):
+        return self.next_sequence - self.next_to_show
+
+    def exchange(self, frame, fresh):
+        """
+        For the render loop: hands a fresh captured frame to the workers (never blocks, if no slot is free the frame
+        is dropped), and gives back the newest preprocessed frame in order, and whether it is a new one.
+        Until the first preprocessed frame arrives, the captured ones are passed through.
+        """
+        if self.broken:
+            return frame, fresh
+        if fresh:
+            self._submit(frame)
+        self._collect()
+
+        newest = None
+        while self.next_to_show in self.completed:
+            result = self.completed.pop(self.next_to_show)
+            self.next_to_show += 1
+            if result.error is not None:
+                self.failed += 1
+                print(f"Preprocessing of frame {result.sequence} failed:", result.error)
+                self.free_slots.append(result.slot)
+                continue
+            if newest is not None:
+                # the workers were faster than the render loop, only the newest one gets shown
+                self.skipped += 1
+                self.free_slots.append(newest.slot)
+            newest = result
+
+        if newest is None:
+            if self.shown_slot is None:
+                return frame, fresh
+            return self.slots[self.shown_slot], False
+
+        if self.shown_slot is not None:
+            # the previous one was uploaded already, so it's free now
+            self.free_slots.append(self.shown_slot)
+        self.shown_slot = newest.slot
+        now = perf_counter()
+        self.latencies_ms.append(1000 * (now - newest.submitted_at))
+        self.queue_wait_ms.append(1000 * (newest.started_at - newest.submitted_at))
+        for (name, _param), milliseconds in zip(self.chain, newest.stage_ms):
+            self.stage_ms[name].append(milliseconds)
+        return self.slots[self.shown_slot], True
+
+    def _submit(self, frame):
+        if frame.shape != self.shape:
+            # e.g. a reconnected capture with another size, that just goes unprocessed
+            self.mismatched += 1
+            return
+        if self.in_flight >= self.max_in_flight or not self.free_slots:
+            self.dropped += 1
+            self._check_workers()
+            return
+        slot = self.free_slots.popleft()
+        self.slots[slot][...] = frame
+        self.tasks.put((self.next_sequence, slot, perf_counter()))
+        self.next_sequence += 1
+
+    def _check_workers(self):
+        # only when the pipeline is full, because then it might be full for good
+        dead = [worker for worker in self.workers if worker.exitcode is not None]
+        if dead:
+            self.broken = True
+            log(f"Preprocessing worker {dead[0].name} died (exit code {dead[0].exitcode}), "
+                f"the frames go through unprocessed from now on")
+
+    def _collect(self):
+        while True:
+            try:
+                result = self.results.get_nowait()
+            except queue.Empty:
+                return
+            self.completed[result.sequence] = result
+
+    def summary(self):
+        def mean(values):
+            return sum(values) / len(values) if values else None
+
+        return {
+            "broken": self.broken,
+            "in_flight": self.in_flight,
+            "free_slots": len(self.free_slots),
+            "dropped": self.dropped,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "mismatched": self.mismatched,
+            "latency_ms": mean(self.latencies_ms),
+            "max_latency_ms": max(self.latencies_ms, default=None),
+            "queue_wait_ms": mean(self.queue_wait_ms),
+            "stage_ms": {name: mean(values) for name, values in self.stage_ms.items()},
+        }
+
+    def debug_lines(self):
+        summary = self.summary()
+        if summary["latency_ms"] is None:
+            return [f"Preprocessing: {summary['in_flight']} in flight, nothing done yet"]
+        stages = ", ".join(
+            f"{name} {milliseconds:.1f}"
+            for name, milliseconds in summary["stage_ms"].items()
+            if milliseconds is not None
+        )
+        return [
+            f"Preprocessing: {summary['latency_ms']:.1f} ms mean / {summary['max_latency_ms']:.1f} ms max added delay, "
+            f"{summary['in_flight']} in flight, queue wait {summary['queue_wait_ms']:.1f} ms",
+            f"  Stages (ms): {stages}",
+            f"  Dropped {summary['dropped']}, skipped {summary['skipped']}, failed {summary['failed']}",
+        ]
+
+    def print_debug(self):
+        for line in self.debug_lines():
+            print(line)
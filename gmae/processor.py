@@ -1,139 +1,351 @@
+from dataclasses import replace
 from enum import Enum
 from math import exp
 from pathlib import Path
 from time import perf_counter
-from tkinter import Tk, messagebox
 from traceback import print_exception
+from typing import TYPE_CHECKING
 
-import cv2
 import glfw
 import numpy as np
 
 from OpenGL.GL import *
 from OpenGL.GL import shaders
-from OpenGL.GLUT import *
 
-from gmae.processor_utils import Rect, LoopState, Key, EffectsState, EffectId
+from gmae.auto_levels import AutoLevels, LEVELS_TEXTURE_UNIT
+from gmae.capture_supervisor import CaptureSupervisor
+from gmae.color_lut import ColorLut, COLOR_LUT_TEXTURE_UNIT, GRADING_LUT_TEXTURE_UNIT
+from gmae.find_video_captures import open_video_capture
+from gmae.frame_interpolation import FrameInterpolator, InterpolationQuality
+from gmae.frame_history import FrameHistory, HistorySource, HISTORY_TEXTURE_UNIT
+from gmae.gl_state import GLState
+from gmae.frame_store import FrameStorePlayer, FrameStoreRecorder, FrameEvent
+from gmae.lookup_textures import LookupTextures, LookupUnit
+from gmae.motion_analysis import MotionAnalysis
+from gmae.overlay import Overlay
+from gmae.preprocess import Preprocessor
+from gmae.processor_utils import Rect, LoopState, Key, EffectsState, EffectId, FrameStats, MotionMode
+from gmae.remote import RemoteControl, TELEMETRY_INTERVAL_SEC
 from gmae.utils import log, CaptureDeviceInfo, UniformLocations, TitleInfo
 
+if TYPE_CHECKING:
+    from gmae.startup import Startup
+
 WINDOW_HEIGHT = 1080
+DEFAULT_ASPECT_RATIO = 16 / 9
 SPACE_FOR_WINDOWS_SHIT = 80
 
 VERTEX_SHADER_FILE = "shaders/original_vertex.glsl"
 DRY_FRAGMENT_SHADER_FILE = "shaders/original_frag.glsl"
 WET_FRAGMENT_SHADER_FILE = "shaders/frag.glsl"
+OVERLAY_VERTEX_SHADER_FILE = "shaders/overlay_vertex.glsl"
+OVERLAY_FRAGMENT_SHADER_FILE = "shaders/overlay_frag.glsl"
+LEVELS_TILES_SHADER_FILE = "shaders/levels_tiles_frag.glsl"
+LEVELS_REDUCE_SHADER_FILE = "shaders/levels_reduce_frag.glsl"
+MOTION_LUMA_SHADER_FILE = "shaders/motion_luma_frag.glsl"
+MOTION_GRID_SHADER_FILE = "shaders/motion_grid_frag.glsl"
+INTERPOLATION_SEARCH_SHADER_FILE = "shaders/interpolation_search_frag.glsl"
+INTERPOLATION_COMPOSE_SHADER_FILE = "shaders/interpolation_compose_frag.glsl"
+
+ERROR_OVERLAY_COLOR = (1.0, 0.3, 0.5, 1.0)
+DEBUG_OVERLAY_COLOR = (0.8, 1.0, 0.8, 1.0)
+DEBUG_OVERLAY_INTERVAL_SEC = 0.25
+
+tk_root = None
 
 
 class Processor:
-    def __init__(self, args, device_name, audio_stream):
-        device_index = args.index
-        self.audio_stream = audio_stream
-        self.capture = cv2.VideoCapture(device_index)
-        self.capture_info = CaptureDeviceInfo.read_from(self.capture, name=device_name)
-        if self.capture_info is None:
-            raise RuntimeError("Video Device cannot be opened")
-        else:
-            print("Opened Device", device_index, self.capture_info)
+    def __init__(self, args, capture_future, audio_future, startup: "Startup"):
+        self.startup = startup
+        self.capture = None
+        self.capture_info = None
+        self.audio_stream = None
+        self.recorder = None
+        self.replay_event = None
+        self.history = None
+        self.preprocessor = None
+        self.remote = None
+        self.overlay = None
+        self.window = None
 
         self.height = WINDOW_HEIGHT
         self.info = TitleInfo("SUPER GMAE")
 
-        glfw.error_callback = self._glfw_error_callback
+        try:
+            self._initialize(args, capture_future, audio_future, startup)
+        except BaseException:
+            # __exit__ never runs then, but the audio stream and the window must not outlive us
+            self._close_after_failed_init(capture_future, audio_future)
+            raise
 
-        self.window, self.monitor = self.init_window(args)
-        self.last_window_rect = None
-        glfw.make_context_current(self.window)
-        self.fullscreen = False
-        if args.fullscreen:
-            self.toggle_fullscreen()
+    def _initialize(self, args, capture_future, audio_future, startup: "Startup"):
+        glfw.set_error_callback(self._glfw_error_callback)
 
-        # we just use tkinter for error message boxes
-        self.tk_root = Tk()
-        self.tk_root.withdraw()
+        with startup.phase("Create Window"):
+            # the capture is still being opened meanwhile, so the window gets placed (and shown) later
+            self.window, self.monitor = self.init_window(args)
+            self.last_window_rect = None
+            glfw.make_context_current(self.window)
+            self.fullscreen = False
 
         folder = Path(__file__).resolve().parent
         self.vertex_shader_path = folder / VERTEX_SHADER_FILE
         self.dry_fragment_shader_path = folder / DRY_FRAGMENT_SHADER_FILE
         self.wet_fragment_shader_path = folder / WET_FRAGMENT_SHADER_FILE
 
-        # BL, BR, TR, TL
-        self.vertices = np.array(
-            [
-                -1.0, +1.0, 0.0,
-                +1.0, +1.0, 0.0,
-                +1.0, -1.0, 0.0,
-                -1.0, -1.0, 0.0,
-            ],
-            dtype=np.float32
-        )
-        # two triangles that give one square, as you can clearly see
-        self.indices = np.array(
-            [0, 1, 2, 0, 2, 3],
-            dtype=np.uint,
-        )
-
         self.vertex_shader = None
         self.dry_fragment_shader = None
         self.wet_fragment_shader = None
+        self.wet_fragment_shader_source = None
         self.dry_program = None
         self.use_dry_program = False
-        self.program, self.error = self.compile_shaders()
+        with startup.phase("Compile Shaders"):
+            self.program, self.error = self.compile_shaders()
         self.last_compiled_program = self.program
         self.last_compiler_error = self.error
         if self.error:
             self.show_error_popup(self.error, title="Cannot start with some compiling shaders.")
+            # still take these over, so that __exit__ closes them properly
+            self.capture, self.capture_info = capture_future.result()
+            self.audio_stream = audio_future.result()
             return
-        self.vao, self.vbo, self.ebo = self.create_objects()
-        self.texture = glGenTextures(1)
 
-        self.locations = UniformLocations(
-            sampler=glGetUniformLocation(self.program, "iPixelData"),
-            resolution=glGetUniformLocation(self.program, "iResolution"),
-            time=glGetUniformLocation(self.program, "iTime"),
-            effect_amount={
-                EffectId.A: glGetUniformLocation(self.program, "aEffectA"),
-                EffectId.B: glGetUniformLocation(self.program, "aEffectB"),
-                EffectId.C: glGetUniformLocation(self.program, "aEffectC"),
-                EffectId.D: glGetUniformLocation(self.program, "aEffectD"),
-                EffectId.GreenBlob: glGetUniformLocation(self.program, "aEffectGreenBlob"),
-            }
-        )
-        self.dry_locations = UniformLocations(
-            sampler=glGetUniformLocation(self.dry_program, "iPixelData"),
-            resolution=glGetUniformLocation(self.dry_program, "iResolution"),
-        )
+        with startup.phase("Create GL Objects"):
+            self.gl = GLState(caching=not args.uncached_gl)
+            # the full screen triangle needs no buffers, but GL wants some vertex array bound
+            self.vao = glGenVertexArrays(1)
+            self.texture = self.create_frame_texture()
+            self.texture_size = None
+            self.lookup_textures = LookupTextures.create()
+            self.use_lookup_textures = not args.analytic_noise
+
+            self.locations = self.read_uniform_locations(self.program)
+            self.dry_locations = UniformLocations(
+                sampler=glGetUniformLocation(self.dry_program, "iPixelData"),
+                resolution=glGetUniformLocation(self.dry_program, "iResolution"),
+                use_auto_levels=glGetUniformLocation(self.dry_program, "iUseAutoLevels"),
+                levels_sampler=glGetUniformLocation(self.dry_program, "iLevels"),
+            )
+            self.auto_levels = AutoLevels(
+                self.vertex_shader,
+                folder / LEVELS_TILES_SHADER_FILE,
+                folder / LEVELS_REDUCE_SHADER_FILE,
+            )
+            self.use_auto_levels = args.auto_levels
+            self.color_lut = ColorLut(self.gl, args.grading_lut)
+            self.color_lut.compile(self.vertex_shader, self.wet_fragment_shader_source)
+            self.use_color_lut = not args.analytic_colors
+            self.motion = MotionAnalysis(
+                self.vertex_shader,
+                folder / MOTION_LUMA_SHADER_FILE,
+                folder / MOTION_GRID_SHADER_FILE,
+            )
+
+        self.capture, self.capture_info = startup.wait_for("Open Capture", capture_future)
+        if not args.replay:
+            # a live device gets read on its own thread, and reopened if it fails - replays just end
+            self.capture = CaptureSupervisor(self.capture, self.capture_info, self.capture_info.index)
+            if args.preprocess:
+                self.preprocessor = Preprocessor(
+                    args.preprocess,
+                    self.capture_info.width,
+                    self.capture_info.height,
+                    workers=args.preprocess_workers,
+                )
+
+        with startup.phase("Create Frame Interpolation"):
+            # made for the capture size, so it has to wait for the capture
+            self.interpolator = self.create_interpolator()
+            self.interpolation = InterpolationQuality(args.interpolation)
+            # GLFW starts with 0 and cannot tell us, so we keep track of it ourselves
+            self.swap_interval = 0
+            self.swap_interval_before_interpolation = None
+            self.display_interval_sec = 1 / (glfw.get_video_mode(self.monitor).refresh_rate or 60)
+            self.last_swap_at = perf_counter()
+            if self.interpolation is not InterpolationQuality.OFF:
+                # the render loop is paced by the display then, not by the capture
+                self.set_swap_interval(1)
+
+        with startup.phase("Create Overlay"):
+            # after the capture, because that is where cv2 (for the glyphs) got imported
+            self.overlay = Overlay(
+                folder / OVERLAY_VERTEX_SHADER_FILE,
+                folder / OVERLAY_FRAGMENT_SHADER_FILE,
+            )
+        self.show_debug_overlay = False
+        self.last_debug_overlay_at = 0
+
+        self.record_path = args.record
+        self.record_segment = 0
+        if args.record:
+            self.recorder = FrameStoreRecorder(args.record, self.capture_info)
+            print("Record Frames to", args.record)
+        if args.history > 0:
+            self.history = FrameHistory(
+                args.history,
+                self.capture_info.width,
+                self.capture_info.height,
+                source=HistorySource(args.history_source),
+            )
+
+        self.place_window()
+        glfw.show_window(self.window)
+        if args.fullscreen:
+            self.toggle_fullscreen()
 
         glClearColor(8.0, 0.0, 1.0, 1.0)  # some magenta shows that we didn't get far yet.
         glClear(GL_COLOR_BUFFER_BIT)
         self.raise_gl_error_if_exists()
 
+        self.audio_stream = startup.wait_for("Start Audio Stream", audio_future)
+
         self.effects = EffectsState.random()
+        self.effects.motion_mode = MotionMode(args.motion_mode)
         self.elapsed_seconds = 0
         self.last_step_at = None
         self.run_started_at = None
         self.first_run_completed = False
+
+        self.frame_stats = FrameStats()
+        self.last_telemetry_at = 0
+        if args.remote_port:
+            self.remote = RemoteControl(args.remote_host, args.remote_port)
+            self.remote.start()
         log("Initialized Processor")
 
+    def _close_after_failed_init(self, capture_future, audio_future):
+        # whatever the background threads already opened, we are the only ones who can close it
+        if self.capture is None:
+            try:
+                self.capture, _info = capture_future.result()
+            except Exception as exc:
+                print_exception(exc)
+        if self.audio_stream is None:
+            try:
+                self.audio_stream = audio_future.result()
+            except Exception as exc:
+                print_exception(exc)
+        if self.remote is not None:
+            self.remote.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.preprocessor is not None:
+            self.preprocessor.close()
+        if self.capture is not None:
+            self.capture.release()
+        if self.audio_stream is not None:
+            self.audio_stream.close()
+        if self.window is not None:
+            glfw.destroy_window(self.window)
+        glfw.terminate()
+
     def __enter__(self):
         return self
 
+    def create_interpolator(self):
+        folder = Path(__file__).resolve().parent
+        return FrameInterpolator(
+            self.vertex_shader,
+            folder / MOTION_LUMA_SHADER_FILE,
+            folder / INTERPOLATION_SEARCH_SHADER_FILE,
+            folder / INTERPOLATION_COMPOSE_SHADER_FILE,
+            self.capture_info.width,
+            self.capture_info.height,
+        )
+
+    def handle_capture_resize(self, width, height):
+        """
+        A reconnected device does not always give us the size it had before. Everything that was made for
+        the capture size gets made again, the frame texture reallocates by itself in load_texture().
+        """
+        log(f"Capture size changed from {self.capture_info.width}x{self.capture_info.height} to {width}x{height}")
+        self.capture_info = replace(self.capture_info, width=width, height=height)
+
+        self.interpolator.delete()
+        self.interpolator = self.create_interpolator()
+        if self.history is not None:
+            self.history.delete()
+            self.history = FrameHistory(self.history.depth, width, height, source=self.history.source)
+        # these did their own GL calls
+        self.gl.invalidate()
+
+        if self.preprocessor is not None:
+            previous = self.preprocessor
+            previous.close()
+            self.preprocessor = Preprocessor(previous.chain_spec, width, height, workers=len(previous.workers))
+
+        if self.recorder is not None:
+            # a frame store has one frame size, so the rest goes into a new one next to it
+            self.recorder.close()
+            self.record_segment += 1
+            path = Path(self.record_path)
+            segment_path = path.with_name(f"{path.stem}.{self.record_segment}{path.suffix}")
+            self.recorder = FrameStoreRecorder(str(segment_path), self.capture_info)
+            print("Continue Recording in", segment_path)
+
+        if not self.fullscreen:
+            # the width follows the aspect ratio
+            self.place_window()
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.program is not None:
-            glDeleteBuffers(1, [self.vbo])
-            glDeleteBuffers(1, [self.ebo])
             glDeleteVertexArrays(1, [self.vao])
             glDeleteTextures(1, [self.texture])
+            self.lookup_textures.delete()
+            self.auto_levels.delete()
+            self.color_lut.delete()
+            self.motion.delete()
+            self.interpolator.delete()
+            if self.history is not None:
+                self.history.delete()
+            if self.overlay is not None:
+                self.overlay.delete()
         glfw.destroy_window(self.window)
         glfw.terminate()
-        self.capture.release()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.capture is not None:
+            self.capture.release()
+        if self.preprocessor is not None:
+            self.preprocessor.close()
+        if self.audio_stream is not None:
+            self.audio_stream.close()
+        if self.remote is not None:
+            self.remote.stop()
 
     @property
     def width(self):
         """
         As this assumes landscape orientation, the height is what counts and the width is derived
         """
+        if self.capture_info is None:
+            # the capture is not open yet during startup
+            return int(self.height * DEFAULT_ASPECT_RATIO)
         return int(self.height * self.capture_info.width / self.capture_info.height)
 
+    @staticmethod
+    def open_capture(args, device_future):
+        # runs on a startup thread, that's also why cv2 gets imported only here
+        import cv2
+        print("CV2 version", cv2.__version__)
+        if args.replay:
+            # no camera needed, the frames come straight out of the memory map
+            capture = FrameStorePlayer(args.replay, realtime=not args.replay_fast)
+            device_name = capture.header.name
+        else:
+            device_name, found_index = device_future.result()
+            # an explicit --index wins, the Windows scan cannot tell the OpenCV index anyway
+            index = args.index if args.index is not None else found_index
+            if index is None:
+                index = 0
+            capture = open_video_capture(index)
+        capture_info = CaptureDeviceInfo.read_from(capture, name=device_name, index=None if args.replay else index)
+        if capture_info is None:
+            raise RuntimeError("Video Device cannot be opened")
+        else:
+            print("Opened Device", args.replay or index, capture_info)
+        return capture, capture_info
+
     def init_window(self, args):
         if not glfw.init():
             raise Exception("GLFW cannot initiailize.")
@@ -148,6 +360,7 @@ class Processor:
         self.height = min(self.height, mode.size.height - SPACE_FOR_WINDOWS_SHIT)
         glfw.window_hint(glfw.RESIZABLE, glfw.FALSE)
         glfw.window_hint(glfw.FOCUS_ON_SHOW, glfw.TRUE)
+        glfw.window_hint(glfw.VISIBLE, glfw.FALSE)
         window = glfw.create_window(
             self.width,
             self.height,
@@ -158,11 +371,16 @@ class Processor:
         if not window:
             glfw.terminate()
             raise Exception("GLFW cannot create window")
-        x, y = glfw.get_monitor_pos(monitor)
+        return window, monitor
+
+    def place_window(self):
+        # center it, now that we know the capture aspect ratio
+        mode = glfw.get_video_mode(self.monitor)
+        x, y = glfw.get_monitor_pos(self.monitor)
         x += (mode.size.width - self.width) // 2
         y += (mode.size.height - self.height) // 2
         glfw.set_window_monitor(
-            window,
+            self.window,
             None,
             x,
             y,
@@ -170,16 +388,32 @@ class Processor:
             self.height,
             mode.refresh_rate
         )
-        return window, monitor
 
     def _glfw_error_callback(self, error, description):
         print("ERROR", error)
-        self.show_error_popup(description)
-        # couldn't get text drawing to work for now. anyway.
-        # self.draw_text(description, self.width // 2, self.height // 2, (255, 0, 210))
+        if isinstance(description, bytes):
+            description = description.decode("utf-8", errors="replace")
+        self.show_error(description, title=f"GLFW Error {error}")
+
+    def show_error(self, message, title="Error"):
+        # during the show, the error goes into the overlay. a message box would freeze the picture.
+        if self.overlay is None:
+            self.show_error_popup(message, title=title)
+            return
+        self.overlay.set_panel(
+            "error",
+            [f"{title} (F2 to dismiss)", "", *str(message).splitlines()],
+            ERROR_OVERLAY_COLOR
+        )
 
     @staticmethod
     def show_error_popup(message, title="Error"):
+        # we just use tkinter for error message boxes, so it is only loaded when there is one
+        global tk_root
+        from tkinter import Tk, messagebox
+        if tk_root is None:
+            tk_root = Tk()
+            tk_root.withdraw()
         messagebox.showerror(title, message)
 
     @staticmethod
@@ -255,58 +489,63 @@ class Processor:
             return None, exc
 
         self.last_compiled_program = program
+        self.wet_fragment_shader_source = fragment_shader_source
         self.info.update(self.window, is_compiling=False)
         return program, None
 
-    def create_objects(self):
-        vao = glGenVertexArrays(1)
-        vbo = glGenBuffers(1)
-        ebo = glGenBuffers(1)
-
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, ebo)
-        glBufferData(
-            target=GL_ELEMENT_ARRAY_BUFFER,
-            size=None,
-            data=self.indices,
-            usage=GL_STATIC_DRAW
-        )
-
-        glBindBuffer(GL_ARRAY_BUFFER, vbo)
-        glBufferData(
-            target=GL_ARRAY_BUFFER,
-            size=None,
-            data=self.vertices,
-            usage=GL_STATIC_DRAW
+    @staticmethod
+    def read_uniform_locations(program):
+        return UniformLocations(
+            sampler=glGetUniformLocation(program, "iPixelData"),
+            resolution=glGetUniformLocation(program, "iResolution"),
+            time=glGetUniformLocation(program, "iTime"),
+            effect_amount={
+                EffectId.A: glGetUniformLocation(program, "aEffectA"),
+                EffectId.B: glGetUniformLocation(program, "aEffectB"),
+                EffectId.C: glGetUniformLocation(program, "aEffectC"),
+                EffectId.D: glGetUniformLocation(program, "aEffectD"),
+                EffectId.GreenBlob: glGetUniformLocation(program, "aEffectGreenBlob"),
+            },
+            use_lookup_textures=glGetUniformLocation(program, "iUseLookupTextures"),
+            lookup_samplers={
+                LookupUnit.NOISE: glGetUniformLocation(program, "iNoiseLookup"),
+                LookupUnit.BLUE_NOISE: glGetUniformLocation(program, "iBlueNoise"),
+                LookupUnit.BAYER: glGetUniformLocation(program, "iBayerLookup"),
+            },
+            history_sampler=glGetUniformLocation(program, "iHistory"),
+            history_depth=glGetUniformLocation(program, "iHistoryDepth"),
+            history_index=glGetUniformLocation(program, "iHistoryIndex"),
+            use_auto_levels=glGetUniformLocation(program, "iUseAutoLevels"),
+            levels_sampler=glGetUniformLocation(program, "iLevels"),
+            use_color_lut=glGetUniformLocation(program, "iUseColorLut"),
+            color_lut_sampler=glGetUniformLocation(program, "iColorLut"),
+            use_grading_lut=glGetUniformLocation(program, "iUseGradingLut"),
+            grading_lut_sampler=glGetUniformLocation(program, "iGradingLut"),
         )
 
-        glBindVertexArray(vao)
-        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 3 * sizeof(GLfloat), None)
-        glEnableVertexAttribArray(0)
-
-        # unbind again - unclear whether important
-        glBindBuffer(GL_ARRAY_BUFFER, 0)
-        glBindVertexArray(0)
-
-        return vao, vbo, ebo
-
-    def load_texture(self, frame):
+    @staticmethod
+    def create_frame_texture():
+        # the parameters never change, so they are set once, not with every upload
+        texture = glGenTextures(1)
         glActiveTexture(GL_TEXTURE0)
-        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glBindTexture(GL_TEXTURE_2D, texture)
         glTexParameter(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_BORDER)
         glTexParameter(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_BORDER)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-        glTexImage2D(
-            GL_TEXTURE_2D,
-            0,
-            GL_RGB,
-            frame.shape[1],
-            frame.shape[0],
-            0,
-            GL_BGR,
-            GL_UNSIGNED_BYTE,
-            frame.tobytes()
-        )
+        return texture
+
+    def load_texture(self, frame):
+        self.gl.bind_texture(0, GL_TEXTURE_2D, self.texture)
+        height, width = frame.shape[:2]
+        # no .tobytes() - that would copy, and the frame store hands us views into its mmap
+        data = np.ascontiguousarray(frame)
+        if self.texture_size == (width, height):
+            # same size as before, so only the pixels change, no reallocation
+            self.gl.call(glTexSubImage2D, GL_TEXTURE_2D, 0, 0, 0, width, height, GL_BGR, GL_UNSIGNED_BYTE, data)
+            return
+        self.gl.call(glTexImage2D, GL_TEXTURE_2D, 0, GL_RGB, width, height, 0, GL_BGR, GL_UNSIGNED_BYTE, data)
+        self.texture_size = (width, height)
 
     @staticmethod
     def raise_gl_error_if_exists():
@@ -325,8 +564,22 @@ class Processor:
             print(f"FAILED: {label}")
             raise e
 
+    @staticmethod
+    def set_sampler_units(gl: GLState, locations: UniformLocations):
+        # every sampler needs its own unit, even when nothing is bound there: samplers of different types
+        # (iPixelData, iHistory, iColorLut...) all on the default unit 0 make the draw GL_INVALID_OPERATION
+        gl.uniform(glUniform1i, locations.sampler, 0)
+        for unit, sampler_location in locations.lookup_samplers.items():
+            gl.uniform(glUniform1i, sampler_location, unit)
+        gl.uniform(glUniform1i, locations.history_sampler, HISTORY_TEXTURE_UNIT)
+        gl.uniform(glUniform1i, locations.levels_sampler, LEVELS_TEXTURE_UNIT)
+        gl.uniform(glUniform1i, locations.color_lut_sampler, COLOR_LUT_TEXTURE_UNIT)
+        gl.uniform(glUniform1i, locations.grading_lut_sampler, GRADING_LUT_TEXTURE_UNIT)
+
     def setup_program(self):
-        glUseProgram(
+        # all through self.gl, which skips what is set already (most of it, most of the time)
+        gl = self.gl
+        gl.use_program(
             self.program
             if not self.use_dry_program
             else self.dry_program
@@ -336,19 +589,36 @@ class Processor:
             if not self.use_dry_program
             else self.dry_locations
         )
-        glUniform1i(locations.sampler, 0)
-        glUniform2f(locations.resolution, self.width, self.height)
+        gl.viewport(0, 0, *glfw.get_framebuffer_size(self.window))
+        self.set_sampler_units(gl, locations)
+        gl.uniform(glUniform2f, locations.resolution, self.width, self.height)
+        gl.uniform(glUniform1i, locations.use_lookup_textures, self.use_lookup_textures)
+        if locations.history_sampler is not None:
+            history_depth = 0 if self.history is None else self.history.available_depth
+            history_index = 0 if self.history is None else self.history.index
+            gl.uniform(glUniform1i, locations.history_depth, history_depth)
+            gl.uniform(glUniform1i, locations.history_index, history_index)
+        # until the first reduction ran, there are no levels to apply
+        gl.uniform(glUniform1i, locations.use_auto_levels, self.use_auto_levels and self.auto_levels.updates > 0)
+        gl.uniform(glUniform1i, locations.use_color_lut, self.use_color_lut)
+        # with the color LUT, the grading is baked in there already
+        gl.uniform(glUniform1i, locations.use_grading_lut, self.color_lut.has_grading and not self.use_color_lut)
 
-        if self.last_step_at is None:
-            self.last_step_at = self.run_started_at
-        current_step_at = perf_counter()
-        delta_seconds = current_step_at - self.last_step_at
-        self.elapsed_seconds += delta_seconds
-        self.last_step_at = current_step_at
+        if self.replay_event is not None:
+            # replay the exact shader time from the recording, otherwise it's not deterministic
+            delta_seconds = self.replay_event.elapsed_seconds - self.elapsed_seconds
+            self.elapsed_seconds = self.replay_event.elapsed_seconds
+        else:
+            if self.last_step_at is None:
+                self.last_step_at = self.run_started_at
+            current_step_at = perf_counter()
+            delta_seconds = current_step_at - self.last_step_at
+            self.elapsed_seconds += delta_seconds
+            self.last_step_at = current_step_at
 
-        if locations.time is not None:
-            glUniform1f(locations.time, self.elapsed_seconds)
+        gl.uniform(glUniform1f, locations.time, self.elapsed_seconds)
 
+        amounts = {}
         for effect_id in EffectId:
             flash = self.effects.next_flash.get(effect_id, None)
             if flash is None:
@@ -359,23 +629,82 @@ class Processor:
                 continue
 
             flash.remaining_sec -= delta_seconds
-            strength = self.effects.strength.get(effect_id, 0)
-            amount = strength * flash.current_value
-            glUniform1f(amount_location, amount)
+            amount = self.effects.current_amount(effect_id)
+            gl.uniform(glUniform1f, amount_location, amount)
+            amounts[effect_id] = amount
             if flash.is_over:
                 self.effects.choose_next_flash(effect_id=effect_id)
+        self.audio_stream.set_effect_amounts(amounts)
+        if self.use_color_lut and not self.use_dry_program:
+            self.color_lut.update(self.elapsed_seconds, amounts, self.use_lookup_textures, self.render)
 
     def render(self):
-        glBindVertexArray(self.vao)
-        glDrawElements(GL_TRIANGLES, len(self.indices), GL_UNSIGNED_INT, self.indices)
+        # one triangle that covers the whole screen, the vertex shader makes it up from gl_VertexID
+        self.gl.bind_vertex_array(self.vao)
+        self.gl.call(glDrawArrays, GL_TRIANGLES, 0, 3)
 
-    def process(self, frame):
-        # frame = self.normalize_frame(frame)
-        Processor.execute_with_error_handling(
-            "LOAD TEXTURE",
-            self.load_texture,
-            frame
-        )
+    def process(self, frame, fresh=True):
+        if fresh:
+            Processor.execute_with_error_handling(
+                "LOAD TEXTURE",
+                self.load_texture,
+                frame
+            )
+        if self.use_auto_levels and fresh:
+            Processor.execute_with_error_handling(
+                "AUTO LEVELS",
+                self.auto_levels.update,
+                self.texture,
+                self.render,
+                self.elapsed_seconds,
+            )
+            # it did its own GL calls in between
+            self.gl.invalidate()
+        if self.effects.motion_mode is not MotionMode.OFF:
+            if fresh:
+                Processor.execute_with_error_handling(
+                    "MOTION ANALYSIS",
+                    self.motion.update,
+                    self.texture,
+                    self.render,
+                )
+                self.gl.invalidate()
+            reading = self.motion.poll()
+            if reading is not None:
+                triggered = self.effects.update_motion(reading.energy, self.elapsed_seconds)
+                if triggered is not None:
+                    print(f"Motion triggered a flash of Effect {triggered.name} (energy {reading.energy:.4f})")
+        # otherwise it's the same frame as before, still in the texture
+        if self.history is not None and fresh:
+            Processor.execute_with_error_handling(
+                "PUSH CAPTURED HISTORY",
+                self.history.push_captured,
+                self.texture,
+                frame.shape[1],
+                frame.shape[0],
+            )
+            self.gl.invalidate()
+        if self.interpolation is not InterpolationQuality.OFF:
+            if fresh:
+                Processor.execute_with_error_handling(
+                    "PUSH INTERPOLATED FRAME",
+                    self.interpolator.push,
+                    self.texture,
+                    frame.shape[1],
+                    frame.shape[0],
+                    perf_counter(),
+                    self.interpolation,
+                    self.render,
+                )
+            Processor.execute_with_error_handling(
+                "INTERPOLATE FRAME",
+                self.interpolator.compose,
+                perf_counter(),
+                self.interpolation,
+                self.render,
+            )
+            self.gl.invalidate()
+        self.gl.bind_texture(0, GL_TEXTURE_2D, self.input_texture)
         Processor.execute_with_error_handling(
             "SETUP PROGRAM",
             self.setup_program,
@@ -384,7 +713,23 @@ class Processor:
             "RENDER",
             self.render
         )
+        if self.history is not None:
+            Processor.execute_with_error_handling(
+                "PUSH PROCESSED HISTORY",
+                self.history.push_processed,
+                *glfw.get_framebuffer_size(self.window),
+            )
+            self.gl.invalidate()
+        # the overlay comes last, so it never ends up in the frame history
+        if self.overlay.visible:
+            Processor.execute_with_error_handling(
+                "DRAW OVERLAY",
+                self.overlay.draw,
+                *glfw.get_framebuffer_size(self.window),
+            )
+            self.gl.invalidate()
         glfw.swap_buffers(self.window)
+        self.last_swap_at = perf_counter()
 
     def run(self):
         if self.error:
@@ -397,34 +742,73 @@ class Processor:
 
         log("Now Run")
         while not glfw.window_should_close(self.window):
-            ok, frame = self.capture.read()
-            if not ok:
-                break
+            if isinstance(self.capture, CaptureSupervisor):
+                frame, fresh = self.capture.read(max_wait_sec=self.capture_wait_sec())
+                if fresh and frame.shape[:2] != (self.capture_info.height, self.capture_info.width):
+                    self.handle_capture_resize(frame.shape[1], frame.shape[0])
+            else:
+                fresh, frame = self.capture.read()
+                if not fresh:
+                    break
+            if self.preprocessor is not None:
+                frame, fresh = self.preprocessor.exchange(frame, fresh)
 
             currently = LoopState.read(self)
 
+            if previously.f1_pressed and not currently.f1_pressed:
+                self.toggle_debug_overlay()
+            if previously.f2_pressed and not currently.f2_pressed:
+                self.overlay.clear_panel("error")
+            if previously.f3_pressed and not currently.f3_pressed:
+                self.toggle_color_lut()
             if previously.f5_pressed and not currently.f5_pressed:
-                program, error = self.compile_shaders()
-                if error:
-                    self.show_error_popup(error, title="Cannot Replace Shaders")
-                else:
-                    log("Compiled Shaders (freshly from file).")
-                    self.program = program
+                self.reload_shaders()
+            if previously.f6_pressed and not currently.f6_pressed:
+                self.use_lookup_textures = not self.use_lookup_textures
+                print("Use Lookup Textures for noise / dithering?", self.use_lookup_textures)
             if previously.f8_pressed and not currently.f8_pressed:
                 self.use_dry_program = not self.use_dry_program
+            if previously.f7_pressed and not currently.f7_pressed:
+                self.toggle_auto_levels()
+            if previously.f9_pressed and not currently.f9_pressed:
+                self.audio_stream.trigger_tape_stop()
+            if previously.f10_pressed and not currently.f10_pressed:
+                self.set_motion_mode()
             if previously.f11_pressed and not currently.f11_pressed:
                 self.toggle_fullscreen()
             if previously.f12_pressed and not currently.f12_pressed:
                 self.audio_stream.toggle_mute()
+            if previously.i_pressed and not currently.i_pressed:
+                self.set_interpolation()
             previously = currently
 
             self.effects.handle_input(self)
+            if self.remote is not None:
+                self.remote.apply_pending(self)
+
+            if self.recorder is not None:
+                effects_snapshot = self.effects.snapshot()
+            if isinstance(self.capture, FrameStorePlayer):
+                self.apply_replay_event(self.capture.current_event)
+
+            self.process(frame, fresh)
+            self.gl.end_frame()
+
+            if self.recorder is not None and fresh:
+                self.recorder.write(frame, FrameEvent(
+                    elapsed_seconds=self.elapsed_seconds,
+                    effects=effects_snapshot,
+                    use_dry_program=self.use_dry_program,
+                ))
 
-            self.process(frame)
+            self.frame_stats.tick(perf_counter(), self.capture_info.fps)
+            if self.remote is not None:
+                self.publish_telemetry()
 
             if not self.first_run_completed:
                 log("First processing completed.")
                 self.first_run_completed = True
+                self.startup.first_frame_done()
 
             if self.key_pressed(glfw.KEY_ESCAPE):
                 if self.fullscreen:
@@ -433,14 +817,192 @@ class Processor:
                     glfw.iconify_window(self.window)
             if self.key_pressed(Key.ABORT):
                 break
-            if self.key_pressed(Key.PRINT_DEBUG):
-                print("======= DEBUG =======")
-                print("Running Time:", self.elapsed_seconds, "sec")
-                self.effects.print_debug()
-                self.audio_stream.print_debug()
+            if self.show_debug_overlay:
+                self.update_debug_overlay()
 
             glfw.poll_events()
 
+    def toggle_debug_overlay(self):
+        self.show_debug_overlay = not self.show_debug_overlay
+        if self.show_debug_overlay:
+            print("======= DEBUG =======")
+            print("Running Time:", self.elapsed_seconds, "sec")
+            self.effects.print_debug()
+            self.audio_stream.print_debug()
+            if self.history is not None:
+                self.history.print_debug()
+            if self.use_auto_levels:
+                self.auto_levels.print_debug()
+            self.color_lut.print_debug()
+            if self.effects.motion_mode is not MotionMode.OFF:
+                self.motion.print_debug()
+            if self.interpolation is not InterpolationQuality.OFF:
+                self.interpolator.print_debug(self.interpolation)
+            print(self.gl.debug_line())
+            if self.preprocessor is not None:
+                self.preprocessor.print_debug()
+            self.last_debug_overlay_at = 0
+            self.update_debug_overlay()
+        else:
+            self.overlay.clear_panel("debug")
+
+    def toggle_color_lut(self):
+        self.use_color_lut = not self.use_color_lut
+        print("Use the baked Color LUT for the color effects?", self.use_color_lut)
+
+    def set_motion_mode(self, mode: MotionMode = None):
+        # without a mode, it's the next one
+        if mode is None:
+            self.effects.cycle_motion_mode()
+        else:
+            self.effects.set_motion_mode(mode)
+        self.motion.reset()
+
+    def set_interpolation(self, quality: InterpolationQuality = None):
+        # without a quality, it's the next one
+        if quality is None:
+            qualities = list(InterpolationQuality)
+            quality = qualities[(qualities.index(self.interpolation) + 1) % len(qualities)]
+        self.interpolation = quality
+        self.interpolator.reset()
+        if quality is not InterpolationQuality.OFF:
+            self.set_swap_interval(1)
+        elif self.swap_interval_before_interpolation is not None:
+            self.set_swap_interval(self.swap_interval_before_interpolation)
+        print("Frame Interpolation:", quality.value)
+
+    def set_swap_interval(self, interval):
+        if interval == 1 and self.swap_interval != 1:
+            # so that switching the interpolation off again gives back what was there
+            self.swap_interval_before_interpolation = self.swap_interval
+        glfw.swap_interval(interval)
+        self.swap_interval = interval
+
+    def capture_wait_sec(self):
+        if self.interpolation is InterpolationQuality.OFF:
+            # paced by the capture, i.e. up to one capture frame interval
+            return None
+        # paced by the display: a new frame may still make it, but leave half a refresh for the rendering
+        deadline = self.last_swap_at + self.display_interval_sec / 2
+        return max(deadline - perf_counter(), 0)
+
+    @property
+    def input_texture(self):
+        # what the dry / wet shader gets as iPixelData
+        if self.interpolation is not InterpolationQuality.OFF and self.interpolator.ready:
+            return self.interpolator.output_texture
+        return self.texture
+
+    def toggle_auto_levels(self):
+        self.use_auto_levels = not self.use_auto_levels
+        print("Use Auto Levels?", self.use_auto_levels)
+
+    def update_debug_overlay(self):
+        # no need to rebuild the text quads every frame
+        now = perf_counter()
+        if now - self.last_debug_overlay_at < DEBUG_OVERLAY_INTERVAL_SEC:
+            return
+        self.last_debug_overlay_at = now
+        stats = self.frame_stats.summary()
+        muted_info = " [MUTED]" if self.audio_stream.mute else ""
+        lines = [
+            f"Running Time: {self.elapsed_seconds:.1f} sec (F1 to hide)",
+            f"Frames: {stats['frames']}, dropped {stats['dropped_frames']}, "
+            f"{stats.get('fps', 0):.1f} fps, mean {stats.get('mean_frame_ms', 0):.1f} ms, "
+            f"max {stats.get('max_frame_ms', 0):.1f} ms",
+            *self.effects.debug_lines(),
+            f"Audio Max Amplitude: {float(self.audio_stream.max_amplitude_since_unmuting):.3f}{muted_info}",
+            f"Dry Program: {self.use_dry_program}, Lookup Textures: {self.use_lookup_textures}",
+            f"Color LUT: {self.use_color_lut}, baked {self.color_lut.bakes} times",
+            f"Auto Levels: {self.use_auto_levels}"
+            + ("" if self.auto_levels.last_gpu_ms is None else f", {self.auto_levels.last_gpu_ms:.3f} ms on the GPU"),
+            self.gl.debug_line(),
+        ]
+        if self.effects.motion_mode is not MotionMode.OFF:
+            lines += self.motion.debug_lines()
+        if self.interpolation is not InterpolationQuality.OFF:
+            lines += self.interpolator.debug_lines(self.interpolation)
+        if self.preprocessor is not None:
+            lines += self.preprocessor.debug_lines()
+        if self.history is not None:
+            lines.append(
+                f"Frame History: {self.history.available_depth} / {self.history.depth}, "
+                f"{self.history.memory_megabytes:.1f} MB"
+            )
+        self.overlay.set_panel("debug", lines, DEBUG_OVERLAY_COLOR)
+
+    def reload_shaders(self):
+        program, error = self.compile_shaders()
+        if error:
+            self.show_error(error, title="Cannot Replace Shaders")
+        else:
+            log("Compiled Shaders (freshly from file).")
+            self.gl.forget_program(self.program)
+            self.program = program
+            self.locations = self.read_uniform_locations(program)
+            self.overlay.clear_panel("error")
+            try:
+                self.color_lut.compile(self.vertex_shader, self.wet_fragment_shader_source)
+            except Exception as exc:
+                self.show_error(exc, title="Cannot Bake the Color LUT")
+
+    def publish_telemetry(self):
+        now = perf_counter()
+        if now - self.last_telemetry_at < TELEMETRY_INTERVAL_SEC:
+            return
+        self.last_telemetry_at = now
+        self.remote.publish({
+            "elapsed_seconds": self.elapsed_seconds,
+            "frame_stats": self.frame_stats.summary(),
+            "audio": {
+                "max_amplitude": float(self.audio_stream.max_amplitude_since_unmuting),
+                "mute": self.audio_stream.mute,
+                "callback": self.audio_stream.callback_summary(),
+            },
+            "effects": {
+                id.name: {
+                    "strength": self.effects.strength.get(id, 0),
+                    "amount": self.effects.current_amount(id),
+                }
+                for id in EffectId
+            },
+            "use_dry_program": self.use_dry_program,
+            "preprocessing": None if self.preprocessor is None else self.preprocessor.summary(),
+            "gl": self.gl.summary(),
+            "color_lut": {
+                "enabled": self.use_color_lut,
+                "bakes": self.color_lut.bakes,
+                "last_bake_ms": self.color_lut.last_bake_ms,
+            },
+            "auto_levels": {
+                "enabled": self.use_auto_levels,
+                "gpu_ms": self.auto_levels.last_gpu_ms,
+            },
+            "interpolation": {
+                "quality": self.interpolation.value,
+                **self.interpolator.summary(),
+            },
+            "motion": {
+                "mode": self.effects.motion_mode.value,
+                "level": self.effects.motion_level,
+                **self.motion.summary(),
+            },
+            "capture": {
+                "stale": self.capture.is_stale,
+                "stale_seconds": self.capture.stale_seconds(),
+                "reconnects": self.capture.reconnects,
+            } if isinstance(self.capture, CaptureSupervisor) else {},
+            "remote": self.remote.summary(),
+        })
+
+    def apply_replay_event(self, event: FrameEvent):
+        self.replay_event = event
+        if event is None:
+            return
+        if event.effects:
+            self.effects.restore(event.effects)
+        self.use_dry_program = event.use_dry_program
+
     def key_pressed(self, key):
         if isinstance(key, Enum):
             key = key.value
@@ -470,9 +1032,3 @@ class Processor:
             )
         self.fullscreen = not self.fullscreen
         print("Is now fullscreen?", self.fullscreen, "(full screen will always be on the last monitor available.")
-
-    @staticmethod
-    def normalize_frame(frame):
-        in_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        normalized = cv2.normalize(in_rgb, None, alpha=0, beta=1, norm_type=cv2.NORM_MINMAX, dtype=cv2.CV_32F)
-        return normalized.astype(np.uint8)
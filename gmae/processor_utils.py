@@ -1,5 +1,6 @@
+from collections import deque
 from enum import Enum
-from math import exp
+from math import exp, cos, pi
 from random import random, uniform
 from typing import TYPE_CHECKING
 
@@ -15,11 +16,19 @@ if TYPE_CHECKING:
 
 class Key(Enum):
     ABORT = glfw.KEY_F4
+    TOGGLE_COLOR_LUT = glfw.KEY_F3
     UPDATE_SHADER = glfw.KEY_F5
+    TOGGLE_LOOKUP_TEXTURES = glfw.KEY_F6
     FULLSCREEN = glfw.KEY_F11
     MUTE = glfw.KEY_F12
+    AUTO_LEVELS = glfw.KEY_F7
     SHOW_ORIGINAL = glfw.KEY_F8
+    TAPE_STOP = glfw.KEY_F9
+    MOTION_MODE = glfw.KEY_F10
     PRINT_DEBUG = glfw.KEY_F1
+    DISMISS_ERROR = glfw.KEY_F2
+    # the F keys are all taken
+    INTERPOLATION = glfw.KEY_I
 
     # effect annoyance controls
     INCREASE_GREEN_BLOB = glfw.KEY_Q
@@ -37,19 +46,35 @@ class Key(Enum):
 
 @dataclass
 class LoopState:
+    f1_pressed: bool = False
+    f2_pressed: bool = False
+    f3_pressed: bool = False
     f5_pressed: bool = False
+    f6_pressed: bool = False
+    f7_pressed: bool = False
     f8_pressed: bool = False
+    f9_pressed: bool = False
+    f10_pressed: bool = False
     f11_pressed: bool = False
     f12_pressed: bool = False
+    i_pressed: bool = False
     compiling: bool = False
 
     @classmethod
     def read(cls, processor: "Processor"):
         return cls(
+            f1_pressed=processor.key_pressed(Key.PRINT_DEBUG),
+            f2_pressed=processor.key_pressed(Key.DISMISS_ERROR),
+            f3_pressed=processor.key_pressed(Key.TOGGLE_COLOR_LUT),
             f5_pressed=processor.key_pressed(Key.UPDATE_SHADER),
+            f6_pressed=processor.key_pressed(Key.TOGGLE_LOOKUP_TEXTURES),
+            f7_pressed=processor.key_pressed(Key.AUTO_LEVELS),
             f8_pressed=processor.key_pressed(Key.SHOW_ORIGINAL),
+            f9_pressed=processor.key_pressed(Key.TAPE_STOP),
+            f10_pressed=processor.key_pressed(Key.MOTION_MODE),
             f11_pressed=processor.key_pressed(Key.FULLSCREEN),
             f12_pressed=processor.key_pressed(Key.MUTE),
+            i_pressed=processor.key_pressed(Key.INTERPOLATION),
             compiling=processor.info.is_compiling,
         )
 
@@ -80,6 +105,8 @@ effect_keymap = {
 class EffectFlash:
     remaining_sec: float
     duration_sec: float
+    # by motion or by the remote: then it is visible right away, for duration_sec
+    triggered: bool = False
 
     _min_seconds_between_flashes = 10
     _max_seconds_between_flashes = 60
@@ -96,9 +123,26 @@ class EffectFlash:
             EffectFlash._min_seconds_flash_duration,
             EffectFlash._max_seconds_flash_duration
         )
+        self.triggered = False
+
+    @classmethod
+    def triggered_now(cls, duration_sec=None):
+        flash = cls()
+        flash.triggered = True
+        if duration_sec is not None:
+            flash.duration_sec = duration_sec
+        # counts down to 0 while it's visible
+        flash.remaining_sec = flash.duration_sec
+        return flash
 
     @property
     def current_value(self):
+        if self.triggered:
+            if not 0 <= self.remaining_sec <= self.duration_sec:
+                return 0
+            # at the top right away, then down to 0 at the end, no hard cut
+            elapsed = self.duration_sec - self.remaining_sec
+            return 0.5 * (1 + cos(pi * elapsed / self.duration_sec))
         if 0 >= self.remaining_sec >= -self.duration_sec:
             return 0
         x = -self.remaining_sec / (2 * self.duration_sec)
@@ -106,13 +150,41 @@ class EffectFlash:
 
     @property
     def is_over(self):
+        if self.triggered:
+            return self.remaining_sec < 0
         return self.remaining_sec < -self.duration_sec
 
 
+class MotionMode(Enum):
+    OFF = "off"
+    # the flash envelopes get scaled with the motion in the picture
+    MODULATE = "modulate"
+    # a burst of motion brings the peak of a flash to right now
+    TRIGGER = "trigger"
+
+
+# the motion energy is the mean absolute luma difference between frames, below the floor it's sensor noise
+MOTION_NOISE_FLOOR = 0.005
+MOTION_FULL_SCALE = 0.05
+# fast attack, slow release
+MOTION_RELEASE_SEC = 1.5
+MOTION_BASELINE_SEC = 10
+# what is left of the amounts in modulate mode when nothing moves at all
+MOTION_MODULATION_FLOOR = 0.2
+# how much more than the baseline motion it needs to trigger
+MOTION_TRIGGER_THRESHOLD = 0.02
+MOTION_TRIGGER_COOLDOWN_SEC = 4
+
+
 @dataclass
 class EffectsState:
     strength: dict = field(default_factory=dict)
     next_flash: dict = field(default_factory=dict)
+    motion_mode: MotionMode = MotionMode.OFF
+    motion_level: float = 0
+    motion_baseline: float = None
+    motion_updated_at: float = None
+    motion_triggered_at: float = None
 
     @classmethod
     def random(cls):
@@ -130,6 +202,15 @@ class EffectsState:
         for id in self.strength:
             print(f"  {id.name} = {self.strength[id]}")
 
+    def debug_lines(self):
+        lines = [
+            f"Effect {id.name}: strength {self.strength.get(id, 0):.2f}, amount {self.current_amount(id):.2f}"
+            for id in EffectId
+        ]
+        if self.motion_mode is not MotionMode.OFF:
+            lines.append(f"Motion Mode: {self.motion_mode.value} (F10), level {self.motion_level:.2f}")
+        return lines
+
     def handle_input(self, processor: "Processor"):
         if processor.key_pressed(Key.RANDOMIZE_ALL_EFFECTS):
             self.randomize_amounts()
@@ -153,6 +234,65 @@ class EffectsState:
             )
         print(f"Effect {id.name} x ", self.strength[id])
 
+    def set_strength(self, id: EffectId, value):
+        self.strength[id] = clamp(value)
+        print(f"Effect {id.name} x ", self.strength[id])
+
+    def trigger_flash(self, id: EffectId, duration_sec=None):
+        # the flash of that effect peaks right now instead of whenever it was scheduled
+        self.next_flash[id] = EffectFlash.triggered_now(duration_sec)
+
+    def current_amount(self, id: EffectId):
+        # what goes into the shader uniform
+        flash = self.next_flash.get(id)
+        if flash is None:
+            return 0
+        amount = self.strength.get(id, 0) * flash.current_value
+        if self.motion_mode is MotionMode.MODULATE:
+            amount *= MOTION_MODULATION_FLOOR + (1 - MOTION_MODULATION_FLOOR) * self.motion_level
+        return amount
+
+    def set_motion_mode(self, mode: MotionMode):
+        self.motion_mode = mode
+        self.motion_level = 0
+        self.motion_baseline = None
+        self.motion_updated_at = None
+        print("Motion Mode:", mode.value)
+
+    def cycle_motion_mode(self):
+        modes = list(MotionMode)
+        self.set_motion_mode(modes[(modes.index(self.motion_mode) + 1) % len(modes)])
+
+    def update_motion(self, energy, now_sec):
+        """
+        With every new motion reading. Returns the effect that got triggered, if any.
+        """
+        level = clamp((energy - MOTION_NOISE_FLOOR) / MOTION_FULL_SCALE)
+        if self.motion_updated_at is None:
+            self.motion_level = level
+            self.motion_baseline = energy
+            self.motion_updated_at = now_sec
+            return None
+        delta_sec = max(now_sec - self.motion_updated_at, 0)
+        self.motion_updated_at = now_sec
+        self.motion_level = max(level, self.motion_level * exp(-delta_sec / MOTION_RELEASE_SEC))
+        # compared before the baseline moves, so a burst doesn't raise its own bar
+        excess = energy - self.motion_baseline
+        self.motion_baseline += (energy - self.motion_baseline) * (1 - exp(-delta_sec / MOTION_BASELINE_SEC))
+
+        if self.motion_mode is not MotionMode.TRIGGER or excess < MOTION_TRIGGER_THRESHOLD:
+            return None
+        if self.motion_triggered_at is not None and now_sec - self.motion_triggered_at < MOTION_TRIGGER_COOLDOWN_SEC:
+            return None
+        candidates = [id for id in EffectId if self.strength.get(id, 0) > 0]
+        if not candidates:
+            return None
+        # the one that is the least visible right now
+        id = min(candidates, key=self.current_amount)
+        self.trigger_flash(id)
+        self.motion_triggered_at = now_sec
+        return id
+
     def choose_next_flash(self, effect_id=None):
         if effect_id is None:
             for id in EffectId:
@@ -160,6 +300,70 @@ class EffectsState:
             return
         self.next_flash[effect_id] = EffectFlash()
 
+    def snapshot(self):
+        # plain dict that survives json, for the frame store (record / replay)
+        return {
+            "strength": {
+                id.name: value
+                for id, value in self.strength.items()
+            },
+            "next_flash": {
+                id.name: [flash.remaining_sec, flash.duration_sec, flash.triggered]
+                for id, flash in self.next_flash.items()
+            },
+            "motion": [self.motion_mode.value, self.motion_level],
+        }
+
+    def restore(self, snapshot: dict):
+        self.strength = {
+            EffectId[name]: value
+            for name, value in snapshot.get("strength", {}).items()
+        }
+        self.next_flash = {}
+        for name, (remaining_sec, duration_sec, triggered) in snapshot.get("next_flash", {}).items():
+            flash = EffectFlash()
+            flash.remaining_sec = remaining_sec
+            flash.duration_sec = duration_sec
+            flash.triggered = triggered
+            self.next_flash[EffectId[name]] = flash
+        if "motion" in snapshot:
+            mode, self.motion_level = snapshot["motion"]
+            self.motion_mode = MotionMode(mode)
+
+
+FRAME_STATS_WINDOW = 120
+
+
+@dataclass
+class FrameStats:
+    frame_times: deque = field(default_factory=lambda: deque(maxlen=FRAME_STATS_WINDOW))
+    frames: int = 0
+    dropped_frames: int = 0
+    last_frame_at: float = None
+
+    def tick(self, now, nominal_fps=0):
+        if self.last_frame_at is not None:
+            frame_time = now - self.last_frame_at
+            self.frame_times.append(frame_time)
+            # a frame that took more than 1.5 nominal frame times means we missed one (or more)
+            if nominal_fps > 0:
+                missed = int(frame_time * nominal_fps + 0.5) - 1
+                self.dropped_frames += max(missed, 0)
+        self.last_frame_at = now
+        self.frames += 1
+
+    def summary(self):
+        if not self.frame_times:
+            return {"frames": self.frames, "dropped_frames": self.dropped_frames}
+        mean_sec = sum(self.frame_times) / len(self.frame_times)
+        return {
+            "frames": self.frames,
+            "dropped_frames": self.dropped_frames,
+            "fps": 1 / mean_sec if mean_sec > 0 else 0,
+            "mean_frame_ms": 1000 * mean_sec,
+            "max_frame_ms": 1000 * max(self.frame_times),
+        }
+
 
 @dataclass
 class Rect:
@@ -0,0 +1,303 @@
+"""
+Per-effect GPU cost of frag.glsl, run this before editing the shaders for a show:
+
+    python -m gmae.profile_effects --resolution 1920x1080 --resolution 3840x2160 --budget-ms 2
+
+Renders fixed frames offscreen with GPU timer queries, for preprocessor variants of the shader:
+ - the full shader and the base (no effects at all),
+ - each effect in isolation ("isolated" = only that effect minus the base),
+ - the full shader with each effect removed ("removed" = full minus that variant).
+Exits with 1 if any effect is over its budget.
+"""
+
+import argparse
+import sys
+from dataclasses import dataclass, field
+from os import getenv
+from pathlib import Path
+from statistics import median
+
+import glfw
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.GL import shaders
+
+from gmae.frame_store import FrameStorePlayer
+from gmae.gl_state import GLState
+from gmae.lookup_textures import LookupTextures
+from gmae.processor import Processor, VERTEX_SHADER_FILE, WET_FRAGMENT_SHADER_FILE
+from gmae.processor_utils import EffectId
+from gmae.utils import log, inject_defines, env_means_true
+
+# names as in the table -> preprocessor switches in frag.glsl
+EFFECT_DEFINES = {
+    EffectId.A.name: "EFFECT_A",
+    EffectId.B.name: "EFFECT_B",
+    EffectId.C.name: "EFFECT_C",
+    EffectId.D.name: "EFFECT_D",
+    EffectId.GreenBlob.name: "EFFECT_GREEN_BLOB",
+    "ScanLines": "EFFECT_SCAN_LINES",
+}
+
+DEFAULT_RESOLUTIONS = ["1280x720", "1920x1080", "3840x2160"]
+DEFAULT_FRAMES = 60
+WARMUP_FRAMES = 10
+# fixed shader times, so that every run renders the very same frames
+FIRST_FRAME_TIME = 13.7
+FRAME_TIME_STEP = 1 / 60
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure the GPU cost per effect of frag.glsl")
+    parser.add_argument("--resolution",
+                        "-r",
+                        action="append",
+                        help=f"WIDTHxHEIGHT to render at, can be given multiple times (default: {DEFAULT_RESOLUTIONS})"
+                        )
+    parser.add_argument("--frames",
+                        "-n",
+                        type=int,
+                        default=DEFAULT_FRAMES,
+                        help="Number of measured frames per variant and resolution"
+                        )
+    parser.add_argument("--budget-ms",
+                        type=float,
+                        default=float(getenv('GMAE_EFFECT_BUDGET_MS', 0)),
+                        help="Fail if any effect costs more than this (ms per frame), 0 = no budget"
+                        )
+    parser.add_argument("--budget",
+                        action="append",
+                        default=[],
+                        metavar="EFFECT=MS",
+                        help="Budget for a single effect, overrides --budget-ms, e.g. B=4.5"
+                        )
+    parser.add_argument("--replay",
+                        type=str,
+                        default=getenv('GMAE_REPLAY', ''),
+                        help="Take the input frames from a recorded frame store instead of a test pattern"
+                        )
+    parser.add_argument("--lookup-textures",
+                        type=bool,
+                        default=not env_means_true('GMAE_ANALYTIC_NOISE'),
+                        help="Measure with the noise / dither lookup textures (otherwise the analytic versions)"
+                        )
+    return parser.parse_args()
+
+
+def parse_resolution(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def parse_budgets(args):
+    budgets = {
+        effect: args.budget_ms
+        for effect in EFFECT_DEFINES
+        if args.budget_ms > 0
+    }
+    for entry in args.budget:
+        effect, ms = entry.split("=")
+        if effect not in EFFECT_DEFINES:
+            raise ValueError(f"Unknown effect {effect}, choose from {list(EFFECT_DEFINES)}")
+        budgets[effect] = float(ms)
+    return budgets
+
+
+def test_pattern(width=1920, height=1080):
+    # something with gradients, edges and a bit of noise, so no effect has it too easy
+    y, x = np.mgrid[0:height, 0:width]
+    rng = np.random.default_rng(210)
+    frame = np.dstack([
+        255 * x / width,
+        255 * y / height,
+        255 * ((x // 64 + y // 64) % 2),
+    ])
+    frame += rng.normal(0, 12, frame.shape)
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+@dataclass
+class EffectCost:
+    effect: str
+    isolated_ms: dict = field(default_factory=dict)
+    removed_ms: dict = field(default_factory=dict)
+
+    def worst_ms(self):
+        return max([*self.isolated_ms.values(), *self.removed_ms.values()], default=0)
+
+
+class EffectProfiler:
+    def __init__(self, input_frames, use_lookup_textures=True):
+        if not glfw.init():
+            raise Exception("GLFW cannot initiailize.")
+        glfw.window_hint(glfw.VISIBLE, glfw.FALSE)
+        self.window = glfw.create_window(64, 64, "SUPER GMAE PROFILER", None, None)
+        if not self.window:
+            glfw.terminate()
+            raise Exception("GLFW cannot create window")
+        glfw.make_context_current(self.window)
+
+        folder = Path(__file__).resolve().parent
+        with open(folder / VERTEX_SHADER_FILE, 'r') as file:
+            self.vertex_shader = shaders.compileShader(file.read(), GL_VERTEX_SHADER)
+        with open(folder / WET_FRAGMENT_SHADER_FILE, 'r') as file:
+            self.fragment_shader_source = file.read()
+        self.programs = {}
+        # uncached: the numbers are about the shader, and every measure() has a fresh program anyway
+        self.gl = GLState(caching=False)
+
+        self.input_frames = input_frames
+        self.use_lookup_textures = use_lookup_textures
+        self.lookup_textures = LookupTextures.create()
+        self.texture = glGenTextures(1)
+        # the vertex shader makes up its triangle itself, but GL wants some VAO bound
+        self.vao = glGenVertexArrays(1)
+        self.query = glGenQueries(1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, _val, _tb):
+        glDeleteQueries(1, [self.query])
+        glDeleteTextures(1, [self.texture])
+        self.lookup_textures.delete()
+        glDeleteVertexArrays(1, [self.vao])
+        for program in self.programs.values():
+            glDeleteProgram(program)
+        glfw.destroy_window(self.window)
+        glfw.terminate()
+
+    def program_with(self, enabled_effects):
+        key = frozenset(enabled_effects)
+        if key not in self.programs:
+            defines = {
+                define: int(effect in key)
+                for effect, define in EFFECT_DEFINES.items()
+            }
+            source = inject_defines(self.fragment_shader_source, defines)
+            try:
+                fragment_shader = shaders.compileShader(source, GL_FRAGMENT_SHADER)
+            except shaders.ShaderCompilationError as exc:
+                Processor.print_error_prettier(exc, title=f"Fragment Shader with {sorted(key)}")
+                raise exc
+            self.programs[key] = shaders.compileProgram(self.vertex_shader, fragment_shader)
+            glDeleteShader(fragment_shader)
+        return self.programs[key]
+
+    def upload_frame(self, frame):
+        glActiveTexture(GL_TEXTURE0)
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexImage2D(
+            GL_TEXTURE_2D, 0, GL_RGB, frame.shape[1], frame.shape[0], 0,
+            GL_BGR, GL_UNSIGNED_BYTE, np.ascontiguousarray(frame)
+        )
+
+    def measure(self, enabled_effects, width, height, frames):
+        """
+        Median GPU time in ms per frame of the shader variant, with all effects at full strength.
+        """
+        program = self.program_with(enabled_effects)
+        locations = Processor.read_uniform_locations(program)
+
+        target = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, target)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA8, width, height, 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
+        framebuffer = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, framebuffer)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, target, 0)
+        glViewport(0, 0, width, height)
+
+        gl = self.gl
+        gl.use_program(program)
+        # the same units as in the Processor, nothing is bound at the history / levels / LUT ones,
+        # and their switches stay at 0, so these effects just don't get their input
+        Processor.set_sampler_units(gl, locations)
+        gl.uniform(glUniform2f, locations.resolution, width, height)
+        gl.uniform(glUniform1i, locations.use_lookup_textures, self.use_lookup_textures)
+        for amount_location in locations.effect_amount.values():
+            gl.uniform(glUniform1f, amount_location, 1)
+        glBindVertexArray(self.vao)
+
+        milliseconds = []
+        for index in range(WARMUP_FRAMES + frames):
+            self.upload_frame(self.input_frames[index % len(self.input_frames)])
+            gl.uniform(glUniform1f, locations.time, FIRST_FRAME_TIME + index * FRAME_TIME_STEP)
+            glBeginQuery(GL_TIME_ELAPSED, self.query)
+            glDrawArrays(GL_TRIANGLES, 0, 3)
+            glEndQuery(GL_TIME_ELAPSED)
+            # waiting for the result serializes the frames, which is what we want here
+            nanoseconds = glGetQueryObjectui64v(self.query, GL_QUERY_RESULT)
+            if index >= WARMUP_FRAMES:
+                milliseconds.append(int(nanoseconds) * 1e-6)
+
+        glBindVertexArray(0)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        glDeleteFramebuffers(1, [framebuffer])
+        glDeleteTextures(1, [target])
+        return median(milliseconds)
+
+    def profile(self, resolutions, frames):
+        all_effects = set(EFFECT_DEFINES)
+        full_ms = {}
+        base_ms = {}
+        costs = [EffectCost(effect) for effect in EFFECT_DEFINES]
+        for width, height in resolutions:
+            key = (width, height)
+            log(f"Profile at {width}x{height}")
+            full_ms[key] = self.measure(all_effects, width, height, frames)
+            base_ms[key] = self.measure(set(), width, height, frames)
+            for cost in costs:
+                only = self.measure({cost.effect}, width, height, frames)
+                without = self.measure(all_effects - {cost.effect}, width, height, frames)
+                cost.isolated_ms[key] = only - base_ms[key]
+                cost.removed_ms[key] = full_ms[key] - without
+        return full_ms, base_ms, costs
+
+
+def print_report(resolutions, full_ms, base_ms, costs):
+    column = 22
+    print("== EFFECT COST (ms per frame, isolated / removed) " + "=" * 40)
+    print("effect".ljust(12) + "".join(f"{w}x{h}".rjust(column) for w, h in resolutions))
+    print("full".ljust(12) + "".join(f"{full_ms[r]:.3f}".rjust(column) for r in resolutions))
+    print("base".ljust(12) + "".join(f"{base_ms[r]:.3f}".rjust(column) for r in resolutions))
+    for cost in costs:
+        cells = "".join(
+            f"{cost.isolated_ms[r]:.3f} / {cost.removed_ms[r]:.3f}".rjust(column)
+            for r in resolutions
+        )
+        print(cost.effect.ljust(12) + cells)
+    print("=" * 90)
+
+
+def check_budgets(costs, budgets):
+    over_budget = [
+        cost
+        for cost in costs
+        if cost.effect in budgets and cost.worst_ms() > budgets[cost.effect]
+    ]
+    for cost in over_budget:
+        print(f"OVER BUDGET: {cost.effect} costs up to {cost.worst_ms():.3f} ms, budget is {budgets[cost.effect]} ms")
+    return not over_budget
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    resolutions = [parse_resolution(text) for text in args.resolution or DEFAULT_RESOLUTIONS]
+    budgets = parse_budgets(args)
+
+    if args.replay:
+        player = FrameStorePlayer(args.replay, realtime=False)
+        # copy, so we don't keep the mmap busy
+        input_frames = [np.array(frame) for frame in player.frames[:WARMUP_FRAMES + args.frames]]
+        player.release()
+    else:
+        input_frames = [test_pattern()]
+
+    with EffectProfiler(input_frames, use_lookup_textures=args.lookup_textures) as profiler:
+        full_ms, base_ms, costs = profiler.profile(resolutions, args.frames)
+
+    print_report(resolutions, full_ms, base_ms, costs)
+    if not check_budgets(costs, budgets):
+        sys.exit(1)
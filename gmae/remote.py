@@ -0,0 +1,269 @@
+"""
+Remote control and telemetry, so the effects can be driven from somewhere else than the keyboard of the show machine.
+
+A tiny HTTP server on its own thread (asyncio, no extra dependencies):
+    GET  /state      current telemetry as JSON
+    GET  /telemetry  the same as a stream (Server-Sent Events), TELEMETRY_INTERVAL_SEC apart
+    POST /command    JSON body, e.g. {"command": "set_strength", "effect": "A", "value": 0.5}
+
+Try e.g.  curl -N http://127.0.0.1:8210/telemetry
+     or   curl -d '{"command": "toggle_dry"}' http://127.0.0.1:8210/command
+
+The render loop never waits for the network: commands go through a deque (append / popleft are atomic)
+and get applied at the next frame boundary, telemetry is just a dict that the render loop replaces.
+When MAX_PENDING_COMMANDS are waiting already (the render loop hangs), new commands get a 429, nothing is dropped.
+"""
+
+import asyncio
+import json
+from collections import deque
+from math import isfinite
+from threading import Thread
+from typing import TYPE_CHECKING
+
+from gmae.frame_interpolation import InterpolationQuality
+from gmae.processor_utils import EffectId, MotionMode
+from gmae.utils import log
+
+if TYPE_CHECKING:
+    from gmae.processor import Processor
+
+TELEMETRY_INTERVAL_SEC = 0.1
+MAX_PENDING_COMMANDS = 256
+MAX_BODY_BYTES = 64 * 1024
+# a flash or a tape stop longer than that is surely a typo, and would block the effect / the audio for ages
+MAX_DURATION_SEC = 120
+
+# command name -> required parameters
+COMMANDS = {
+    "set_strength": ["effect", "value"],
+    "trigger_flash": ["effect"],
+    "toggle_dry": [],
+    "set_dry": ["value"],
+    "reload_shaders": [],
+    "toggle_mute": [],
+    "tape_stop": [],
+    "toggle_auto_levels": [],
+    "toggle_color_lut": [],
+    "set_motion_mode": ["mode"],
+    "set_interpolation": ["quality"],
+}
+
+HTTP_STATUS_TEXT = {
+    200: "OK",
+    202: "Accepted",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+}
+
+
+class CommandError(ValueError):
+    pass
+
+
+def is_number(value):
+    # json.loads() gives NaN / Infinity as floats, and bool is an int for isinstance()
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and isfinite(value)
+
+
+def validate_command(command: dict):
+    # done on the server thread, so the render loop only ever gets commands that make sense
+    if not isinstance(command, dict):
+        raise CommandError("Command must be a JSON object")
+    name = command.get("command")
+    if name not in COMMANDS:
+        raise CommandError(f"Unknown command {name!r}, choose from {list(COMMANDS)}")
+    for parameter in COMMANDS[name]:
+        if parameter not in command:
+            raise CommandError(f"Command {name} needs {parameter!r}")
+    if "effect" in command and command["effect"] not in EffectId.__members__:
+        raise CommandError(f"Unknown effect {command['effect']!r}, choose from {list(EffectId.__members__)}")
+    if name == "set_strength" and not is_number(command["value"]):
+        raise CommandError("Strength value must be a finite number")
+    if name == "set_dry" and not isinstance(command["value"], bool):
+        # bool("false") would be True
+        raise CommandError("Dry value must be true or false")
+    if name in ["trigger_flash", "tape_stop"] and command.get("duration_sec") is not None:
+        duration_sec = command["duration_sec"]
+        if not is_number(duration_sec) or not 0 < duration_sec <= MAX_DURATION_SEC:
+            raise CommandError(f"duration_sec must be a number in (0, {MAX_DURATION_SEC}]")
+    if name == "set_motion_mode" and command["mode"] not in [mode.value for mode in MotionMode]:
+        raise CommandError(f"Unknown motion mode {command['mode']!r}, choose from {[mode.value for mode in MotionMode]}")
+    if name == "set_interpolation" and command["quality"] not in [quality.value for quality in InterpolationQuality]:
+        raise CommandError(f"Unknown interpolation quality {command['quality']!r}, "
+                           f"choose from {[quality.value for quality in InterpolationQuality]}")
+    return command
+
+
+class RemoteControl:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        # no maxlen, that would drop the oldest command silently. _receive_command() keeps it short
+        self.commands = deque()
+        self.rejected_commands = 0
+        self.telemetry = {}
+        self.clients = 0
+        self.loop = None
+        self.stopped = None
+        self.thread = Thread(target=self._serve, name="RemoteControl", daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, _type, _val, _tb):
+        self.stop()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        if self.loop is not None and self.stopped is not None:
+            self.loop.call_soon_threadsafe(self.stopped.set)
+        self.thread.join(timeout=1)
+
+    # --- render thread side, none of this may block
+
+    def publish(self, telemetry: dict):
+        # replacing the reference is atomic, the server only ever reads complete dicts
+        self.telemetry = telemetry
+
+    def summary(self):
+        return {
+            "pending_commands": len(self.commands),
+            "rejected_commands": self.rejected_commands,
+            "clients": self.clients,
+        }
+
+    def apply_pending(self, processor: "Processor"):
+        while self.commands:
+            command = self.commands.popleft()
+            try:
+                self.apply(command, processor)
+            except Exception as exc:
+                print("Remote Command failed:", command, exc)
+
+    @staticmethod
+    def apply(command: dict, processor: "Processor"):
+        name = command["command"]
+        if name == "set_strength":
+            processor.effects.set_strength(EffectId[command["effect"]], command["value"])
+        elif name == "trigger_flash":
+            processor.effects.trigger_flash(EffectId[command["effect"]], command.get("duration_sec"))
+        elif name == "toggle_dry":
+            processor.use_dry_program = not processor.use_dry_program
+        elif name == "set_dry":
+            processor.use_dry_program = command["value"]
+        elif name == "reload_shaders":
+            processor.reload_shaders()
+        elif name == "toggle_mute":
+            processor.audio_stream.toggle_mute()
+        elif name == "toggle_color_lut":
+            processor.toggle_color_lut()
+        elif name == "toggle_auto_levels":
+            processor.toggle_auto_levels()
+        elif name == "set_motion_mode":
+            processor.set_motion_mode(MotionMode(command["mode"]))
+        elif name == "set_interpolation":
+            processor.set_interpolation(InterpolationQuality(command["quality"]))
+        elif name == "tape_stop":
+            processor.audio_stream.trigger_tape_stop(command.get("duration_sec"))
+
+    # --- server thread side
+
+    def _serve(self):
+        asyncio.run(self._main())
+
+    async def _main(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        log(f"Remote Control listening on http://{self.host}:{self.port}")
+        await self.stopped.wait()
+        server.close()
+
+    async def _handle(self, reader, writer):
+        try:
+            method, path, headers = await self._read_request_head(reader)
+            if path == "/state" and method == "GET":
+                await self._respond(writer, 200, self.telemetry)
+            elif path == "/telemetry" and method == "GET":
+                await self._stream_telemetry(writer)
+            elif path == "/command" and method == "POST":
+                await self._receive_command(reader, writer, headers)
+            elif path in ["/state", "/telemetry", "/command"]:
+                await self._respond(writer, 405, {"error": f"{method} not allowed on {path}"})
+            else:
+                await self._respond(writer, 404, {"error": f"No {path} here"})
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        except (ValueError, UnicodeDecodeError) as exc:
+            await self._respond(writer, 400, {"error": str(exc)})
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request_head(reader):
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        if not request_line:
+            raise ConnectionError("Client left")
+        method, path, _version = request_line.split(" ", 2)
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            key, value = line.split(":", 1)
+            headers[key.strip().casefold()] = value.strip()
+        return method.upper(), path.split("?")[0], headers
+
+    async def _receive_command(self, reader, writer, headers):
+        length = int(headers.get("content-length", 0))
+        if length > MAX_BODY_BYTES:
+            await self._respond(writer, 413, {"error": "Command too large"})
+            return
+        body = await reader.readexactly(length)
+        try:
+            command = validate_command(json.loads(body))
+        except (CommandError, json.JSONDecodeError) as exc:
+            await self._respond(writer, 400, {"error": str(exc)})
+            return
+        # only this thread appends, so it can't get longer between the check and the append
+        if len(self.commands) >= MAX_PENDING_COMMANDS:
+            self.rejected_commands += 1
+            await self._respond(writer, 429, {"error": f"{len(self.commands)} commands pending already, try again"})
+            return
+        self.commands.append(command)
+        await self._respond(writer, 202, {"queued": command})
+
+    async def _stream_telemetry(self, writer):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        self.clients += 1
+        try:
+            while not self.stopped.is_set():
+                writer.write(f"data: {json.dumps(self.telemetry)}\n\n".encode("utf-8"))
+                await writer.drain()
+                await asyncio.sleep(TELEMETRY_INTERVAL_SEC)
+        finally:
+            self.clients -= 1
+
+    @staticmethod
+    async def _respond(writer, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {HTTP_STATUS_TEXT[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1")
+            + body
+        )
+        await writer.drain()
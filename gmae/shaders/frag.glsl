@@ -10,6 +10,56 @@ uniform float aEffectC;
 uniform float aEffectD;
 uniform float aEffectGreenBlob;
 
+// precomputed lookup textures (see lookup_textures.py), iUseLookupTextures switches between these and the analytic versions
+uniform bool iUseLookupTextures;
+uniform sampler2D iNoiseLookup; // R = rand() on the integer lattice, G = hash12() on the integer lattice
+uniform sampler2D iBlueNoise;
+uniform sampler2D iBayerLookup;
+
+// the last frames, on the GPU (see frame_history.py). iHistoryDepth = 0 means there is no history (yet).
+// iHistoryIndex is the layer of the newest one, which is the current frame for --history-source captured,
+// but the previous output for --history-source processed.
+uniform sampler2DArray iHistory;
+uniform int iHistoryDepth;
+uniform int iHistoryIndex;
+
+// the color-only effects (A, C, grading) baked into a 3D LUT (see color_lut.py), iUseColorLut switches to it.
+// with BAKE_COLOR_LUT, this shader is the one that bakes it: one draw per slice, iColorLutSlice being the blue axis.
+uniform bool iUseColorLut;
+uniform sampler3D iColorLut;
+uniform int iColorLutSize;
+uniform int iColorLutSlice;
+uniform bool iUseGradingLut;
+uniform sampler3D iGradingLut;
+
+#ifndef BAKE_COLOR_LUT
+#define BAKE_COLOR_LUT 0
+#endif
+
+// effect switches, so the profiler (profile_effects.py) can build variants of this shader. all on by default.
+#ifndef EFFECT_A
+#define EFFECT_A 1
+#endif
+#ifndef EFFECT_B
+#define EFFECT_B 1
+#endif
+#ifndef EFFECT_C
+#define EFFECT_C 1
+#endif
+#ifndef EFFECT_D
+#define EFFECT_D 1
+#endif
+#ifndef EFFECT_GREEN_BLOB
+#define EFFECT_GREEN_BLOB 1
+#endif
+#ifndef EFFECT_SCAN_LINES
+#define EFFECT_SCAN_LINES 1
+#endif
+// effectD dithers with the Bayer matrix, with 1 it takes the blue noise instead (looks different, less like a grid)
+#ifndef DITHER_BLUE_NOISE
+#define DITHER_BLUE_NOISE 0
+#endif
+
 const float pi = 3.14159265358979323846;
 vec3 c = vec3(1., 0., -1.);
 
@@ -29,6 +79,10 @@ float noise(vec2 p, float freq ){
 	vec2 xy = mod(p,unit)/unit;
 	//xy = 3.*xy*xy-2.*xy*xy*xy;
 	xy = .5*(1.-cos(pi *xy));
+	if (iUseLookupTextures) {
+		// the linear filtering does the four mix() for us, in one fetch
+		return texture(iNoiseLookup, (ij + xy + .5) / vec2(textureSize(iNoiseLookup, 0))).r;
+	}
 	float a = rand((ij+vec2(0.,0.)));
 	float b = rand((ij+vec2(1.,0.)));
 	float c = rand((ij+vec2(0.,1.)));
@@ -64,6 +118,58 @@ vec2 random_vec(float x) {
 	);
 }
 
+// the smoothed (min, max, mean, median) luma of the input, measured on the GPU (see auto_levels.py)
+uniform bool iUseAutoLevels;
+uniform sampler2D iLevels;
+
+// black point, 1 / range, gamma. set once per fragment by setupAutoLevels(), the blur alone reads the input 432 times
+vec3 levelsParams = vec3(0., 1., 1.);
+
+void setupAutoLevels()
+{
+    if (!iUseAutoLevels) {
+        return;
+    }
+    vec4 levels = texelFetch(iLevels, ivec2(0), 0);
+    // a black frame should stay black, not turn into amplified noise
+    float range = max(levels.y - levels.x, 0.1);
+    // and the exposure: a gamma that brings the median towards the middle
+    float median = clamp((levels.w - levels.x) / range, 0.05, 0.95);
+    levelsParams = vec3(levels.x, 1. / range, clamp(log(.5) / log(median), .5, 2.));
+}
+
+vec3 autoLevels(vec3 col)
+{
+    if (!iUseAutoLevels) {
+        return col;
+    }
+    col = clamp((col - levelsParams.x) * levelsParams.y, 0., 1.);
+    return pow(col, vec3(levelsParams.z));
+}
+
+// every read of the input goes through here, so that all the effects work on the same levelled picture
+vec3 inputColor(vec2 coord)
+{
+    return autoLevels(texture(iPixelData, coord).xyz);
+}
+
+// frames_ago = 0 is the newest, older than the history reaches gives the oldest one there is
+vec3 history(vec2 image_coord, int frames_ago)
+{
+    if (iHistoryDepth == 0) {
+        return inputColor(image_coord);
+    }
+    int layer = (iHistoryIndex - min(frames_ago, iHistoryDepth - 1) + iHistoryDepth) % iHistoryDepth;
+    return texture(iHistory, vec3(image_coord, float(layer))).xyz;
+}
+
+// the lattice points are the texel centers
+vec3 applyLut(sampler3D lut, vec3 col)
+{
+    float size = float(textureSize(lut, 0).x);
+    return texture(lut, (clamp(col, 0., 1.) * (size - 1.) + .5) / size).rgb;
+}
+
 //////////////////////// https://www.shadertoy.com/view/M3cSzH
 
 float hash12(vec2 p)
@@ -79,6 +185,9 @@ float lfnoise(vec2 t)
     vec2 i = floor(t);
     t = fract(t);
     t = smoothstep(c.yy, c.xx, t);
+    if (iUseLookupTextures) {
+        return -1. + 2. * texture(iNoiseLookup, (i + t + .5) / vec2(textureSize(iNoiseLookup, 0))).g;
+    }
     vec2 v1 = vec2(hash12(i), hash12(i+c.xy)),
         v2 = vec2(hash12(i+c.yx), hash12(i+c.xx));
     v1 = c.zz+2.*mix(v1, v2, t.y);
@@ -146,7 +255,7 @@ void blur(out vec3 fragColor, vec2 fragCoord) {
             // Unnormalized Gauss kernel.
             exp( -x / 2.)
             // Remap to texture coordinates.
-            * texture(iPixelData, ((uv - z) * iResolution.y + .5 * iResolution.xy) / iResolution.xy).xyz;
+            * inputColor(((uv - z) * iResolution.y + .5 * iResolution.xy) / iResolution.xy);
     }
     fragColor = col / sampleCount * pi * pi / sqrt(2. * pi) * 1.25;
 }
@@ -180,6 +289,10 @@ const int MAX_LEVEL = 4;
 
 float GetBayerFromCoordLevel(vec2 pixelpos)
 {
+    if (iUseLookupTextures) {
+        // the pattern repeats every 2^MAX_LEVEL pixels, which is exactly the texture size
+        return texelFetch(iBayerLookup, ivec2(pixelpos) & ((1 << MAX_LEVEL) - 1), 0).r;
+    }
     ivec2 ppos = ivec2(pixelpos);
     int sum = 0;
     for(int i = 0; i<MAX_LEVEL; i++)
@@ -191,19 +304,23 @@ float GetBayerFromCoordLevel(vec2 pixelpos)
     return float(sum) / float(1 << (2 * MAX_LEVEL));
 }
 
-// Blends the nearest two palette colors with dithering.
-float GetDitheredPalette(float x, vec2 pixel)
+// only with DITHER_BLUE_NOISE. there is no cheap analytic blue noise, so without the lookup textures it's Bayer
+float GetBlueNoise(vec2 pixelpos)
 {
-	float idx = clamp(x,0.0,1.0)*AMOUNT_COLOR-1.;
-
-	float c1 = 0.;
-	float c2 = 0.;
+    if (iUseLookupTextures) {
+        return texelFetch(iBlueNoise, ivec2(pixelpos) % textureSize(iBlueNoise, 0), 0).r;
+    }
+    return GetBayerFromCoordLevel(pixelpos);
+}
 
-	c1 = floor(x*AMOUNT_COLOR-1.)/AMOUNT_COLOR;
+// Blends the nearest two palette colors with dithering, all three channels at once (same dither value).
+vec3 GetDitheredPalette(vec3 x, float dith)
+{
+	vec3 idx = clamp(x,0.0,1.0)*AMOUNT_COLOR-1.;
 
-    c2 =c1+1./(AMOUNT_COLOR);
-    float dith = GetBayerFromCoordLevel(pixel);
-    float mixAmt = float(fract(idx) > dith);
+	vec3 c1 = floor(x*AMOUNT_COLOR-1.)/AMOUNT_COLOR;
+	vec3 c2 = c1+1./(AMOUNT_COLOR);
+	vec3 mixAmt = vec3(greaterThan(fract(idx), vec3(dith)));
 
 	return mix(c1,c2,mixAmt);
 }
@@ -214,11 +331,12 @@ void effectD(inout vec3 col, in vec3 orig_col, in vec2 _uv)
     vec2 fragCoord = floor(gl_FragCoord.xy / DOWN_SCALE) * DOWN_SCALE;
 	vec2 uv = fragCoord.xy/iResolution.xy;
 
-    float outColor1 = GetDitheredPalette(texture(iPixelData, uv).x, fragCoord / DOWN_SCALE);
-    float outColor2 = GetDitheredPalette(texture(iPixelData, uv).y, fragCoord / DOWN_SCALE);
-    float outColor3 = GetDitheredPalette(texture(iPixelData, uv).z, fragCoord / DOWN_SCALE);
-
-    vec3 new_col = vec3(outColor1,outColor2,outColor3);
+#if DITHER_BLUE_NOISE
+    float dith = GetBlueNoise(fragCoord / DOWN_SCALE);
+#else
+    float dith = GetBayerFromCoordLevel(fragCoord / DOWN_SCALE);
+#endif
+    vec3 new_col = GetDitheredPalette(inputColor(uv), dith);
     col = mix(col, new_col, aEffectD);
 }
 
@@ -226,6 +344,21 @@ void effectD(inout vec3 col, in vec3 orig_col, in vec2 _uv)
 
 void main()
 {
+#if BAKE_COLOR_LUT
+    vec3 lattice_col = vec3(ivec3(gl_FragCoord.xy, iColorLutSlice)) / float(iColorLutSize - 1);
+#if EFFECT_A
+    effectA(lattice_col, lattice_col, c.yy);
+#endif
+#if EFFECT_C
+    effectC(lattice_col, lattice_col, c.yy);
+#endif
+    if (iUseGradingLut) {
+        lattice_col = applyLut(iGradingLut, lattice_col);
+    }
+    out_color = vec4(clamp(lattice_col, c.yyy, c.xxx), 1.0);
+    return;
+#endif
+
     // image coordinates are:
     // TOP: y=0, BOTTOM: y=1, LEFT: x=0, RIGHT: x=1
     vec2 image_coord = vec2(
@@ -242,11 +375,12 @@ void main()
 	pd = 0.002 * (1. + sin(iTime));
 	image_coord = floor(image_coord / pd) * pd;
 
-    vec3 col = texture(iPixelData, image_coord).xyz;
+    setupAutoLevels();
+    vec3 col = inputColor(image_coord);
     vec3 orig_col = col;
 
     // and some neighbor, for Schabernack
-    vec3 col_offset = texture(iPixelData, image_coord + vec2(0.003)).xyz;
+    vec3 col_offset = inputColor(image_coord + vec2(0.003));
 
     // for our postprocessing, it might make more sense to have
     // CENTER = (0,0), TOP=1, BOTTOM=-1 and LEFT/RIGHT according to pixel ratio
@@ -260,10 +394,12 @@ void main()
 
     float r = col.x;
 
+#if EFFECT_SCAN_LINES
     float scan_pos = 2. * mod(0.1 * iTime, 1.) - 1.;
     float scan_distance = abs(uv.x * (1. + 3. * uv.y) - scan_pos);
     float scan_strength = exp(-.1 * scan_distance * scan_distance);
     col.y = col.z - scan_strength * col.y;
+#endif
 
     // some funny colorizations based on a very stupid condition
     /*
@@ -279,16 +415,36 @@ void main()
     );
     col = max(col, annoying_offset);
 
+#if EFFECT_GREEN_BLOB
     vec2 bobble_center = 0.3 * random_vec(0.43 * iTime);
 	float bobble_distance = distance(uv, bobble_center);
 	float bobble_size = 13.5 + 7. * sin(iTime) * sin(3. * iTime + 0.2) + uv.y * cos(0.23 * iTime + 0.01);
 	col.y += aEffectGreenBlob *
         exp(-bobble_size * bobble_distance * bobble_distance);
+#endif
 
-	effectA(col, orig_col, uv);
+#if EFFECT_A
+    if (!iUseColorLut) {
+        effectA(col, orig_col, uv);
+    }
+#endif
+#if EFFECT_B
     effectB(col, orig_col, uv);
-	effectC(col, orig_col, uv);
+#endif
+#if EFFECT_C
+    if (!iUseColorLut) {
+        effectC(col, orig_col, uv);
+    }
+#endif
+    if (iUseColorLut) {
+        // effect A and C (and the grading) in one fetch
+        col = applyLut(iColorLut, col);
+    } else if (iUseGradingLut) {
+        col = applyLut(iGradingLut, col);
+    }
+#if EFFECT_D
     effectD(col, orig_col, uv);
+#endif
 
     out_color = vec4(clamp(col, c.yyy, c.xxx), 1.0);
 }
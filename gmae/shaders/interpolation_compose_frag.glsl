@@ -0,0 +1,29 @@
+#version 330 core
+out vec4 out_color;
+
+uniform sampler2D iPreviousFrame;
+uniform sampler2D iCurrentFrame;
+uniform sampler2D iMotion;
+uniform float iPhase; // 0 = the previous frame, 1 = the current one
+uniform int iUseMotion;
+
+// where even the best match of a block was that bad, it's no motion but something new - that just gets blended
+#define MISMATCH_LIMIT .08
+
+void main()
+{
+    vec2 uv = gl_FragCoord.xy / vec2(textureSize(iCurrentFrame, 0));
+    vec3 blended = mix(texture(iPreviousFrame, uv).rgb, texture(iCurrentFrame, uv).rgb, iPhase);
+    if (iUseMotion == 0) {
+        out_color = vec4(blended, 1.);
+        return;
+    }
+    // what is at uv in the current frame was at uv + offset in the previous one,
+    // so in between, it comes from iPhase of the way from there, or the rest of the way back from here
+    vec3 motion = texture(iMotion, uv).xyz;
+    vec3 from_previous = texture(iPreviousFrame, uv + iPhase * motion.xy).rgb;
+    vec3 from_current = texture(iCurrentFrame, uv - (1. - iPhase) * motion.xy).rgb;
+    vec3 warped = mix(from_previous, from_current, iPhase);
+    float confidence = 1. - smoothstep(.5 * MISMATCH_LIMIT, MISMATCH_LIMIT, motion.z);
+    out_color = vec4(mix(blended, warped, confidence), 1.);
+}
@@ -0,0 +1,56 @@
+#version 330 core
+out vec4 out_motion;
+
+uniform sampler2D iCurrentLuma;
+uniform sampler2D iPreviousLuma;
+
+#ifndef BLOCK_SIZE
+#define BLOCK_SIZE 8
+#endif
+#ifndef SEARCH_RADIUS
+#define SEARCH_RADIUS 4
+#endif
+#ifndef SAMPLE_STEP
+#define SAMPLE_STEP 2
+#endif
+
+// every candidate costs this much more per texel of offset, so that flat areas don't get random vectors
+#define OFFSET_PENALTY .002
+
+const int SAMPLES = BLOCK_SIZE / SAMPLE_STEP;
+
+// one fragment per block of the current luma: where in the previous luma that block matches best
+// (least mean absolute difference), as offset in texture coordinates, and that difference
+void main()
+{
+    ivec2 size = textureSize(iCurrentLuma, 0);
+    ivec2 origin = ivec2(gl_FragCoord.xy) * BLOCK_SIZE;
+    float current[SAMPLES * SAMPLES];
+    for (int y = 0; y < SAMPLES; y++) {
+        for (int x = 0; x < SAMPLES; x++) {
+            current[y * SAMPLES + x] = texelFetch(iCurrentLuma, origin + ivec2(x, y) * SAMPLE_STEP, 0).r;
+        }
+    }
+    float best_cost = 1e9;
+    float best_difference = 0.;
+    ivec2 best_offset = ivec2(0);
+    for (int dy = -SEARCH_RADIUS; dy <= SEARCH_RADIUS; dy++) {
+        for (int dx = -SEARCH_RADIUS; dx <= SEARCH_RADIUS; dx++) {
+            float difference = 0.;
+            for (int y = 0; y < SAMPLES; y++) {
+                for (int x = 0; x < SAMPLES; x++) {
+                    ivec2 texel = clamp(origin + ivec2(x, y) * SAMPLE_STEP + ivec2(dx, dy), ivec2(0), size - 1);
+                    difference += abs(current[y * SAMPLES + x] - texelFetch(iPreviousLuma, texel, 0).r);
+                }
+            }
+            difference /= float(SAMPLES * SAMPLES);
+            float cost = difference + OFFSET_PENALTY * length(vec2(dx, dy));
+            if (cost < best_cost) {
+                best_cost = cost;
+                best_difference = difference;
+                best_offset = ivec2(dx, dy);
+            }
+        }
+    }
+    out_motion = vec4(vec2(best_offset) / vec2(size), best_difference, 1.);
+}
@@ -0,0 +1,42 @@
+#version 330 core
+out vec4 out_levels;
+
+uniform sampler2D iTileStats;
+uniform sampler2D iPreviousLevels;
+uniform float iSmoothing; // 0 = keep the previous levels, 1 = take the new ones
+
+#ifndef HISTOGRAM_BINS
+#define HISTOGRAM_BINS 64
+#endif
+
+// the one fragment: (min, max, mean, median) luma over all tiles. the median comes from a histogram
+// of the tile means, interpolated within its bin, so a few stage lights don't count like half the picture.
+void main()
+{
+    ivec2 tiles = textureSize(iTileStats, 0);
+    float histogram[HISTOGRAM_BINS];
+    for (int bin = 0; bin < HISTOGRAM_BINS; bin++) {
+        histogram[bin] = 0.;
+    }
+    vec3 reduced = vec3(1., 0., 0.);
+    for (int y = 0; y < tiles.y; y++) {
+        for (int x = 0; x < tiles.x; x++) {
+            vec3 tile = texelFetch(iTileStats, ivec2(x, y), 0).xyz;
+            reduced = vec3(min(reduced.x, tile.x), max(reduced.y, tile.y), reduced.z + tile.z);
+            histogram[clamp(int(tile.z * float(HISTOGRAM_BINS)), 0, HISTOGRAM_BINS - 1)] += 1.;
+        }
+    }
+    float half_count = .5 * float(tiles.x * tiles.y);
+    float below = 0.;
+    float median = 1.;
+    for (int bin = 0; bin < HISTOGRAM_BINS; bin++) {
+        if (below + histogram[bin] >= half_count) {
+            median = (float(bin) + (half_count - below) / histogram[bin]) / float(HISTOGRAM_BINS);
+            break;
+        }
+        below += histogram[bin];
+    }
+    vec4 levels = vec4(reduced.xy, reduced.z / float(tiles.x * tiles.y), median);
+    vec4 previous = texelFetch(iPreviousLevels, ivec2(0), 0);
+    out_levels = mix(previous, levels, iSmoothing);
+}
@@ -0,0 +1,30 @@
+#version 330 core
+out vec4 out_stats;
+
+uniform sampler2D iPixelData;
+uniform ivec2 iTiles;
+
+#ifndef SAMPLES_PER_TILE
+#define SAMPLES_PER_TILE 8
+#endif
+
+// one fragment per tile: (min, max, mean) luma of a SAMPLES_PER_TILE^2 grid inside that tile
+void main()
+{
+    vec2 tile_size = vec2(textureSize(iPixelData, 0)) / vec2(iTiles);
+    vec2 tile_origin = floor(gl_FragCoord.xy) * tile_size;
+    float lowest = 1.;
+    float highest = 0.;
+    float sum = 0.;
+    for (int y = 0; y < SAMPLES_PER_TILE; y++) {
+        for (int x = 0; x < SAMPLES_PER_TILE; x++) {
+            vec2 offset = (vec2(x, y) + .5) / float(SAMPLES_PER_TILE) * tile_size;
+            vec3 col = texelFetch(iPixelData, ivec2(tile_origin + offset), 0).rgb;
+            float luma = dot(col, vec3(.2126, .7152, .0722));
+            lowest = min(lowest, luma);
+            highest = max(highest, luma);
+            sum += luma;
+        }
+    }
+    out_stats = vec4(lowest, highest, sum / float(SAMPLES_PER_TILE * SAMPLES_PER_TILE), 1.);
+}
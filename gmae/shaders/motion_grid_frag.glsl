@@ -0,0 +1,28 @@
+#version 330 core
+out vec4 out_motion;
+
+uniform sampler2D iCurrentLuma;
+uniform sampler2D iPreviousLuma;
+uniform ivec2 iGrid;
+
+// one fragment per grid cell: (mean, max) absolute luma difference of the analysis texels in that cell,
+// and the mean signed one (> 0 means it got brighter)
+void main()
+{
+    ivec2 cell_size = textureSize(iCurrentLuma, 0) / iGrid;
+    ivec2 cell_origin = ivec2(gl_FragCoord.xy) * cell_size;
+    float sum = 0.;
+    float highest = 0.;
+    float signed_sum = 0.;
+    for (int y = 0; y < cell_size.y; y++) {
+        for (int x = 0; x < cell_size.x; x++) {
+            ivec2 texel = cell_origin + ivec2(x, y);
+            float diff = texelFetch(iCurrentLuma, texel, 0).r - texelFetch(iPreviousLuma, texel, 0).r;
+            sum += abs(diff);
+            highest = max(highest, abs(diff));
+            signed_sum += diff;
+        }
+    }
+    float count = float(cell_size.x * cell_size.y);
+    out_motion = vec4(sum / count, highest, signed_sum / count, 1.);
+}
@@ -0,0 +1,25 @@
+#version 330 core
+out vec4 out_luma;
+
+uniform sampler2D iPixelData;
+uniform ivec2 iSize;
+
+#ifndef SAMPLES_PER_TEXEL
+#define SAMPLES_PER_TEXEL 4
+#endif
+
+// one fragment per texel of the small analysis image: mean luma of a SAMPLES_PER_TEXEL^2 grid inside its block
+void main()
+{
+    vec2 block_size = vec2(textureSize(iPixelData, 0)) / vec2(iSize);
+    vec2 block_origin = floor(gl_FragCoord.xy) * block_size;
+    float sum = 0.;
+    for (int y = 0; y < SAMPLES_PER_TEXEL; y++) {
+        for (int x = 0; x < SAMPLES_PER_TEXEL; x++) {
+            vec2 offset = (vec2(x, y) + .5) / float(SAMPLES_PER_TEXEL) * block_size;
+            vec3 col = texelFetch(iPixelData, ivec2(block_origin + offset), 0).rgb;
+            sum += dot(col, vec3(.2126, .7152, .0722));
+        }
+    }
+    out_luma = vec4(sum / float(SAMPLES_PER_TEXEL * SAMPLES_PER_TEXEL), 0., 0., 1.);
+}
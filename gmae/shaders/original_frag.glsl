@@ -6,6 +6,24 @@ uniform vec2 iResolution;
 
 vec3 c = vec3(1., 0., -1.);
 
+// the smoothed (min, max, mean, median) luma of the input, measured on the GPU (see auto_levels.py)
+uniform bool iUseAutoLevels;
+uniform sampler2D iLevels;
+
+vec3 autoLevels(vec3 col)
+{
+    if (!iUseAutoLevels) {
+        return col;
+    }
+    vec4 levels = texelFetch(iLevels, ivec2(0), 0);
+    // a black frame should stay black, not turn into amplified noise
+    float range = max(levels.y - levels.x, 0.1);
+    col = clamp((col - levels.x) / range, 0., 1.);
+    // and the exposure: a gamma that brings the median towards the middle
+    float median = clamp((levels.w - levels.x) / range, 0.05, 0.95);
+    return pow(col, vec3(clamp(log(.5) / log(median), .5, 2.)));
+}
+
 void main()
 {
     // image coordinates are:
@@ -15,7 +33,7 @@ void main()
         1. - gl_FragCoord.y / iResolution.y
     );
 
-    vec3 col = texture(iPixelData, image_coord).xyz;
+    vec3 col = autoLevels(texture(iPixelData, image_coord).xyz);
 
     out_color = vec4(clamp(col, c.yyy, c.xxx), 1.0);
 
@@ -1,7 +1,9 @@
 #version 330 core
-layout (location = 0) in vec3 pos;
 
+// no vertex buffer at all: one triangle from the vertex index, (-1,-1), (3,-1), (-1,3),
+// which covers the whole screen (the rest is clipped), and the fragment shaders only need gl_FragCoord
 void main()
 {
-   gl_Position = vec4(-pos, 1.0);
+   vec2 pos = vec2((gl_VertexID << 1) & 2, gl_VertexID & 2) * 2. - 1.;
+   gl_Position = vec4(pos, 0.0, 1.0);
 }
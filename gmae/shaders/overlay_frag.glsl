@@ -0,0 +1,13 @@
+#version 330 core
+out vec4 out_color;
+
+in vec2 glyph_uv;
+in vec4 glyph_color;
+
+uniform sampler2D iGlyphAtlas;
+
+void main()
+{
+    float coverage = texture(iGlyphAtlas, glyph_uv).r;
+    out_color = vec4(glyph_color.rgb, glyph_color.a * coverage);
+}
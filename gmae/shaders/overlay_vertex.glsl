@@ -0,0 +1,22 @@
+#version 330 core
+// in pixels, with (0, 0) at the TOP left, as one is used to for text
+layout (location = 0) in vec2 pos;
+layout (location = 1) in vec2 uv;
+layout (location = 2) in vec4 color;
+
+uniform vec2 iResolution;
+
+out vec2 glyph_uv;
+out vec4 glyph_color;
+
+void main()
+{
+    gl_Position = vec4(
+        2. * pos.x / iResolution.x - 1.,
+        1. - 2. * pos.y / iResolution.y,
+        0.,
+        1.
+    );
+    glyph_uv = uv;
+    glyph_color = color;
+}
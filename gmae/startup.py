@@ -0,0 +1,90 @@
+"""
+Startup orchestration: the slow things that don't need the GL context (device scan, opening the capture,
+the audio stream, and importing cv2 / sounddevice for these) run on background threads,
+while the main thread creates the window and compiles the shaders. GLFW wants the main thread anyway.
+
+Every phase is timed, and the report at the first frame tells where the startup time went.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, Future
+from contextlib import contextmanager
+from dataclasses import dataclass
+from threading import current_thread, Lock
+from time import perf_counter
+
+from gmae.utils import log
+
+BACKGROUND_WORKERS = 3
+TARGET_FIRST_FRAME_SEC = 1.
+
+
+@dataclass
+class PhaseTiming:
+    name: str
+    thread: str
+    started_sec: float
+    duration_sec: float = None
+
+
+class Startup:
+    def __init__(self):
+        self.started_at = perf_counter()
+        self.executor = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix="Startup")
+        self.phases = []
+        self.lock = Lock()
+        self.first_frame_sec = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, _val, _tb):
+        # don't wait for anything that didn't even start, but let the running ones finish
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def now(self):
+        return perf_counter() - self.started_at
+
+    @contextmanager
+    def phase(self, name):
+        timing = PhaseTiming(name, current_thread().name, self.now())
+        with self.lock:
+            self.phases.append(timing)
+        try:
+            yield timing
+        finally:
+            timing.duration_sec = self.now() - timing.started_sec
+            log(f"{name} took {timing.duration_sec:.3f}s")
+
+    def background(self, name, func, *args, **kwargs) -> Future:
+        def run_as_phase():
+            with self.phase(name):
+                return func(*args, **kwargs)
+        return self.executor.submit(run_as_phase)
+
+    def wait_for(self, name, future: Future):
+        # so the report shows how long the main thread had to idle for a background phase
+        with self.phase(f"(wait) {name}"):
+            return future.result()
+
+    def first_frame_done(self):
+        if self.first_frame_sec is not None:
+            return
+        self.first_frame_sec = self.now()
+        self.print_report()
+
+    def print_report(self):
+        print("== STARTUP " + "=" * 69)
+        print("phase".ljust(36) + "thread".ljust(20) + "start".rjust(12) + "duration".rjust(12))
+        for timing in sorted(self.phases, key=lambda t: t.started_sec):
+            duration = "running" if timing.duration_sec is None else f"{timing.duration_sec:.3f}s"
+            print(
+                timing.name.ljust(36)
+                + timing.thread.ljust(20)
+                + f"{timing.started_sec:.3f}s".rjust(12)
+                + duration.rjust(12)
+            )
+        if self.first_frame_sec is not None:
+            verdict = "ok" if self.first_frame_sec <= TARGET_FIRST_FRAME_SEC else "too slow"
+            print(f"First frame on screen after {self.first_frame_sec:.3f}s"
+                  f" (target {TARGET_FIRST_FRAME_SEC:.1f}s, {verdict})")
+        print("=" * 80)
@@ -4,7 +4,6 @@ from os import getenv
 from time import perf_counter
 from typing import Optional
 
-import cv2
 import glfw
 
 
@@ -33,9 +32,11 @@ class CaptureDeviceInfo:
     fps: float
     frame_count: float
     name: str = ""
+    index: Optional[int] = None
 
     @classmethod
-    def read_from(cls, capture, name="") -> Optional["CaptureDeviceInfo"]:
+    def read_from(cls, capture, name="", index=None) -> Optional["CaptureDeviceInfo"]:
+        import cv2
         if not capture.isOpened():
             return None
         return cls(
@@ -44,6 +45,7 @@ class CaptureDeviceInfo:
             capture.get(cv2.CAP_PROP_FPS),
             capture.get(cv2.CAP_PROP_FRAME_COUNT),
             name=name,
+            index=index,
         )
 
 
@@ -53,6 +55,17 @@ class UniformLocations:
     resolution: int
     time: Optional[int] = None
     effect_amount: dict = field(default_factory=dict)
+    use_lookup_textures: Optional[int] = None
+    lookup_samplers: dict = field(default_factory=dict)
+    history_sampler: Optional[int] = None
+    history_depth: Optional[int] = None
+    history_index: Optional[int] = None
+    use_auto_levels: Optional[int] = None
+    levels_sampler: Optional[int] = None
+    use_color_lut: Optional[int] = None
+    color_lut_sampler: Optional[int] = None
+    use_grading_lut: Optional[int] = None
+    grading_lut_sampler: Optional[int] = None
 
 
 @dataclass
@@ -75,6 +88,19 @@ class TitleInfo:
         glfw.set_window_title(window, self.full_title)
 
 
+def inject_defines(shader_source: str, defines: dict):
+    # the #version line has to stay first, so the #defines go right after it,
+    # and the #line keeps the line numbers in the compiler errors matching the file
+    if not defines:
+        return shader_source
+    version_line, rest = shader_source.split("\n", 1)
+    define_lines = "".join(
+        f"#define {name} {value}\n"
+        for name, value in defines.items()
+    )
+    return f"{version_line}\n{define_lines}#line 2\n{rest}"
+
+
 def env_means_true(name: str):
     return getenv(name, "").casefold() in ["true", "1", "on"]
 
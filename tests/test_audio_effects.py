@@ -0,0 +1,28 @@
+import numpy as np
+
+from gmae.audio_effects import AudioEffectsChain
+
+SAMPLERATE = 48000
+BLOCK = 512
+
+
+def test_tape_stop_fades_back_into_the_live_audio():
+    chain = AudioEffectsChain(SAMPLERATE, 1, max_block=BLOCK)
+    # 97 Hz sine, the largest step between two samples of it is about 0.013. the stopped tape holds
+    # a value close to 0, while the live audio is close to its trough when the tape stop ends
+    t = np.arange(3 * SAMPLERATE) / SAMPLERATE
+    signal = np.sin(2 * np.pi * 97 * t).astype(np.float32)[:, None]
+
+    result = np.zeros_like(signal)
+    for start in range(0, len(signal), BLOCK):
+        if start <= SAMPLERATE < start + BLOCK:
+            chain.params = chain.params.with_tape_stop(0.5)
+        block = signal[start:start + BLOCK]
+        result[start:start + len(block)] = chain.process(block)
+
+    stopped = SAMPLERATE // BLOCK * BLOCK
+    end = stopped + SAMPLERATE // 2
+    assert np.abs(result[stopped:end] - signal[stopped:end]).max() > 0.5
+    # no jump where the tape stop ends, and the live audio after it
+    assert np.abs(np.diff(result[stopped:end + SAMPLERATE // 10, 0])).max() < 0.05
+    np.testing.assert_allclose(result[end + BLOCK:], signal[end + BLOCK:])
@@ -0,0 +1,78 @@
+import time
+from threading import Event
+
+import numpy as np
+import pytest
+
+from gmae import capture_supervisor
+from gmae.capture_supervisor import CaptureSupervisor
+from gmae.utils import CaptureDeviceInfo
+
+WIDTH, HEIGHT = 32, 18
+
+
+class FakeCapture:
+    """
+    Like cv2.VideoCapture, but read() can hang (as a stalled device does) until release() is called.
+    """
+    def __init__(self, stall_after=None):
+        self.stall_after = stall_after
+        self.reads = 0
+        self.released = Event()
+
+    def isOpened(self):
+        return not self.released.is_set()
+
+    def get(self, _property):
+        # CaptureDeviceInfo.read_from() only asks for the size, the fps and the frame count
+        return {3: WIDTH, 4: HEIGHT, 5: 30.}.get(_property, 0)
+
+    def read(self):
+        self.reads += 1
+        if self.stall_after is not None and self.reads > self.stall_after:
+            self.released.wait()
+        if self.released.is_set():
+            return False, None
+        time.sleep(0.005)
+        return True, np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
+
+    def release(self):
+        self.released.set()
+
+
+def wait_for(condition, timeout_sec=5):
+    deadline = time.monotonic() + timeout_sec
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_stalled_capture_is_released_before_the_reopen(monkeypatch):
+    stalled = FakeCapture(stall_after=1)
+    reopened = FakeCapture()
+    released_at_reopen = []
+
+    def reopen_capture(index, capture_info):
+        released_at_reopen.append(stalled.released.is_set())
+        return reopened
+
+    monkeypatch.setattr(capture_supervisor, "reopen_capture", reopen_capture)
+    monkeypatch.setattr(capture_supervisor, "STUCK_READER_WAIT_SEC", 0.05)
+    info = CaptureDeviceInfo(WIDTH, HEIGHT, 30., 0, name="fake", index=0)
+    supervisor = CaptureSupervisor(stalled, info, index=0)
+    try:
+        wait_for(lambda: stalled.reads > 1)
+        _frame, fresh = supervisor.read(max_wait_sec=0)
+        assert fresh
+        # no frame for longer than the stall timeout, while the reader hangs in read()
+        supervisor.last_frame_at -= capture_supervisor.STALL_TIMEOUT_SEC + 1
+        supervisor.read(max_wait_sec=0)
+        assert supervisor.reconnecting
+
+        wait_for(lambda: supervisor.reconnects == 1)
+        assert released_at_reopen == [True]
+        wait_for(lambda: supervisor.read(max_wait_sec=0.1)[1])
+        assert not supervisor.is_stale
+    finally:
+        supervisor.release()
+    assert reopened.released.is_set()
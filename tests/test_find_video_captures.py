@@ -0,0 +1,44 @@
+from gmae.find_video_captures import enumerate_linux_video_devices, find_capture_device_name_with_index_linux
+
+
+def make_video_node(sys_root, number, name, index, usb_port):
+    # what the kernel has for every /dev/videoN, index 1 being the metadata node of the same device
+    device = sys_root / "devices" / "pci0000:00" / "usb1" / usb_port
+    device.mkdir(parents=True, exist_ok=True)
+    entry = sys_root / "class" / "video4linux" / f"video{number}"
+    entry.mkdir(parents=True)
+    (entry / "name").write_text(name + "\n")
+    (entry / "index").write_text(f"{index}\n")
+    (entry / "device").symlink_to(device)
+
+
+def fake_tree(tmp_path):
+    sys_root = tmp_path / "sys"
+    make_video_node(sys_root, 0, "Integrated Camera: Integrated C", 0, "1-5:1.0")
+    make_video_node(sys_root, 1, "Integrated Camera: Integrated C", 1, "1-5:1.0")
+    make_video_node(sys_root, 2, "UGREEN 25854: UGREEN 25854", 0, "1-2:1.0")
+    make_video_node(sys_root, 3, "UGREEN 25854: UGREEN 25854", 1, "1-2:1.0")
+    # no device nodes there, so nothing gets opened and the sysfs attributes have to do
+    return sys_root / "class" / "video4linux", tmp_path / "dev"
+
+
+def test_enumerate_tells_capture_from_metadata_nodes(tmp_path):
+    sysfs_root, dev_root = fake_tree(tmp_path)
+    devices = enumerate_linux_video_devices(sysfs_root, dev_root)
+    assert [device.index for device in devices] == [0, 1, 2, 3]
+    assert [device.can_capture for device in devices] == [True, False, True, False]
+    assert devices[2].path == str(dev_root / "video2")
+    assert devices[2].stable_id == devices[3].stable_id == "devices/pci0000:00/usb1/1-2:1.0"
+
+
+def test_finds_the_opencv_index_of_the_preferred_capture(tmp_path):
+    sysfs_root, dev_root = fake_tree(tmp_path)
+    assert find_capture_device_name_with_index_linux(sysfs_root, dev_root) == ("UGREEN 25854", 2)
+
+
+def test_single_capture_is_taken_even_if_integrated(tmp_path):
+    sys_root = tmp_path / "sys"
+    make_video_node(sys_root, 0, "Integrated Camera: Integrated C", 0, "1-5:1.0")
+    make_video_node(sys_root, 1, "Integrated Camera: Integrated C", 1, "1-5:1.0")
+    sysfs_root = sys_root / "class" / "video4linux"
+    assert find_capture_device_name_with_index_linux(sysfs_root, tmp_path / "dev") == ("Integrated Camera", 0)
@@ -0,0 +1,65 @@
+import pytest
+
+from gmae.processor_utils import EffectFlash, EffectId, EffectsState, MotionMode
+
+FRAME_SEC = 1 / 60
+
+
+def run_flash(flash, seconds):
+    # like Processor.setup_program does it, frame by frame
+    values = []
+    for _ in range(round(seconds / FRAME_SEC)):
+        flash.remaining_sec -= FRAME_SEC
+        values.append(flash.current_value)
+    return values
+
+
+@pytest.mark.parametrize("duration_sec", [0.5, 6, 40])
+def test_triggered_flash_is_visible_for_its_duration(duration_sec):
+    state = EffectsState.random()
+    state.trigger_flash(EffectId.B, duration_sec)
+    flash = state.next_flash[EffectId.B]
+    assert flash.current_value == pytest.approx(1)
+
+    # a frame short of the end, it's still there, and it only goes down
+    values = run_flash(flash, duration_sec - FRAME_SEC)
+    assert all(value > 0 for value in values)
+    assert values == sorted(values, reverse=True)
+    assert values[-1] < 0.01
+    assert not flash.is_over
+
+    values = run_flash(flash, 2 * FRAME_SEC)
+    assert values[-1] == 0
+    assert flash.is_over
+
+
+def test_motion_trigger_shows_the_flash_right_away():
+    state = EffectsState.random()
+    state.set_motion_mode(MotionMode.TRIGGER)
+    state.update_motion(0, now_sec=0)
+    id = state.update_motion(1, now_sec=1)
+    assert id is not None
+    flash = state.next_flash[id]
+    assert flash.current_value == pytest.approx(1)
+    assert all(value > 0 for value in run_flash(flash, flash.duration_sec - FRAME_SEC))
+
+
+def test_triggered_flash_survives_a_snapshot():
+    state = EffectsState.random()
+    state.trigger_flash(EffectId.C, 3)
+    state.next_flash[EffectId.C].remaining_sec = 1
+
+    restored = EffectsState()
+    restored.restore(state.snapshot())
+    flash = restored.next_flash[EffectId.C]
+    assert flash.triggered
+    assert flash.current_value == state.next_flash[EffectId.C].current_value
+
+
+def test_scheduled_flash_keeps_its_envelope():
+    flash = EffectFlash()
+    flash.remaining_sec = -1
+    assert flash.current_value == 0
+    assert not flash.is_over
+    flash.remaining_sec = -flash.duration_sec - 1
+    assert flash.is_over
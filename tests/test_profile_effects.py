@@ -0,0 +1,23 @@
+import pytest
+
+from gmae import profile_effects
+from gmae.profile_effects import EFFECT_DEFINES, EffectProfiler
+
+
+@pytest.fixture(params=[True, False], ids=["lookup", "analytic"])
+def profiler(request):
+    frames = [profile_effects.test_pattern(64, 36)]
+    try:
+        profiler = EffectProfiler(frames, use_lookup_textures=request.param)
+    except Exception as exc:
+        # needs a display (or some other way to a GL context)
+        pytest.skip(f"no GL context: {exc}")
+    with profiler:
+        yield profiler
+
+
+@pytest.mark.parametrize("effects", [set(EFFECT_DEFINES), set()], ids=["full", "base"])
+def test_measure_renders_the_real_shader(profiler, effects):
+    # PyOpenGL checks the errors after every call, so a bad sampler setup raises in the draw
+    milliseconds = profiler.measure(effects, 64, 36, frames=2)
+    assert milliseconds >= 0
@@ -0,0 +1,125 @@
+import json
+import socket
+import time
+from types import SimpleNamespace
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+from gmae.processor_utils import EffectId, EffectsState
+from gmae.remote import RemoteControl, MAX_PENDING_COMMANDS
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_listening(port, timeout_sec=5):
+    deadline = time.monotonic() + timeout_sec
+    while True:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.02)
+
+
+@pytest.fixture
+def remote():
+    port = free_port()
+    with RemoteControl("127.0.0.1", port) as remote:
+        wait_until_listening(port)
+        yield remote
+
+
+def request(remote, path, payload=None):
+    data = None if payload is None else json.dumps(payload).encode("utf-8")
+    url = f"http://127.0.0.1:{remote.port}{path}"
+    try:
+        with urlopen(Request(url, data=data), timeout=5) as response:
+            return response.status, json.loads(response.read())
+    except HTTPError as error:
+        return error.code, json.loads(error.read())
+
+
+def test_valid_command_gets_queued_and_applied(remote):
+    status, body = request(remote, "/command", {"command": "set_strength", "effect": "A", "value": 0.25})
+    assert status == 202
+    assert body["queued"]["value"] == 0.25
+
+    processor = SimpleNamespace(effects=EffectsState.random())
+    remote.apply_pending(processor)
+    assert processor.effects.strength[EffectId.A] == 0.25
+    assert not remote.commands
+
+
+def test_unknown_command_is_rejected(remote):
+    status, body = request(remote, "/command", {"command": "self_destruct"})
+    assert status == 400
+    assert "self_destruct" in body["error"]
+    assert not remote.commands
+
+
+@pytest.mark.parametrize("command", [
+    {"command": "set_strength", "effect": "A", "value": "loud"},
+    {"command": "set_strength", "effect": "A", "value": True},
+    {"command": "set_strength", "effect": "Z", "value": 0.5},
+    {"command": "trigger_flash", "effect": "B", "duration_sec": -1},
+    {"command": "trigger_flash", "effect": "B", "duration_sec": 1000},
+    {"command": "tape_stop", "duration_sec": "long"},
+    {"command": "set_motion_mode", "mode": 3},
+    {"command": "set_dry", "value": "false"},
+    {"command": "set_dry", "value": 0},
+    {"command": "set_dry", "value": None},
+    ["set_strength"],
+])
+def test_bad_types_are_rejected(remote, command):
+    status, _body = request(remote, "/command", command)
+    assert status == 400
+    assert not remote.commands
+
+
+def test_set_dry_takes_a_json_bool(remote):
+    status, _body = request(remote, "/command", {"command": "set_dry", "value": False})
+    assert status == 202
+
+    processor = SimpleNamespace(use_dry_program=True)
+    remote.apply_pending(processor)
+    assert processor.use_dry_program is False
+
+
+def test_full_queue_rejects_instead_of_dropping(remote):
+    command = {"command": "toggle_dry"}
+    for _ in range(MAX_PENDING_COMMANDS):
+        remote.commands.append(command)
+    status, _body = request(remote, "/command", {"command": "set_dry", "value": True})
+    assert status == 429
+    assert len(remote.commands) == MAX_PENDING_COMMANDS
+    assert remote.commands[0] is command
+    assert remote.summary()["rejected_commands"] == 1
+
+    remote.commands.clear()
+    status, _body = request(remote, "/command", {"command": "set_dry", "value": True})
+    assert status == 202
+
+
+def test_non_finite_values_are_rejected(remote):
+    # json.dumps() writes NaN, which is not strictly JSON but json.loads() takes it
+    status, _body = request(remote, "/command", {"command": "set_strength", "effect": "A", "value": float("nan")})
+    assert status == 400
+
+
+def test_state_returns_the_published_telemetry(remote):
+    status, body = request(remote, "/state")
+    assert status == 200
+    assert body == {}
+
+    remote.publish({"fps": 59.9, "dry": False})
+    status, body = request(remote, "/state")
+    assert status == 200
+    assert body == {"fps": 59.9, "dry": False}